@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Loading and summarizing the CardPoolAnalysis_*/GameAnalysis_* CSVs for the notebooks.
+# CSVs are read in chunks into small dtypes (categories for the rarity, cost and ability names, int8 for stats and
+# levels), and the result is cached as a Parquet file next to the CSV, so reloading a large simulation dump is a
+# single columnar read. Summaries over GameAnalysis_Results.csv can also be aggregated chunk by chunk straight from
+# the CSV without holding it all in memory. Win rate grids come from one groupby over the whole table instead of a
+# filter per (attack, health) cell.
+
+CHUNK_SIZE = 1000000
+
+RARITIES = ["Sacrifice", "Common", "Uncommon", "Rare"]
+BLOOD_COSTS = ["Zero", "One", "Two", "Three"]
+CATEGORIES = {
+    "Rarity": pd.CategoricalDtype(RARITIES, ordered=True),
+    "BloodCost": pd.CategoricalDtype(BLOOD_COSTS, ordered=True),
+}
+# Abilities are combinations like "Flying-Lethal", their categories come from the data
+OPEN_CATEGORIES = ["Abilities"]
+DTYPES = {
+    "Attack": "int8", "Health": "int8", "AbilitiesCount": "int8", "Level": "int8", "Pool": "int32",
+    "TotalGames": "int32", "WinRate": "float32", "PlayerWin": "int32", "EnemyWin": "int32", "Stalemate": "int32", "MaxTurnsReached": "int32",
+}
+RESULT_COUNTS = ["TotalGames", "PlayerWin", "EnemyWin", "Stalemate", "MaxTurnsReached"]
+
+
+def get_cache_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+def read_chunks(csv_path: str, chunk_size: int = CHUNK_SIZE):
+    # DataFrames of up to chunk_size rows with the compact dtypes. "None" is an ability, not a missing value.
+    columns = pd.read_csv(csv_path, skipinitialspace=True, nrows=0).columns
+    dtypes = { column: dtype for column, dtype in { **DTYPES, **CATEGORIES }.items() if column in columns }
+    for column in OPEN_CATEGORIES:
+        if column in columns:
+            dtypes[column] = "category"
+    yield from pd.read_csv(csv_path, skipinitialspace=True, dtype=dtypes, keep_default_na=False, na_values=[""], chunksize=chunk_size)
+
+
+def load_csv(csv_path: str, chunk_size: int = CHUNK_SIZE, cache=True) -> pd.DataFrame:
+    # The cached Parquet file is used while it's newer than the CSV
+    cache_path = get_cache_path(csv_path)
+    if cache and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(csv_path):
+        return pd.read_parquet(cache_path)
+
+    chunks = list(read_chunks(csv_path, chunk_size))
+    df = concat_chunks(chunks) if chunks else pd.read_csv(csv_path, skipinitialspace=True)
+    if cache:
+        try:
+            df.to_parquet(cache_path, index=False)
+        except ImportError:
+            # Parquet needs pyarrow (see requirements.txt), loading still works without the cache
+            pass
+    return df
+
+
+def concat_chunks(chunks: list[pd.DataFrame]) -> pd.DataFrame:
+    # Chunks can find different ability combinations, union the categories so the columns stay categorical
+    for column in OPEN_CATEGORIES:
+        if column in chunks[0].columns:
+            categories = sorted(set().union(*(chunk[column].cat.categories for chunk in chunks)))
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def summarize_results(source, by: list[str] = None, chunk_size: int = CHUNK_SIZE) -> pd.DataFrame:
+    # Summed result counts and mean WinRate of GameAnalysis_Results.csv per group (Pool and Level by default, like
+    # the notebook's cardpool_level_summary). source is a DataFrame or a CSV path, which is aggregated a chunk at a time.
+    by = by or ["Pool", "Level"]
+    chunks = [ source ] if isinstance(source, pd.DataFrame) else read_chunks(source, chunk_size)
+    partials = []
+    for chunk in chunks:
+        grouped = chunk.groupby(by, observed=True)
+        partial = grouped[RESULT_COUNTS].sum()
+        partial["WinRateSum"] = grouped["WinRate"].sum()
+        partial["Games"] = grouped.size()
+        partials.append(partial)
+
+    summary = pd.concat(partials).groupby(level=by).sum()
+    summary["WinRate"] = summary.pop("WinRateSum") / summary.pop("Games")
+    return summary[["TotalGames", "WinRate"] + RESULT_COUNTS[1:]]
+
+
+def factor_matches(df: pd.DataFrame, factor: str, values: list[str]) -> pd.DataFrame:
+    # Boolean column per value, True where the factor contains it (case insensitive, so "Lethal" matches
+    # "Flying-Lethal"). Categorical factors are only matched once per category.
+    column = df[factor]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories.astype(str)
+        # Missing values have code -1, which picks the False appended after the categories
+        codes = column.cat.codes.to_numpy()
+        return pd.DataFrame({ value: np.append(categories.str.contains(value, case=False, regex=False), False)[codes] for value in values }, index=df.index)
+    column = column.astype(str)
+    return pd.DataFrame({ value: column.str.contains(value, case=False, regex=False, na=False) for value in values }, index=df.index)
+
+
+def win_rate_grids(df: pd.DataFrame, factor: str, values: list[str]) -> dict[str, pd.DataFrame]:
+    # {value: (attack x health) DataFrame of (win rate, played count)} for the card performance CSVs, from one
+    # groupby over every (value, attack, health). Cells with no cards played are NaN with a count of 0.
+    matches = factor_matches(df, factor, values)
+    rows, value_index = np.nonzero(matches.to_numpy())
+    long = pd.DataFrame({
+        factor: pd.Categorical.from_codes(value_index, categories=values),
+        "Attack": df["Attack"].to_numpy()[rows],
+        "Health": df["Health"].to_numpy()[rows],
+        "Played": df["Played Count"].to_numpy()[rows],
+        "Win": df["Win Count"].to_numpy()[rows],
+    })
+    totals = long.groupby([factor, "Attack", "Health"], observed=False)[["Played", "Win"]].sum()
+
+    attack = pd.Index(range(0, int(df["Attack"].max()) + 1), name="Attack")
+    health = pd.Index(range(0, int(df["Health"].max()) + 1), name="Health")
+    grids = {}
+    for value in values:
+        cells = totals.xs(value, level=factor) if value in totals.index.get_level_values(0) else totals.iloc[:0]
+        played = cells["Played"].unstack("Health").reindex(index=attack, columns=health, fill_value=0).fillna(0).astype("int64")
+        win = cells["Win"].unstack("Health").reindex(index=attack, columns=health, fill_value=0).fillna(0).astype("int64")
+        grids[value] = pd.concat({ "WinRate": (win / played.where(played > 0)), "Played": played }, axis=1)
+    return grids
+
+
+def factor_summary(df: pd.DataFrame, factor: str) -> pd.DataFrame:
+    # Played, won and lost counts with the win rate per value of the factor, in one groupby
+    summary = df.groupby(factor, observed=True)[["Played Count", "Win Count", "Lose Count"]].sum()
+    summary["Win Rate"] = summary["Win Count"] / summary["Played Count"]
+    return summary
@@ -0,0 +1,242 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from avatar_rescaler import AVATAR_SIZE
+from card_database import CardDatabase
+from data_store import atomic_write
+
+# Checks the avatar sprites against the deck data. Every PNG in the avatar and raw directories is recorded in a
+# manifest with its size, mtime, content hash and whether it decodes, so later runs only re-read files whose size or
+# mtime changed. Images are read and validated on a thread pool (hashing and PNG decoding release the GIL).
+# The leading dot keeps Godot from importing the manifest.
+
+MANIFEST_FILENAME = ".verify.json"
+RAW_PREFIX = "raw/"
+
+
+def load_manifest(avatar_dir: str) -> dict:
+    manifest_path = os.path.join(avatar_dir, MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r") as file:
+            return json.loads(file.read())
+    except json.JSONDecodeError:
+        return {}
+
+
+def save_manifest(avatar_dir: str, manifest: dict) -> None:
+    # Written without indentation so the C encoder is used, it has an entry per sprite
+    atomic_write(os.path.join(avatar_dir, MANIFEST_FILENAME), json.dumps(manifest, sort_keys=True))
+
+
+def list_files(directory: str, prefix: str = "") -> tuple[dict[str, os.stat_result], list[str]]:
+    # (manifest key -> stat for every PNG, names of Godot .import files)
+    images = {}
+    imports = []
+    if not os.path.isdir(directory):
+        return images, imports
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".png"):
+                images[prefix + entry.name] = entry.stat()
+            elif entry.name.endswith(".png.import"):
+                imports.append(prefix + entry.name)
+    return images, imports
+
+
+def check_image(path: str) -> dict:
+    from PIL import Image
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    record = { "hash": hashlib.sha256(data).hexdigest() }
+    if not data:
+        record["error"] = "empty file"
+        return record
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            record["width"], record["height"] = img.size
+            img.verify()
+    except Exception as e:
+        record["error"] = f"unreadable ({type(e).__name__}: {e})"
+    return record
+
+
+def update_manifest(manifest: dict, files: dict[str, os.stat_result], avatar_dir: str, workers: int = None, full=False) -> tuple[int, int]:
+    # Re-reads new and changed files, drops deleted ones. Returns (files read, records removed).
+    removed = [ key for key in manifest if key not in files ]
+    for key in removed:
+        del manifest[key]
+
+    changed = []
+    for key, stat in files.items():
+        record = manifest.get(key)
+        if full or record is None or record["size"] != stat.st_size or record["mtime_ns"] != stat.st_mtime_ns:
+            changed.append(key)
+
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 2)) as executor:
+        paths = [ os.path.join(avatar_dir, key) for key in changed ]
+        for key, record in zip(changed, executor.map(check_image, paths)):
+            stat = files[key]
+            manifest[key] = dict(record, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    return len(changed), len(removed)
+
+
+def find_duplicate_files(manifest: dict, prefix: str) -> list[list[str]]:
+    by_hash = {}
+    for key, record in manifest.items():
+        if key.startswith(RAW_PREFIX) == (prefix == RAW_PREFIX) and record["size"]:
+            by_hash.setdefault(record["hash"], []).append(key)
+    return sorted(sorted(keys) for keys in by_hash.values() if len(keys) > 1)
+
+
+def verify(db: CardDatabase, avatar_dir: str, godot_avatar_dir: str, raw_dir: str = None, workers: int = None, full=False, avatar_size=AVATAR_SIZE) -> dict:
+    # raw_dir is expected to be inside avatar_dir (../assets/sprites/avatars/raw/)
+    start = time.time()
+    raw_dir = raw_dir or os.path.join(avatar_dir, RAW_PREFIX)
+    avatar_files, avatar_imports = list_files(avatar_dir)
+    raw_files, _ = list_files(raw_dir, RAW_PREFIX)
+
+    manifest = load_manifest(avatar_dir)
+    files = dict(avatar_files)
+    files.update(raw_files)
+    read, removed = update_manifest(manifest, files, avatar_dir, workers, full)
+    if read or removed:
+        save_manifest(avatar_dir, manifest)
+
+    report = {
+        # Deck data
+        "duplicate_entries": [],
+        "missing_files": [],
+        "unreferenced_avatars": [],
+        # Files
+        "invalid_files": [],
+        "wrong_size": [],
+        "duplicate_avatars": find_duplicate_files(manifest, ""),
+        "duplicate_raw": find_duplicate_files(manifest, RAW_PREFIX),
+        "raw_without_avatar": [],
+        "avatar_without_raw": [],
+        "orphan_imports": [],
+    }
+
+    referenced = {}
+    for noun, info in db.nouns.items():
+        seen = set()
+        for avatar in info.get("avatars") or []:
+            if avatar in seen:
+                report["duplicate_entries"].append((noun, avatar))
+            seen.add(avatar)
+            referenced.setdefault(avatar, []).append(noun)
+            if not avatar.startswith(godot_avatar_dir) or avatar[len(godot_avatar_dir):] not in avatar_files:
+                report["missing_files"].append((noun, avatar))
+    for avatar, nouns in referenced.items():
+        if len(set(nouns)) > 1:
+            report["duplicate_entries"].append((", ".join(sorted(set(nouns))), avatar))
+
+    for key in sorted(files):
+        record = manifest[key]
+        if "error" in record:
+            report["invalid_files"].append((key, record["error"]))
+        elif not key.startswith(RAW_PREFIX) and (record["width"], record["height"]) != tuple(avatar_size):
+            report["wrong_size"].append((key, f"{record['width']}x{record['height']}"))
+
+    for filename in sorted(avatar_files):
+        if godot_avatar_dir + filename not in referenced:
+            report["unreferenced_avatars"].append(filename)
+        # Avatars are named after their raw image, see avatar_rescaler.get_avatar_path
+        if raw_files and filename.startswith("avatar_") and RAW_PREFIX + filename[len("avatar_"):] not in raw_files:
+            report["avatar_without_raw"].append(filename)
+    for key in sorted(raw_files):
+        if "avatar_" + key[len(RAW_PREFIX):] not in avatar_files:
+            report["raw_without_avatar"].append(key)
+    report["orphan_imports"] = sorted(name for name in avatar_imports if name[:-len(".import")] not in avatar_files)
+
+    report["stats"] = { "avatars": len(avatar_files), "raw": len(raw_files), "read": read, "seconds": time.time() - start }
+    return report
+
+
+def print_report(report: dict, limit: int = 20) -> int:
+    # Returns the number of problems found. Only the first limit items of each kind are listed (None for all).
+    sections = [
+        ("duplicate_entries", "Avatars listed more than once in the deck data", lambda item: f"{item[0]}: {item[1]}"),
+        ("missing_files", "Deck avatars with no file (`deck_generator.py clean` removes them)", lambda item: f"{item[0]}: {item[1]}"),
+        ("invalid_files", "Empty or unreadable images", lambda item: f"{item[0]}: {item[1]}"),
+        ("wrong_size", "Avatars that aren't the avatar size", lambda item: f"{item[0]}: {item[1]}"),
+        ("duplicate_avatars", "Byte-identical avatars", ", ".join),
+        ("duplicate_raw", "Byte-identical raw images", ", ".join),
+        ("unreferenced_avatars", "Avatars not used by any deck noun", str),
+        ("raw_without_avatar", "Raw images with no processed avatar (`deck_generator.py rescale` makes them)", str),
+        ("avatar_without_raw", "Avatars with no raw image", str),
+        ("orphan_imports", "Godot .import files for missing images", str),
+    ]
+
+    problems = 0
+    for key, title, format_item in sections:
+        items = report[key]
+        if not items:
+            continue
+        problems += len(items)
+        print(f"{title}: {len(items)}")
+        for item in items[:limit]:
+            print(f"   {format_item(item)}")
+        if limit is not None and len(items) > limit:
+            print(f"   ... and {len(items) - limit} more")
+
+    stats = report["stats"]
+    print(f"Checked {stats['avatars']} avatars and {stats['raw']} raw images in {stats['seconds']:.2f} seconds "
+          f"({stats['read']} read, the rest unchanged since the last check): {problems or 'no'} problems found")
+    return problems
+
+
+def benchmark(count: int, workers: int = None) -> None:
+    from PIL import Image
+    from card_database import generate_synthetic_data
+
+    print(f"Benchmarking verify with {count} avatars and {count} raw images")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        godot_dir = "res://assets/sprites/avatars/"
+        raw_dir = os.path.join(tmp_dir, "raw")
+        os.makedirs(raw_dir)
+        db = CardDatabase(None, generate_synthetic_data(count // 4, 0, avatars_per_noun=4))
+
+        avatars = [ avatar for noun in db.nouns for avatar in db.avatars(noun) ]
+        for i, avatar in enumerate(avatars):
+            filename = avatar[len(godot_dir):]
+            # Unique pixels per image, so the duplicate check has nothing to report
+            color = (i & 255, (i >> 8) & 255, (i >> 16) & 255)
+            Image.new("RGB", AVATAR_SIZE, color).save(os.path.join(tmp_dir, filename))
+            Image.new("RGB", (128, 128), color).save(os.path.join(raw_dir, filename[len("avatar_"):]))
+
+        def timed(label: str, **kwargs):
+            report = verify(db, tmp_dir, godot_dir, workers=workers, **kwargs)
+            stats = report["stats"]
+            print(f"   {label}: {stats['seconds']:.2f} seconds, {stats['read']} files read")
+
+        timed("First run (every file read)")
+        timed("Second run (nothing changed)")
+        touched = sorted(os.listdir(raw_dir))[:count // 100]
+        for filename in touched:
+            os.utime(os.path.join(raw_dir, filename), ns=(0, 0))
+        timed(f"After touching {len(touched)} raw images")
+        timed("--full (every file read again)", full=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the avatar verifier on synthetic sprites.")
+    parser.add_argument("--sprites", type=int, default=20000, help="Number of synthetic avatars (and as many raw images).")
+    parser.add_argument("--workers", type=int, default=None, help="Threads reading images.")
+    args = parser.parse_args()
+
+    benchmark(args.sprites, args.workers)
@@ -0,0 +1,201 @@
+import json
+import os
+import time
+
+from avatar_rescaler import AVATAR_SIZE, hash_file
+from card_database import CardDatabase
+from data_store import atomic_write
+
+# Packs the 90x60 avatars into a few large atlas PNGs, so the game can load a handful of textures instead of one
+# resource per avatar. Avatars sit on a fixed grid and keep their slot between runs: new avatars fill the slots freed
+# by removed ones (lowest first, in noun order), so adding avatars only rewrites the atlas pages that changed. Packing
+# is deterministic, and a repack from scratch always lays the avatars out in noun order.
+#
+# The index (avatars.atlas.json) maps each noun to the atlas and rect of each of its avatars, e.g.
+#    "Cat": [ { "avatar": "res://.../avatar_cat_0.png", "atlas": "res://.../atlas/avatars_0.png", "rect": [1, 1, 90, 60] } ]
+
+INDEX_FILENAME = "avatars.atlas.json"
+# Slots and file hashes from the last run, kept out of the index the game loads. The leading dot keeps Godot from
+# importing it.
+STATE_FILENAME = ".atlas.json"
+ATLAS_SIZE = (2048, 2048)
+# Gap between avatars so texture filtering doesn't bleed neighbours into each other
+PADDING = 1
+
+
+def get_atlas_filename(page: int) -> str:
+    return f"avatars_{page}.png"
+
+
+def get_layout(atlas_size: tuple[int, int], cell_size: tuple[int, int], padding: int) -> tuple[int, int]:
+    # (columns, rows) per atlas
+    columns = (atlas_size[0] - padding) // (cell_size[0] + padding)
+    rows = (atlas_size[1] - padding) // (cell_size[1] + padding)
+    if columns < 1 or rows < 1:
+        raise ValueError(f"An atlas of {atlas_size[0]}x{atlas_size[1]} can't fit a {cell_size[0]}x{cell_size[1]} avatar")
+    return columns, rows
+
+
+def get_rect(slot: int, columns: int, rows: int, cell_size: tuple[int, int], padding: int) -> tuple[int, list[int]]:
+    # (atlas page, [x, y, width, height])
+    page, index = divmod(slot, columns * rows)
+    row, column = divmod(index, columns)
+    return page, [ padding + column * (cell_size[0] + padding), padding + row * (cell_size[1] + padding), cell_size[0], cell_size[1] ]
+
+
+def load_state(atlas_dir: str) -> dict:
+    state_path = os.path.join(atlas_dir, STATE_FILENAME)
+    if not os.path.isfile(state_path):
+        return {}
+    with open(state_path, "r") as file:
+        return json.loads(file.read())
+
+
+def assign_slots(avatars: list[str], previous: dict[str, int]) -> dict[str, int]:
+    # Avatars already packed keep their slot, new ones take the lowest free slots in order
+    slots = { avatar: previous[avatar] for avatar in avatars if avatar in previous }
+    used = set(slots.values())
+    free = 0
+    for avatar in avatars:
+        if avatar in slots:
+            continue
+        while free in used:
+            free += 1
+        slots[avatar] = free
+        used.add(free)
+    return slots
+
+
+def render_page(page_slots: dict[str, int], files: dict[str, str], layout: tuple[int, int], cell_size: tuple[int, int], padding: int, atlas_size: tuple[int, int]):
+    from PIL import Image
+
+    rects = { avatar: get_rect(slot, *layout, cell_size, padding)[1] for avatar, slot in page_slots.items() }
+    images = {}
+    for avatar in rects:
+        with Image.open(files[avatar]) as img:
+            images[avatar] = img.copy()
+
+    # Generated avatars are RGB, which packs about 12% smaller than RGBA. Padding is transparent if any avatar has alpha.
+    mode = "RGBA" if any(img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info for img in images.values()) else "RGB"
+    # Pages are trimmed to their last used row, so a partly filled page stays small
+    height = max(rect[1] + rect[3] for rect in rects.values()) + padding
+    atlas = Image.new(mode, (atlas_size[0], height), 0)
+    for avatar, rect in rects.items():
+        atlas.paste(images[avatar].convert(mode), (rect[0], rect[1]))
+    return atlas
+
+
+def pack_atlases(db: CardDatabase, avatar_dir: str, godot_avatar_dir: str, atlas_dir: str, godot_atlas_dir: str, atlas_size=ATLAS_SIZE, cell_size=AVATAR_SIZE, padding: int = PADDING, repack=False) -> dict:
+    from PIL import Image
+
+    start = time.time()
+    os.makedirs(atlas_dir, exist_ok=True)
+    settings = { "atlas_size": list(atlas_size), "cell_size": list(cell_size), "padding": padding }
+    state = load_state(atlas_dir)
+    if repack or state.get("settings") != settings:
+        state = {}
+    previous = state.get("avatars", {})
+
+    # Every avatar the deck uses, in noun order, once each. Files unchanged since the last run aren't opened again.
+    avatars = []
+    files = {}
+    stats = {}
+    skipped = []
+    for noun in sorted(db.nouns):
+        for avatar in db.avatars(noun):
+            if avatar in files or avatar in skipped:
+                continue
+            path = os.path.join(avatar_dir, avatar[len(godot_avatar_dir):]) if avatar.startswith(godot_avatar_dir) else None
+            if path is None or not os.path.isfile(path):
+                skipped.append(avatar)
+                continue
+            stat = os.stat(path)
+            record = previous.get(avatar)
+            if not record or record["size"] != stat.st_size or record["mtime_ns"] != stat.st_mtime_ns:
+                with Image.open(path) as img:
+                    if img.size != tuple(cell_size):
+                        skipped.append(avatar)
+                        continue
+            avatars.append(avatar)
+            files[avatar] = path
+            stats[avatar] = stat
+
+    layout = get_layout(atlas_size, cell_size, padding)
+    slots = assign_slots(avatars, { avatar: entry["slot"] for avatar, entry in previous.items() })
+    pages = { avatar: get_rect(slot, *layout, cell_size, padding)[0] for avatar, slot in slots.items() }
+
+    # A page is rewritten if any avatar on it was added, moved, removed or changed
+    records = {}
+    dirty = set()
+    for avatar, slot in slots.items():
+        stat = stats[avatar]
+        record = previous.get(avatar)
+        if record and record["slot"] == slot and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+            records[avatar] = record
+            continue
+        file_hash = hash_file(files[avatar])
+        if not record or record["slot"] != slot or record["hash"] != file_hash:
+            dirty.add(pages[avatar])
+        records[avatar] = { "slot": slot, "hash": file_hash, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns }
+    for avatar, record in previous.items():
+        if avatar not in slots:
+            dirty.add(get_rect(record["slot"], *layout, cell_size, padding)[0])
+
+    page_count = max(pages.values()) + 1 if pages else 0
+    for page in range(page_count):
+        if not os.path.isfile(os.path.join(atlas_dir, get_atlas_filename(page))):
+            dirty.add(page)
+
+    rewritten = []
+    for page in sorted(dirty):
+        if page >= page_count:
+            continue
+        path = os.path.join(atlas_dir, get_atlas_filename(page))
+        page_slots = { avatar: slots[avatar] for avatar in slots if pages[avatar] == page }
+        if page_slots:
+            render_page(page_slots, files, layout, cell_size, padding, atlas_size).save(path)
+            rewritten.append(path)
+
+    # Pages past the last one, left by removed avatars or an earlier layout
+    current = { get_atlas_filename(page) for page in range(page_count) }
+    for filename in os.listdir(atlas_dir):
+        if filename.startswith("avatars_") and filename.endswith(".png") and filename not in current:
+            os.remove(os.path.join(atlas_dir, filename))
+
+    nouns = {}
+    for noun in sorted(db.nouns):
+        entries = []
+        for avatar in db.avatars(noun):
+            if avatar in slots and not any(entry["avatar"] == avatar for entry in entries):
+                page, rect = get_rect(slots[avatar], *layout, cell_size, padding)
+                entries.append({ "avatar": avatar, "atlas": godot_atlas_dir + get_atlas_filename(page), "rect": rect })
+        if entries:
+            nouns[noun] = entries
+
+    index = { "atlases": [ godot_atlas_dir + get_atlas_filename(page) for page in range(page_count) ], "nouns": nouns }
+    atomic_write(os.path.join(atlas_dir, INDEX_FILENAME), json.dumps(index, indent=3))
+    atomic_write(os.path.join(atlas_dir, STATE_FILENAME), json.dumps({ "settings": settings, "avatars": records }, sort_keys=True))
+
+    atlas_paths = [ os.path.join(atlas_dir, get_atlas_filename(page)) for page in range(page_count) ]
+    return {
+        "avatars": len(slots),
+        "pages": page_count,
+        "rewritten": rewritten,
+        "skipped": skipped,
+        "avatar_bytes": sum(os.path.getsize(path) for path in files.values()),
+        "atlas_bytes": sum(os.path.getsize(path) for path in atlas_paths) + os.path.getsize(os.path.join(atlas_dir, INDEX_FILENAME)),
+        "seconds": time.time() - start,
+    }
+
+
+def print_report(report: dict) -> None:
+    if report["skipped"]:
+        print(f"Skipped {len(report['skipped'])} avatars that are missing or not the avatar size (see `deck_generator.py verify`)")
+    print(f"Packed {report['avatars']} avatars into {report['pages']} atlases in {report['seconds']:.2f} seconds ({len(report['rewritten'])} rewritten)")
+    for path in report["rewritten"]:
+        print(f"   Saved {path}")
+
+    saved = report["avatar_bytes"] - report["atlas_bytes"]
+    print(f"Loading avatars reads {report['pages'] + 1} files ({report['atlas_bytes'] / 1024:.0f} KB with the index) instead of "
+          f"{report['avatars']} files ({report['avatar_bytes'] / 1024:.0f} KB): {report['avatars'] - report['pages'] - 1} fewer files, "
+          f"{abs(saved) / 1024:.0f} KB {'less' if saved >= 0 else 'more'}")
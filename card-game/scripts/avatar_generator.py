@@ -1,19 +1,28 @@
 from dotenv import load_dotenv
-from openai import OpenAI, RateLimitError
 from PIL import Image
 import argparse
 import os
 import base64
 import time
+import request_cache
 
 ###
 # THIS SCRIPT IS DEPRECATED
 # Use avatar_generator_local.py instead to use the local model.
 ###
 
-load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+_client = None
+
+MAX_RETRIES = 5
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        load_dotenv()
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
 
 
 def get_unique_path(path: str) -> str:
@@ -45,29 +54,20 @@ def generate_image(prompt: str, output_dir: str, filename: str, n: int = 4) -> l
     if not filename.endswith(".png"):
         filename = filename + ".png"
 
-    RETRY_COUNT = 3
-    retry = 0
-    while retry < RETRY_COUNT:
-        try:
-            response = client.images.generate(
-                model="dall-e-2",
-                prompt=prompt,
-                response_format="b64_json",
-                size="256x256",
-                n=n,
-            )
-            break
-        except RateLimitError as e:
-            print("Rate Limit Exceeded! Waiting 60 seconds and then trying again.")
-            retry += 1
-            if retry >= RETRY_COUNT:
-                raise e
-            time.sleep(60)
-
+    params = {
+        "model": "dall-e-2",
+        "prompt": prompt,
+        "response_format": "b64_json",
+        "size": "256x256",
+        "n": n,
+    }
+    response, cached = request_cache.cached_request("images.generate", params, lambda: create_image_with_retries(params))
+    if cached:
+        print("Using cached images for this prompt")
 
     image_paths = []
-    for img_data in response.data:
-        b64_str = img_data.b64_json
+    for img_data in response["data"]:
+        b64_str = img_data["b64_json"]
         image_data = base64.b64decode(b64_str)
 
         image_path = get_unique_path(os.path.join(output_dir, filename))
@@ -80,6 +80,20 @@ def generate_image(prompt: str, output_dir: str, filename: str, n: int = 4) -> l
     return image_paths
 
 
+def create_image_with_retries(params: dict) -> dict:
+    from openai import RateLimitError
+
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return get_client().images.generate(**params).model_dump()
+        except RateLimitError as e:
+            if attempt == MAX_RETRIES:
+                raise e
+            seconds = request_cache.get_retry_seconds(e, attempt)
+            print(f"Rate Limit Exceeded! Waiting {seconds:.1f} seconds and then trying again.")
+            time.sleep(seconds)
+
+
 def format_image(image_path: str, output_dir: str) -> str:
     rescale_size = (60, 60)
     avatar_size = (90, 60)
@@ -104,10 +118,12 @@ def format_image(image_path: str, output_dir: str) -> str:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate card game avatars")
     parser.add_argument("creature", type=str)
+    parser.add_argument("--cache", choices=request_cache.MODES, default=request_cache.MODE, help="How to use the request cache. (offline replays cached images without calling the API)")
     args = parser.parse_args()
 
+    request_cache.MODE = args.cache
     raw_img_dir = "../assets/sprites/avatars/raw"
     avatar_img_dir = "../assets/sprites/avatars"
-    img_paths = generate_pixel_art_avatar(args.creature)
+    img_paths = generate_pixel_art_avatar(args.creature, raw_img_dir)
     for img_path in img_paths:
         format_image(img_path, avatar_img_dir)
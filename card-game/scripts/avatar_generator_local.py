@@ -1,32 +1,48 @@
 import argparse
 import os
-import torch
-from PIL import Image
-from diffusers import StableDiffusionXLPipeline, EulerDiscreteScheduler
-from huggingface_hub import hf_hub_download
-from pixel_scaler import scale_image
+import weakref
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+from avatar_rescaler import AVATAR_SIZE, get_avatar_path
+import tracing
+
+# torch, diffusers and huggingface_hub take seconds to import, so they are only imported by the functions that
+# run the pipeline. Clients of a running avatar_server never load them, and deck_generator can import this module
+# for its settings without paying for them either.
+if TYPE_CHECKING:
+    from diffusers import StableDiffusionXLPipeline
 
 prompt_path = "./avatar.prompt.txt"
 negative_prompt_path = "./avatar.negative.prompt.txt"
 
-parser = argparse.ArgumentParser(description="Generate card game avatars")
-parser.add_argument("creature", type=str)
-args = parser.parse_args()
+# Images per pipeline call. Batches are halved automatically if the GPU runs out of memory.
+MAX_BATCH_SIZE = 4
 
+# Text encoder outputs for recent prompts of each pipeline, so each creature's prompt is only encoded once
+PROMPT_CACHE_SIZE = 16
+_prompt_embeds_cache = weakref.WeakKeyDictionary()
 
-def generate_pixel_art_avatar(creature: str, output_dir: str, pipeline: StableDiffusionXLPipeline = None, n: int = 4) -> list[str]:
-    filename = format_name_for_filepath(creature)
+
+def generate_pixel_art_avatar(creature: str, output_dir: str, pipeline: "StableDiffusionXLPipeline" = None, n: int = 4, on_image=None, max_batch_size: int = MAX_BATCH_SIZE) -> list[str]:
+    return generate_pixel_art_avatars({ creature: n }, output_dir, pipeline, on_image=(lambda _, img_path: on_image(img_path)) if on_image else None, max_batch_size=max_batch_size)[creature]
+
+
+def generate_pixel_art_avatars(creatures: dict[str, int], output_dir: str, pipeline: "StableDiffusionXLPipeline" = None, on_image=None, max_batch_size: int = MAX_BATCH_SIZE) -> dict[str, list[str]]:
+    # Generates n images for each creature, sharing pipeline calls between creatures. on_image is called with (creature, image path).
     with open(prompt_path, "r") as file:
         prompt = file.read()
-    prompt = prompt.replace("{name}", creature)
-    
+
     with open(negative_prompt_path, "r") as file:
         negative_prompt = file.read()
 
     if pipeline is None:
         pipeline = initialize_diffusion_pipeline()
 
-    return generate_image(prompt, negative_prompt, output_dir, filename, pipeline, n)
+    creature_names = list(creatures.keys())
+    requests = [ (prompt.replace("{name}", creature), negative_prompt, format_name_for_filepath(creature), n) for creature, n in creatures.items() ]
+    image_paths = generate_images(requests, output_dir, pipeline, max_batch_size, (lambda i, img_path: on_image(creature_names[i], img_path)) if on_image else None)
+    return dict(zip(creature_names, image_paths))
 
 
 def get_unique_path(path: str) -> str:
@@ -45,7 +61,31 @@ def format_name_for_filepath(name: str) -> str:
     return filename + ".png"
 
 
-def initialize_diffusion_pipeline() -> StableDiffusionXLPipeline:
+@tracing.traced("pipeline init")
+def initialize_diffusion_pipeline(fused_path: str = None) -> "StableDiffusionXLPipeline":
+    # fused_path is a directory for a saved copy of the pipeline with the LoRAs already fused.
+    # It is written on the first run and loaded directly afterwards, which skips the LoRA download and fuse.
+    import torch
+    from diffusers import StableDiffusionXLPipeline, EulerDiscreteScheduler
+
+    if fused_path and os.path.isdir(fused_path):
+        pipe = StableDiffusionXLPipeline.from_pretrained(fused_path, torch_dtype=torch.float16)
+    else:
+        pipe = fuse_diffusion_pipeline()
+        if fused_path:
+            save_fused_pipeline(pipe, fused_path)
+
+    # Ensure sampler uses "trailing" timesteps
+    pipe.scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+    pipe.enable_model_cpu_offload()
+    return pipe
+
+
+def fuse_diffusion_pipeline() -> "StableDiffusionXLPipeline":
+    import torch
+    from diffusers import StableDiffusionXLPipeline
+    from huggingface_hub import hf_hub_download
+
     base = "stabilityai/stable-diffusion-xl-base-1.0"
     lightning_lora = "ByteDance/SDXL-Lightning"
     lightning_4step_checkpoint = "sdxl_lightning_4step_lora.safetensors"
@@ -58,46 +98,108 @@ def initialize_diffusion_pipeline() -> StableDiffusionXLPipeline:
     pipe.load_lora_weights(pixel_lora, adapter_name="pixel")
     pipe.set_adapters(["lightning", "pixel"], adapter_weights=[1.0, 1.2])
     pipe.fuse_lora()
-
-    # Ensure sampler uses "trailing" timesteps
-    pipe.scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
-    pipe.enable_model_cpu_offload()
     return pipe
 
 
-def generate_image(prompt: str, negative_prompt: str, output_dir: str, filename: str, pipeline: StableDiffusionXLPipeline, n: int = 4) -> list[str]:
+def save_fused_pipeline(pipe: "StableDiffusionXLPipeline", fused_path: str) -> None:
+    # The fused weights stay in the base model after the LoRA layers are unloaded.
+    # Save next to the target first so an interrupted save is never mistaken for a finished one.
+    pipe.unload_lora_weights()
+    tmp_path = f"{fused_path}.{os.getpid()}.tmp"
+    pipe.save_pretrained(tmp_path)
+    os.replace(tmp_path, fused_path)
+    print(f'Saved fused pipeline to "{fused_path}"')
+
+
+def generate_image(prompt: str, negative_prompt: str, output_dir: str, filename: str, pipeline: "StableDiffusionXLPipeline", n: int = 4, on_image=None, max_batch_size: int = MAX_BATCH_SIZE) -> list[str]:
+    return generate_images([ (prompt, negative_prompt, filename, n) ], output_dir, pipeline, max_batch_size, (lambda _, img_path: on_image(img_path)) if on_image else None)[0]
+
+
+def generate_images(requests: list[tuple[str, str, str, int]], output_dir: str, pipeline: "StableDiffusionXLPipeline", max_batch_size: int = MAX_BATCH_SIZE, on_image=None) -> list[list[str]]:
+    # Each request is (prompt, negative prompt, filename, n). Images from all requests are generated in batches of up to
+    # max_batch_size, so several creatures can share one pipeline call. on_image is called with (request index, image path).
+    ops = get_tensor_ops(pipeline)
+
     os.makedirs(output_dir, exist_ok=True)
 
-    print(f'Generating avatar:')
-    print(f"   Prompt: {prompt}")
-    print(f"   Negative Prompt: {negative_prompt}")
-    print(f"   Output Directory: {output_dir}")
-    print(f"   Filename: {filename}")
-
-    image_paths = []
-    for i in range(n):
-        print(f"    Image Generation Progress: {i + 1}/{n}")
-        img = pipeline(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=4,
-            guidance_scale=1.5,
-            width=1216,
-            height=832).images[0]
-        
-        img_path = get_unique_path(os.path.join(output_dir, filename))
-        img.save(img_path)
-        image_paths.append(img_path)
+    embeds = []
+    for prompt, negative_prompt, filename, n in requests:
+        print(f'Generating avatar:')
+        print(f"   Prompt: {prompt}")
+        print(f"   Negative Prompt: {negative_prompt}")
+        print(f"   Output Directory: {output_dir}")
+        print(f"   Filename: {filename}")
+        embeds.append(encode_prompt(pipeline, prompt, negative_prompt))
+
+    queue = [ i for i, request in enumerate(requests) for _ in range(request[3]) ]
+    image_paths = [ [] for _ in requests ]
+    batch_size = max(1, max_batch_size)
+    done = 0
+    while done < len(queue):
+        batch = queue[done:done + batch_size]
+        print(f"    Image Generation Progress: {done + 1}-{done + len(batch)}/{len(queue)}")
+        try:
+            with tracing.span("diffusion", batch_size=len(batch)):
+                images = pipeline(
+                    prompt_embeds=ops.cat([ embeds[i][0] for i in batch ]),
+                    negative_prompt_embeds=ops.cat([ embeds[i][1] for i in batch ]),
+                    pooled_prompt_embeds=ops.cat([ embeds[i][2] for i in batch ]),
+                    negative_pooled_prompt_embeds=ops.cat([ embeds[i][3] for i in batch ]),
+                    num_inference_steps=4,
+                    guidance_scale=1.5,
+                    width=1216,
+                    height=832).images
+        except ops.OutOfMemoryError:
+            if batch_size == 1:
+                raise
+            batch_size = max(1, batch_size // 2)
+            ops.empty_cache()
+            print(f"    Out of memory, retrying with batch size {batch_size}")
+            continue
+
+        for i, img in zip(batch, images):
+            img_path = get_unique_path(os.path.join(output_dir, requests[i][2]))
+            with tracing.span("save raw image"):
+                img.save(img_path)
+            image_paths[i].append(img_path)
+            if on_image:
+                on_image(i, img_path)
+        done += len(batch)
 
     return image_paths
 
 
-def format_image(image_path: str, output_dir: str) -> str:
-    avatar_size = (90, 60)
+def get_tensor_ops(pipeline: "StableDiffusionXLPipeline") -> SimpleNamespace:
+    # The torch calls the generation loop makes. Pipelines without torch tensors (stub_pipeline) bring their own.
+    ops = getattr(pipeline, "tensor_ops", None)
+    if ops is None:
+        import torch
+        ops = SimpleNamespace(cat=torch.cat, no_grad=torch.no_grad, OutOfMemoryError=torch.cuda.OutOfMemoryError, empty_cache=torch.cuda.empty_cache)
+    return ops
+
+
+def encode_prompt(pipeline: "StableDiffusionXLPipeline", prompt: str, negative_prompt: str) -> tuple:
+    # Returns (prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds) for one image.
+    # Cached per pipeline object, so a new pipeline never gets the embeddings of one that was garbage collected.
+    cache = _prompt_embeds_cache.setdefault(pipeline, OrderedDict())
+    key = (prompt, negative_prompt)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    with get_tensor_ops(pipeline).no_grad(), tracing.span("encode prompt"):
+        embeds = pipeline.encode_prompt(prompt=prompt, negative_prompt=negative_prompt, num_images_per_prompt=1, do_classifier_free_guidance=True)
+    cache[key] = embeds
+    if len(cache) > PROMPT_CACHE_SIZE:
+        cache.popitem(last=False)
+    return embeds
 
-    filename = os.path.basename(image_path)
-    avatar_path = os.path.join(output_dir, f"avatar_{filename}")
-    scale_image(image_path, avatar_path, avatar_size[1], avatar_size[0])
+
+def format_image(image_path: str, output_dir: str, avatar_size=AVATAR_SIZE, palette=False, cache=True) -> str:
+    from pixel_scaler import scale_image
+
+    avatar_path = get_avatar_path(image_path, output_dir)
+    scale_image(image_path, avatar_path, avatar_size[1], avatar_size[0], palette=palette, cache=cache)
     print(f'Saved modified image to "{avatar_path}"')
     return avatar_path
 
@@ -105,10 +207,29 @@ def format_image(image_path: str, output_dir: str) -> str:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate card game avatars")
     parser.add_argument("creature", type=str)
+    parser.add_argument("-n", type=int, default=4, help="Number of images to generate.")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE, help="Maximum images per pipeline call.")
+    parser.add_argument("--stub", action="store_true", help="Use a tiny CPU stand-in instead of SDXL, to check the generation loop without a GPU.")
+    parser.add_argument("--no-server", action="store_true", help="Load the pipeline in this process even if an avatar server is running.")
+    parser.add_argument("--fused-path", default=None, help="Directory for a saved copy of the fused pipeline, to skip LoRA fusing on later runs.")
+    parser.add_argument("--trace", default=None, help="Record timing spans to this file (.jsonl, or .json for a Chrome trace) and print a summary per stage at the end.")
     args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+
+    import avatar_server
 
     raw_img_dir = "img/raw"
     avatar_img_dir = "img"
-    img_paths = generate_pixel_art_avatar(args.creature, raw_img_dir)
+    if not args.stub and not args.no_server and avatar_server.is_running():
+        print(f"Sending job to avatar server on {avatar_server.SERVER_URL}")
+        img_paths = avatar_server.generate_pixel_art_avatar(args.creature, raw_img_dir, args.n, max_batch_size=args.batch_size)
+    else:
+        if args.stub:
+            from stub_pipeline import StubPipeline
+            pipeline = StubPipeline()
+        else:
+            pipeline = initialize_diffusion_pipeline(args.fused_path)
+        img_paths = generate_pixel_art_avatar(args.creature, raw_img_dir, pipeline, args.n, max_batch_size=args.batch_size)
     for img_path in img_paths:
         format_image(img_path, avatar_img_dir)
@@ -0,0 +1,188 @@
+import hashlib
+import io
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from data_store import atomic_write
+
+# Indexed color avatars. Each avatar is quantized to at most `colors` colors and saved as a paletted PNG with only the
+# colors it uses, so PNG picks the smallest bit depth (4-bit for 16 colors or fewer, else 8-bit).
+# Optionally every avatar is mapped onto one shared palette learned from all of them: a weighted k-means over the
+# combined color histogram of every avatar, computed in batches of colors so memory stays bounded.
+
+PALETTE_FILENAME = ".palette.json"
+MAX_COLORS = 256
+KMEANS_ITERATIONS = 20
+BATCH_SIZE = 16384
+
+
+def get_palette_path(avatar_dir: str) -> str:
+    return os.path.join(avatar_dir, PALETTE_FILENAME)
+
+
+def load_palette(path: str) -> np.ndarray:
+    with open(path, "r") as file:
+        return np.array(json.loads(file.read())["colors"], dtype=np.uint8)
+
+
+def save_palette(path: str, palette: np.ndarray) -> None:
+    atomic_write(path, json.dumps({ "colors": palette.tolist() }))
+
+
+def get_palette_hash(palette: np.ndarray) -> str:
+    return hashlib.sha256(palette.tobytes()).hexdigest()[:16]
+
+
+def _codes(pixels: np.ndarray) -> np.ndarray:
+    pixels = pixels.astype(np.int64)
+    return (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+
+
+def _colors(codes: np.ndarray) -> np.ndarray:
+    return np.stack([ (codes >> 16) & 255, (codes >> 8) & 255, codes & 255 ], axis=1)
+
+
+def get_histogram(paths: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    # (unique colors as (n, 3), pixel count of each) over every image
+    histogram = {}
+    for path in paths:
+        with Image.open(path) as img:
+            pixels = np.asarray(img.convert("RGB")).reshape(-1, 3)
+        codes, counts = np.unique(_codes(pixels), return_counts=True)
+        for code, count in zip(codes.tolist(), counts.tolist()):
+            histogram[code] = histogram.get(code, 0) + count
+
+    codes = np.fromiter(histogram.keys(), dtype=np.int64, count=len(histogram))
+    counts = np.fromiter(histogram.values(), dtype=np.int64, count=len(histogram))
+    order = np.argsort(codes)
+    return _colors(codes[order]), counts[order]
+
+
+def nearest_palette_indices(colors: np.ndarray, palette: np.ndarray, batch_size: int = BATCH_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    # (index of the nearest palette color, squared distance to it) for each color, batch_size colors at a time
+    palette = palette.astype(np.float32)
+    palette_norms = np.einsum("ij,ij->i", palette, palette)
+    indices = np.empty(len(colors), dtype=np.intp)
+    distances = np.empty(len(colors), dtype=np.float32)
+    for start in range(0, len(colors), batch_size):
+        batch = colors[start:start + batch_size].astype(np.float32)
+        # |c - p|^2 = |c|^2 - 2c.p + |p|^2, without a (batch, k, 3) temporary
+        squared = np.einsum("ij,ij->i", batch, batch)[:, np.newaxis] - 2 * (batch @ palette.T) + palette_norms
+        indices[start:start + batch_size] = np.argmin(squared, axis=1)
+        distances[start:start + batch_size] = np.maximum(squared[np.arange(len(batch)), indices[start:start + batch_size]], 0)
+    return indices, distances
+
+
+def learn_palette(colors: np.ndarray, counts: np.ndarray, k: int = MAX_COLORS, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    # Weighted k-means over the histogram, seeded with k-means++ so the same avatars always give the same palette
+    if len(colors) <= k:
+        return colors.astype(np.uint8)
+
+    rng = np.random.default_rng(seed)
+    weights = counts.astype(np.float64)
+    centroids = [ colors[np.argmax(weights)] ]
+    distances = nearest_palette_indices(colors, np.array(centroids))[1].astype(np.float64)
+    for _ in range(1, k):
+        probabilities = weights * distances
+        total = probabilities.sum()
+        if total == 0:
+            break
+        chosen = colors[rng.choice(len(colors), p=probabilities / total)]
+        centroids.append(chosen)
+        distances = np.minimum(distances, ((colors - chosen).astype(np.float64) ** 2).sum(axis=1))
+    centroids = np.array(centroids, dtype=np.float64)
+
+    for _ in range(iterations):
+        labels, _ = nearest_palette_indices(colors, centroids)
+        totals = np.bincount(labels, weights=weights, minlength=len(centroids))
+        moved = np.stack([ np.bincount(labels, weights=weights * colors[:, c], minlength=len(centroids)) for c in range(3) ], axis=1)
+        used = totals > 0
+        updated = centroids.copy()
+        updated[used] = moved[used] / totals[used, np.newaxis]
+        if np.allclose(updated, centroids, atol=0.01):
+            centroids = updated
+            break
+        centroids = updated
+
+    # Unique, rounded entries in a fixed order
+    return np.unique(np.clip(np.rint(centroids), 0, 255).astype(np.uint8), axis=0)
+
+
+def to_indexed(image: Image, palette: np.ndarray = None, colors: int = MAX_COLORS) -> Image:
+    # Paletted copy of the image holding only the colors it uses
+    if colors > MAX_COLORS or (palette is not None and len(palette) > MAX_COLORS):
+        raise ValueError(f"Paletted PNGs hold at most {MAX_COLORS} colors")
+    rgb = image.convert("RGB")
+    if palette is None:
+        unique = len(rgb.getcolors(rgb.width * rgb.height))
+        if unique > colors:
+            rgb = rgb.quantize(colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE).convert("RGB")
+        pixels = np.asarray(rgb).reshape(-1, 3)
+        codes, indices = np.unique(_codes(pixels), return_inverse=True)
+        used = _colors(codes)
+    else:
+        pixels = np.asarray(rgb).reshape(-1, 3)
+        codes, inverse = np.unique(_codes(pixels), return_inverse=True)
+        nearest, _ = nearest_palette_indices(_colors(codes), palette)
+        used_entries, compact = np.unique(nearest, return_inverse=True)
+        indices = compact.ravel()[inverse.ravel()]
+        used = palette[used_entries]
+
+    indexed = Image.fromarray(indices.reshape(rgb.height, rgb.width).astype(np.uint8), mode="P")
+    indexed.putpalette(used.astype(np.uint8).flatten().tolist())
+    return indexed
+
+
+def encode_png(image: Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def color_error(original: Image, indexed: Image) -> float:
+    # Root mean squared error per channel, 0-255
+    difference = np.asarray(original.convert("RGB"), dtype=np.float64) - np.asarray(indexed.convert("RGB"), dtype=np.float64)
+    return float(np.sqrt(np.mean(difference ** 2)))
+
+
+def index_avatars(paths: list[str], palette: np.ndarray = None, colors: int = MAX_COLORS, dry_run=False) -> dict:
+    start = time.time()
+    report = { "files": 0, "bytes_before": 0, "bytes_after": 0, "errors": [], "four_bit": 0, "unchanged": 0 }
+    for path in paths:
+        with open(path, "rb") as file:
+            data = file.read()
+        with Image.open(io.BytesIO(data)) as original:
+            original.load()
+        indexed = to_indexed(original, palette, colors)
+        encoded = encode_png(indexed)
+
+        report["files"] += 1
+        report["bytes_before"] += len(data)
+        report["errors"].append(color_error(original, indexed))
+        report["four_bit"] += len(indexed.getpalette()) // 3 <= 16
+        if len(encoded) >= len(data) and original.mode == "P":
+            # Already indexed and no smaller this way
+            report["bytes_after"] += len(data)
+            report["unchanged"] += 1
+            continue
+        report["bytes_after"] += len(encoded)
+        if not dry_run:
+            atomic_write(path, encoded)
+
+    report["seconds"] = time.time() - start
+    return report
+
+
+def print_report(report: dict, palette: np.ndarray = None, dry_run=False) -> None:
+    errors = np.array(report["errors"]) if report["errors"] else np.zeros(1)
+    saved = report["bytes_before"] - report["bytes_after"]
+    percent = 100 * saved / report["bytes_before"] if report["bytes_before"] else 0
+    palette_text = f"the shared {len(palette)} color palette" if palette is not None else "their own palettes"
+    print(f"{'Would index' if dry_run else 'Indexed'} {report['files']} avatars with {palette_text} in {report['seconds']:.1f} seconds "
+          f"({report['four_bit']} at 4 bits per pixel, {report['unchanged']} left as they were)")
+    print(f"   Size: {report['bytes_before'] / 1024:.0f} KB -> {report['bytes_after'] / 1024:.0f} KB ({saved / 1024:.0f} KB, {percent:.1f}% saved)")
+    print(f"   Color error (RMSE per channel, 0-255): mean {errors.mean():.2f}, median {np.median(errors):.2f}, worst {errors.max():.2f}")
@@ -0,0 +1,142 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+AVATAR_SIZE = (90, 60)
+
+# Records the input hash and settings used for each raw image, so reruns only redo what changed.
+# The leading dot keeps Godot from importing it.
+MANIFEST_FILENAME = ".rescale.json"
+
+
+def get_avatar_path(image_path: str, output_dir: str) -> str:
+    filename = os.path.basename(image_path)
+    return os.path.join(output_dir, f"avatar_{filename}")
+
+
+def hash_file(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def load_manifest(raw_dir: str) -> dict:
+    manifest_path = os.path.join(raw_dir, MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, "r") as file:
+        return json.loads(file.read())
+
+
+def save_manifest(raw_dir: str, manifest: dict) -> None:
+    manifest_path = os.path.join(raw_dir, MANIFEST_FILENAME)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(json.dumps(manifest, indent=3, sort_keys=True))
+    os.replace(tmp_path, manifest_path)
+
+
+def is_up_to_date(image_path: str, avatar_path: str, record: dict, settings: dict, check: str, image_hash: str = None) -> bool:
+    if not record or record.get("settings") != settings or not os.path.isfile(avatar_path):
+        return False
+
+    if check == "mtime":
+        return os.path.getmtime(avatar_path) >= os.path.getmtime(image_path)
+
+    return record.get("hash") == image_hash
+
+
+def rescale_avatar(image_path: str, avatar_path: str, record: dict, settings: dict, check: str, force: bool, cache: bool, shared_palette=None) -> dict:
+    # Runs in a worker process. Returns the new manifest record for the raw image.
+    # pixel_scaler pulls in numpy and scipy, so it is imported here rather than by everything that needs AVATAR_SIZE.
+    from pixel_scaler import scale_image
+
+    start = time.time()
+    # mtime checks only read the raw image when it is rescaled, skipped images keep their recorded hash
+    image_hash = hash_file(image_path) if check == "hash" else None
+    if not force and is_up_to_date(image_path, avatar_path, record, settings, check, image_hash):
+        return { "skipped": True, "hash": image_hash or record.get("hash"), "settings": settings, "milliseconds": round((time.time() - start) * 1000) }
+    image_hash = image_hash or hash_file(image_path)
+
+    # scale_image prints timings for every image, keep the worker output to one line per image
+    with contextlib.redirect_stdout(io.StringIO()):
+        scale_image(image_path, avatar_path, settings["height"], settings["width"], palette=settings["palette"], max_colors=settings["max_colors"], cache=cache,
+                    indexed_colors=settings.get("indexed"), shared_palette=shared_palette)
+
+    return { "skipped": False, "hash": image_hash, "settings": settings, "milliseconds": round((time.time() - start) * 1000) }
+
+
+def rescale_avatars(raw_dir: str, output_dir: str, avatar_size=AVATAR_SIZE, palette=False, max_colors=128, workers=None, check="hash", force=False, cache=True, indexed_colors=None, shared_palette=None) -> list[str]:
+    if not os.path.isdir(raw_dir):
+        print(f"No raw images to rescale, {raw_dir} does not exist")
+        return []
+    raw_images = sorted([ os.path.join(raw_dir, f) for f in os.listdir(raw_dir) if f.endswith(".png") ])
+    os.makedirs(output_dir, exist_ok=True)
+
+    settings = { "width": avatar_size[0], "height": avatar_size[1], "palette": palette, "max_colors": max_colors }
+    if indexed_colors:
+        # Only recorded when set, so avatars rescaled before indexed output existed stay up to date
+        from avatar_palette import get_palette_hash
+        settings["indexed"] = indexed_colors
+        settings["shared_palette"] = get_palette_hash(shared_palette) if shared_palette is not None else None
+    workers = workers or os.cpu_count()
+    manifest = load_manifest(raw_dir)
+    # Forget raw images that were deleted or renamed since the last run, so the manifest doesn't grow forever
+    raw_filenames = { os.path.basename(image_path) for image_path in raw_images }
+    removed = [ filename for filename in manifest if filename not in raw_filenames ]
+    for filename in removed:
+        del manifest[filename]
+    if removed:
+        print(f"Removed {len(removed)} manifest records for raw images that no longer exist")
+
+    print(f"Rescaling {len(raw_images)} raw images from {raw_dir} to {output_dir} with {workers} workers")
+    start = time.time()
+    rescaled = []
+    skipped = 0
+    failed = 0
+    done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of images in flight so huge directories stream through the pool
+            pending = {}
+            queued = iter(raw_images)
+            while True:
+                for image_path in queued:
+                    filename = os.path.basename(image_path)
+                    avatar_path = get_avatar_path(image_path, output_dir)
+                    future = executor.submit(rescale_avatar, image_path, avatar_path, manifest.get(filename), settings, check, force, cache, shared_palette)
+                    pending[future] = (filename, avatar_path)
+                    if len(pending) >= workers * 4:
+                        break
+
+                if not pending:
+                    break
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    filename, avatar_path = pending.pop(future)
+                    done += 1
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"   [{done}/{len(raw_images)}] ERROR: {filename}: {e}")
+                        continue
+
+                    manifest[filename] = { "hash": result["hash"], "settings": result["settings"] }
+                    if result["skipped"]:
+                        skipped += 1
+                    else:
+                        rescaled.append(avatar_path)
+                        print(f'   [{done}/{len(raw_images)}] Saved "{avatar_path}" in {result["milliseconds"]} milliseconds')
+    finally:
+        save_manifest(raw_dir, manifest)
+
+    elapsed = time.time() - start
+    processed = len(rescaled)
+    rate = processed / elapsed if elapsed > 0 else 0
+    print(f"Rescaled {processed} images ({skipped} up to date, {failed} failed) in {elapsed:.1f} seconds: {rate:.2f} images/second with {workers} workers")
+    return rescaled
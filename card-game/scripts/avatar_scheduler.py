@@ -0,0 +1,161 @@
+import contextlib
+import io
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from avatar_rescaler import AVATAR_SIZE, get_avatar_path
+
+# Overlaps diffusion with downscaling across creatures. One producer thread runs the diffusion pipeline over every
+# creature and pushes each raw image onto a bounded queue as soon as it is saved. The calling thread feeds the queue to
+# a pool of scale_image worker processes and hands every finished avatar to on_avatar, so results can be committed
+# while the GPU keeps working. The pipeline and image libraries are only imported where they are used, which keeps
+# the worker processes light.
+
+
+def downscale_avatar(image_path: str, output_dir: str, avatar_size=AVATAR_SIZE, palette=False, cache=True) -> tuple[str, float]:
+    # Runs in a worker process. Returns the avatar path and the seconds spent.
+    from pixel_scaler import scale_image
+
+    start = time.perf_counter()
+    avatar_path = get_avatar_path(image_path, output_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        scale_image(image_path, avatar_path, avatar_size[1], avatar_size[0], palette=palette, cache=cache)
+    return avatar_path, time.perf_counter() - start
+
+
+def group_creatures(creatures: dict[str, int], batch_size: int, max_batches: int = 8) -> list[dict[str, int]]:
+    # Group creatures so their images fill whole batches, capped so only a few creatures' prompt embeddings are held at once
+    groups = [{}]
+    images = 0
+    for creature, n in creatures.items():
+        if images >= batch_size and (images % batch_size == 0 or images >= batch_size * max_batches):
+            groups.append({})
+            images = 0
+        groups[-1][creature] = n
+        images += n
+    return [ group for group in groups if group ]
+
+
+def schedule_avatars(creatures: dict[str, int], raw_dir: str, output_dir: str, on_avatar, on_raw=None, pipeline=None, workers: int = None, max_batch_size: int = None, queue_size: int = None, avatar_size=AVATAR_SIZE, palette=False, cache=True, use_server=True) -> dict:
+    # creatures maps creature name -> number of new images. on_raw(creature, raw path) is called from the producer thread
+    # once a raw image is saved, on_avatar(creature, raw path, avatar path) from the calling thread once it is downscaled.
+    # Without a pipeline, jobs go to a running avatar_server if there is one, otherwise SDXL is loaded here.
+    workers = workers or os.cpu_count()
+    queue_size = queue_size or workers * 2
+    raw_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    stats = { "diffusion_seconds": 0.0, "producer_blocked_seconds": 0.0, "downscale_seconds": 0.0, "consumer_idle_seconds": 0.0, "images": 0, "failed": 0 }
+    producer_error = []
+
+    def put(item):
+        start = time.perf_counter()
+        while True:
+            if stop.is_set():
+                raise RuntimeError("Avatar scheduler stopped")
+            try:
+                raw_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats["producer_blocked_seconds"] += time.perf_counter() - start
+
+    def on_image(creature, img_path):
+        if on_raw:
+            on_raw(creature, img_path)
+        put((creature, img_path))
+
+    def produce():
+        nonlocal pipeline
+        try:
+            import avatar_server
+            from avatar_generator_local import MAX_BATCH_SIZE, generate_pixel_art_avatars, initialize_diffusion_pipeline
+            batch_size = max_batch_size or MAX_BATCH_SIZE
+            if pipeline is None and use_server and avatar_server.is_running():
+                print(f"Sending jobs to avatar server on {avatar_server.SERVER_URL}")
+                generate = lambda group: avatar_server.generate_pixel_art_avatars(group, raw_dir, on_image=on_image, max_batch_size=batch_size)
+            else:
+                if pipeline is None:
+                    pipeline = initialize_diffusion_pipeline()
+                generate = lambda group: generate_pixel_art_avatars(group, raw_dir, pipeline, on_image=on_image, max_batch_size=batch_size)
+
+            start = time.perf_counter()
+            for group in group_creatures(creatures, batch_size):
+                generate(group)
+            stats["diffusion_seconds"] = time.perf_counter() - start - stats["producer_blocked_seconds"]
+        except Exception as e:
+            if not stop.is_set():
+                producer_error.append(e)
+        finally:
+            # Blocking here is fine, the consumer drains the queue until it sees the end marker
+            if not stop.is_set():
+                raw_queue.put(None)
+
+    total = sum(creatures.values())
+    print(f"Generating {total} avatars for {len(creatures)} creatures with {workers} downscale workers")
+    start = time.perf_counter()
+    producer = threading.Thread(target=produce, name="diffusion-producer", daemon=True)
+    producer.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            produced = False
+            while not produced or pending:
+                # Keep every worker busy, only block on the queue when nothing is in flight
+                while not produced and len(pending) < workers:
+                    idle_start = time.perf_counter()
+                    try:
+                        item = raw_queue.get(block=not pending)
+                    except queue.Empty:
+                        break
+                    finally:
+                        if not pending:
+                            stats["consumer_idle_seconds"] += time.perf_counter() - idle_start
+
+                    if item is None:
+                        produced = True
+                        break
+                    creature, img_path = item
+                    pending[executor.submit(downscale_avatar, img_path, output_dir, avatar_size, palette, cache)] = (creature, img_path)
+
+                if not pending:
+                    continue
+
+                finished, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    creature, img_path = pending.pop(future)
+                    try:
+                        avatar_path, seconds = future.result()
+                    except Exception as e:
+                        stats["failed"] += 1
+                        print(f"   ERROR: {img_path}: {e}")
+                        continue
+
+                    stats["images"] += 1
+                    stats["downscale_seconds"] += seconds
+                    print(f'   [{stats["images"]}/{total}] Saved "{avatar_path}" for {creature}')
+                    on_avatar(creature, img_path, avatar_path)
+    finally:
+        stop.set()
+        producer.join()
+
+    if producer_error:
+        raise producer_error[0]
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = elapsed
+    stats["workers"] = workers
+    print_utilization(stats)
+    return stats
+
+
+def print_utilization(stats: dict) -> None:
+    elapsed = stats["seconds"]
+    if elapsed <= 0:
+        return
+    rate = stats["images"] / elapsed
+    print(f"Generated {stats['images']} avatars ({stats['failed']} failed) in {elapsed:.1f} seconds: {rate:.2f} images/second")
+    print(f"   Diffusion: {100 * stats['diffusion_seconds'] / elapsed:.0f}% busy, blocked on a full queue for {stats['producer_blocked_seconds']:.1f} seconds")
+    print(f"   Downscale: {100 * stats['downscale_seconds'] / (elapsed * stats['workers']):.0f}% busy across {stats['workers']} workers, waited on diffusion for {stats['consumer_idle_seconds']:.1f} seconds")
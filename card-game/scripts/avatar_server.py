@@ -0,0 +1,220 @@
+import argparse
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from paths import CACHE_DIR
+
+# Long-lived local server that keeps the fused diffusion pipeline loaded between runs.
+# Start it once with `python avatar_server.py serve`. avatar_generator_local.py and `deck_generator.py avatars` then send
+# their jobs to it instead of loading SDXL themselves. Jobs are plain JSON over localhost HTTP. The response streams one
+# JSON line per image as it is saved, so callers can journal and downscale images while the rest of the job runs.
+# This module only imports torch/diffusers when serving, so clients stay light.
+# POST requests must be JSON, must not come from a browser (no Origin header) and must carry the token the server writes
+# to the cache directory when it starts, so web pages and other users can't start jobs or stop the server.
+
+SERVER_URL = os.environ.get("CARD_GAME_AVATAR_SERVER", "http://127.0.0.1:8765")
+TOKEN_PATH = os.path.join(CACHE_DIR, "avatar_server.token")
+TOKEN_HEADER = "X-Avatar-Token"
+
+
+def write_token(path: str = TOKEN_PATH) -> str:
+    # New token for every server start, readable only by this user
+    token = secrets.token_hex(32)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as file:
+        file.write(token)
+    return token
+
+
+def read_token(path: str = TOKEN_PATH) -> str:
+    if not os.path.isfile(path):
+        return ""
+    with open(path, "r") as file:
+        return file.read().strip()
+
+
+def get_headers() -> dict:
+    return { "Content-Type": "application/json", TOKEN_HEADER: read_token() }
+
+
+def is_running(url: str = SERVER_URL, timeout: float = 0.5) -> bool:
+    try:
+        return get_status(url, timeout)["status"] == "ok"
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def get_status(url: str = SERVER_URL, timeout: float = 5) -> dict:
+    with urllib.request.urlopen(f"{url}/status", timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def stop_server(url: str = SERVER_URL) -> None:
+    request = urllib.request.Request(f"{url}/shutdown", data=b"{}", headers=get_headers(), method="POST")
+    with urllib.request.urlopen(request, timeout=5) as response:
+        response.read()
+
+
+def generate_pixel_art_avatars(creatures: dict[str, int], output_dir: str, on_image=None, max_batch_size: int = None, url: str = SERVER_URL) -> dict[str, list[str]]:
+    # Same as avatar_generator_local.generate_pixel_art_avatars, but runs on the server. on_image is called with (creature, image path).
+    job = { "creatures": creatures, "output_dir": os.path.abspath(output_dir), "max_batch_size": max_batch_size }
+    request = urllib.request.Request(f"{url}/generate", data=json.dumps(job).encode(), headers=get_headers(), method="POST")
+    image_paths = { creature: [] for creature in creatures }
+    with urllib.request.urlopen(request) as response:
+        for line in response:
+            message = json.loads(line)
+            if "error" in message:
+                raise RuntimeError(f"Avatar server error: {message['error']}")
+            if "done" in message:
+                return image_paths
+
+            image_paths[message["creature"]].append(message["path"])
+            if on_image:
+                on_image(message["creature"], message["path"])
+
+    raise RuntimeError("Avatar server closed the connection before the job finished")
+
+
+def generate_pixel_art_avatar(creature: str, output_dir: str, n: int = 4, on_image=None, max_batch_size: int = None, url: str = SERVER_URL) -> list[str]:
+    return generate_pixel_art_avatars({ creature: n }, output_dir, (lambda _, img_path: on_image(img_path)) if on_image else None, max_batch_size, url)[creature]
+
+
+class AvatarServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], pipeline, token: str):
+        super().__init__(address, AvatarRequestHandler)
+        self.pipeline = pipeline
+        self.token = token
+        # One job on the GPU at a time, other clients wait their turn
+        self.generate_lock = threading.Lock()
+        self.started = time.time()
+        self.jobs = 0
+        self.images = 0
+
+
+class AvatarRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.headers.get("Origin") is not None:
+            self.send_error(403, "Browser requests are not accepted")
+            return
+        if self.path != "/status":
+            self.send_error(404)
+            return
+
+        server = self.server
+        self.send_json({
+            "status": "ok",
+            "pipeline": type(server.pipeline).__name__,
+            "uptime_seconds": round(time.time() - server.started),
+            "jobs": server.jobs,
+            "images": server.images,
+            "busy": server.generate_lock.locked(),
+        })
+
+    def do_POST(self):
+        error = self.check_request()
+        if error:
+            self.send_error(*error)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/shutdown":
+            self.send_json({ "status": "stopping" })
+            threading.Thread(target=self.server.shutdown).start()
+        elif self.path == "/generate":
+            self.generate(body)
+        else:
+            self.send_error(404)
+
+    def check_request(self):
+        # (status, message) when the request is refused. Browsers send an Origin header with every cross-origin POST,
+        # and can only send JSON after a CORS preflight this server never answers.
+        if self.headers.get("Origin") is not None:
+            return 403, "Browser requests are not accepted"
+        if self.headers.get_content_type() != "application/json":
+            return 415, "Expected application/json"
+        if not hmac.compare_digest(self.headers.get(TOKEN_HEADER, "").encode(), self.server.token.encode()):
+            return 403, f"Missing or wrong {TOKEN_HEADER}, see {TOKEN_PATH}"
+        return None
+
+    def generate(self, job: dict):
+        from avatar_generator_local import MAX_BATCH_SIZE, generate_pixel_art_avatars
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        def on_image(creature: str, img_path: str):
+            self.server.images += 1
+            self.write_line({ "creature": creature, "path": img_path })
+
+        server = self.server
+        try:
+            with server.generate_lock:
+                server.jobs += 1
+                generate_pixel_art_avatars(job["creatures"], job["output_dir"], server.pipeline, on_image=on_image, max_batch_size=job.get("max_batch_size") or MAX_BATCH_SIZE)
+            self.write_line({ "done": True })
+        except Exception as e:
+            print(f"ERROR: {e}")
+            self.write_line({ "error": str(e) })
+
+    def write_line(self, message: dict):
+        self.wfile.write((json.dumps(message) + "\n").encode())
+        self.wfile.flush()
+
+    def send_json(self, message: dict):
+        data = json.dumps(message).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(url: str = SERVER_URL, stub=False, fused_path: str = None) -> None:
+    start = time.time()
+    if stub:
+        from stub_pipeline import StubPipeline
+        pipeline = StubPipeline()
+    else:
+        from avatar_generator_local import initialize_diffusion_pipeline
+        pipeline = initialize_diffusion_pipeline(fused_path)
+
+    address = urlsplit(url)
+    server = AvatarServer((address.hostname, address.port), pipeline, write_token())
+    print(f"Loaded {type(pipeline).__name__} in {time.time() - start:.1f} seconds, serving avatar jobs on {url}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the avatar diffusion pipeline loaded and serve generation jobs on localhost.")
+    parser.add_argument("action", choices=["serve", "status", "stop"], help="Start the server, or query/stop a running one.")
+    parser.add_argument("--url", default=SERVER_URL, help="Server address. (Also set with the CARD_GAME_AVATAR_SERVER environment variable)")
+    parser.add_argument("--fused-path", default=None, help="Directory for a saved copy of the fused pipeline. Created on the first start, loaded on later ones.")
+    parser.add_argument("--stub", action="store_true", help="Serve a tiny CPU stand-in instead of SDXL.")
+    args = parser.parse_args()
+
+    if args.action == "serve":
+        serve(args.url, stub=args.stub, fused_path=args.fused_path)
+    elif args.action == "status":
+        try:
+            print(json.dumps(get_status(args.url), indent=3))
+        except urllib.error.URLError:
+            print(f"No avatar server running on {args.url}")
+    elif args.action == "stop":
+        stop_server(args.url)
+        print(f"Stopped avatar server on {args.url}")
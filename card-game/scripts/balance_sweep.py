@@ -0,0 +1,231 @@
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+
+from card_simulator import AI_DATA_PATH, CARDS_DATA_PATH, OUTPUT_DIR, PLAYER_WIN, ROUND_RESULTS, _init_worker, get_game_tasks, simulate_games_task
+from paths import CACHE_DIR
+
+# Parameter sweeps for balance tuning. Each point of a grid or random search over settings values (named by their path
+# in cards.data.json or ai.data.json, e.g. cards.stats.ability_costs.flying or ai.levels.reward_odds.Easy.AddCreature)
+# runs through card_simulator on a worker process and is summarized into a few metrics. Results are stored in
+# sweeps.sqlite in the cache directory, keyed on a hash of the settings files, the swept values and the simulation
+# settings, so rerunning an overlapping sweep only simulates the new points. Every point of the sweep is written to one
+# columnar file (NPZ, or Parquet if pandas and pyarrow are installed).
+#
+# Values are comma separated ("2,3,4") or an inclusive integer range ("2..6"). A grid runs every combination, --random N
+# draws N combinations.
+
+CACHE_FILENAME = "sweeps.sqlite"
+# Bump when a change to the simulator or the metrics changes results, so stored results are not reused
+SWEEP_VERSION = 1
+SIMULATIONS = ["games", "pools"]
+
+
+def get_cache_path() -> str:
+    return os.path.join(CACHE_DIR, CACHE_FILENAME)
+
+
+def connect() -> sqlite3.Connection:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    connection = sqlite3.connect(get_cache_path(), timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, config TEXT, metrics TEXT, seconds REAL, created REAL)")
+    return connection
+
+
+def get_stored(keys: list[str]) -> dict[str, dict]:
+    with closing(connect()) as connection:
+        results = {}
+        for key in keys:
+            row = connection.execute("SELECT metrics FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                results[key] = json.loads(row[0])
+        return results
+
+
+def store(key: str, config: dict, metrics: dict, seconds: float) -> None:
+    with closing(connect()) as connection:
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (key, json.dumps(config, sort_keys=True), json.dumps(metrics), seconds, time.time()))
+
+
+def parse_values(text: str) -> list:
+    if ".." in text:
+        low, high = text.split("..")
+        return list(range(int(low), int(high) + 1))
+    return [ json.loads(value) for value in text.split(",") ]
+
+
+def parse_param(text: str, settings: dict) -> tuple[str, list]:
+    # "file.path.to.value=values", checked against the settings so typos fail before anything runs
+    if "=" not in text:
+        raise ValueError(f"Expected PATH=VALUES, got {text}")
+    path, values = text.split("=", 1)
+    get_value(settings, path)
+    return path, parse_values(values)
+
+
+def _walk(settings: dict, path: str) -> tuple:
+    # (container, last key) for a dotted path, list indexes are numbers
+    parts = path.split(".")
+    node = settings
+    for part in parts[:-1]:
+        node = node[int(part)] if isinstance(node, list) else node[part]
+    return node, int(parts[-1]) if isinstance(node, list) else parts[-1]
+
+
+def get_value(settings: dict, path: str):
+    try:
+        node, key = _walk(settings, path)
+        return node[key]
+    except (KeyError, IndexError, ValueError, TypeError):
+        raise ValueError(f"No setting {path} (paths start with cards. or ai.)") from None
+
+
+def set_value(settings: dict, path: str, value) -> None:
+    node, key = _walk(settings, path)
+    node[key] = value
+
+
+def get_points(params: list[tuple[str, list]], random_points: int = None, seed: int = 0) -> list[dict]:
+    # {path: value} for every point of the grid, or random_points distinct random ones
+    grid = [ dict(zip([ path for path, _ in params ], values)) for values in itertools.product(*[ values for _, values in params ]) ]
+    if random_points is None or random_points >= len(grid):
+        return grid
+    return random.Random(seed).sample(grid, random_points)
+
+
+def get_key(base_hash: str, point: dict, simulation: dict) -> str:
+    return hashlib.sha256(json.dumps({ "version": SWEEP_VERSION, "settings": base_hash, "point": point, "simulation": simulation }, sort_keys=True).encode()).hexdigest()
+
+
+def run_point(settings: dict, point: dict, simulation: dict) -> tuple[dict, float]:
+    # (metrics, seconds) for one point, run in a worker process
+    start = time.time()
+    settings = copy.deepcopy(settings)
+    for path, value in point.items():
+        set_value(settings, path, value)
+
+    if simulation["type"] == "pools":
+        from card_pool_sampler import PoolSampler
+        from card_simulator import GameData
+        totals, histograms = PoolSampler(GameData(None, None, settings["cards"], settings["ai"])).analyze(simulation["pools"], simulation["seed"])
+        cards = sum(totals.values())
+        metrics = {
+            "mean_attack": sum(key[2] * count for key, count in totals.items()) / cards,
+            "mean_health": sum(key[3] * count for key, count in totals.items()) / cards,
+            # Share of cards with the same stats, or the same name, as another card in their pool
+            "stat_collision_rate": 1 - histograms[0][1] / cards,
+            "name_collision_rate": 1 - histograms[3][1] / cards,
+        }
+        for ability, name in ((1, "flying"), (2, "tall"), (3, "lethal")):
+            metrics[f"{name}_rate"] = sum(count for key, count in totals.items() if ability in key[5]) / cards
+        return metrics, time.time() - start
+
+    _init_worker(None, None, settings["cards"], settings["ai"])
+    results = [0] * len(ROUND_RESULTS)
+    win_rates = {}
+    for task in get_game_tasks(simulation["pools"], simulation["games"], simulation["min_level"], simulation["max_level"], simulation["seed"]):
+        rows, _, _ = simulate_games_task(*task)
+        for _, level, counts in rows:
+            results = [ total + count for total, count in zip(results, counts) ]
+            # Mean of the per game win rates, like the WinRate column of GameAnalysis_Results.csv
+            if sum(counts):
+                win_rates.setdefault(level, []).append(counts[PLAYER_WIN] / sum(counts))
+
+    all_rates = [ rate for rates in win_rates.values() for rate in rates ]
+    metrics = { "win_rate": sum(all_rates) / len(all_rates) if all_rates else float("nan") }
+    for name, count in zip(["player_win", "enemy_win", "stalemate", "max_turns_reached"], results):
+        metrics[f"{name}_rounds"] = count
+    for level in range(simulation["min_level"], simulation["max_level"] + 1):
+        rates = win_rates.get(level, [])
+        metrics[f"win_rate_level_{level}"] = sum(rates) / len(rates) if rates else float("nan")
+    return metrics, time.time() - start
+
+
+def run_sweep(params: list[tuple[str, list]], simulation: dict, output_path: str, random_points: int = None, seed: int = 0, workers: int = None,
+              cards_path: str = CARDS_DATA_PATH, ai_path: str = AI_DATA_PATH) -> dict:
+    start = time.time()
+    texts = {}
+    for name, path in (("cards", cards_path), ("ai", ai_path)):
+        with open(path, "r") as file:
+            texts[name] = file.read()
+    settings = { name: json.loads(text) for name, text in texts.items() }
+    base_hash = hashlib.sha256((texts["cards"] + "\0" + texts["ai"]).encode()).hexdigest()
+
+    points = get_points(params, random_points, seed)
+    keys = [ get_key(base_hash, point, simulation) for point in points ]
+    results = get_stored(keys)
+    missing = { key: point for key, point in zip(keys, points) if key not in results }
+    print(f"Sweeping {len(points)} points ({len(points) - len(missing)} already stored, {len(missing)} to run)")
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = { executor.submit(run_point, settings, point, simulation): key for key, point in missing.items() }
+            for done, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                metrics, seconds = future.result()
+                # Stored as each point finishes, so an interrupted sweep keeps its progress
+                store(key, { "point": missing[key], "simulation": simulation }, metrics, seconds)
+                results[key] = metrics
+                print(f"   [{done}/{len(missing)}] {missing[key]} in {seconds:.1f} seconds")
+
+    columns = { path: [ point[path] for point in points ] for path, _ in params }
+    for metric in results[keys[0]] if keys else []:
+        columns[metric] = [ results[key][metric] for key in keys ]
+    columns["config_hash"] = keys
+    save_results(output_path, columns)
+    return { "points": len(points), "computed": len(missing), "path": output_path, "seconds": time.time() - start }
+
+
+def save_results(path: str, columns: dict[str, list]) -> None:
+    import numpy as np
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith(".parquet"):
+        import pandas as pd
+        pd.DataFrame(columns).to_parquet(path, index=False)
+    else:
+        np.savez(path, **{ name: np.array(values) for name, values in columns.items() })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep settings values through the headless card pool and game simulations.")
+    parser.add_argument("simulation", choices=SIMULATIONS, help="Simulate games (win rates) or card pools (stats and collisions) for every point.")
+    parser.add_argument("--param", action="append", required=True, metavar="PATH=VALUES", help="Setting to sweep, e.g. cards.stats.ability_costs.flying=2..5 or ai.levels.reward_odds.Easy.AddCreature=40,50,60. Repeat for more.")
+    parser.add_argument("--random", type=int, default=None, metavar="N", help="Run N random points of the grid instead of all of it.")
+    parser.add_argument("--output", default=os.path.join(OUTPUT_DIR, "sweep.npz"), help="Results file, .npz or .parquet.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes. (Defaults to the number of CPUs)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the simulations and random points.")
+    parser.add_argument("--pools", type=int, default=None, help="Card pools per point. (Default 3 for games, 10000 for pools)")
+    parser.add_argument("--games", type=int, default=10, help="Games per pool and level.")
+    parser.add_argument("--min-level", type=int, default=1, help="First level to simulate.")
+    parser.add_argument("--max-level", type=int, default=12, help="Last level to simulate.")
+    parser.add_argument("--cards", default=CARDS_DATA_PATH, help="Path to cards.data.json.")
+    parser.add_argument("--ai", default=AI_DATA_PATH, help="Path to ai.data.json.")
+    args = parser.parse_args()
+
+    with open(args.cards, "r") as cards_file, open(args.ai, "r") as ai_file:
+        settings = { "cards": json.loads(cards_file.read()), "ai": json.loads(ai_file.read()) }
+    try:
+        params = [ parse_param(param, settings) for param in args.param ]
+    except ValueError as e:
+        parser.error(str(e))
+
+    simulation = { "type": args.simulation, "seed": args.seed }
+    if args.simulation == "games":
+        simulation.update(pools=args.pools or 3, games=args.games, min_level=args.min_level, max_level=args.max_level)
+    else:
+        simulation.update(pools=args.pools or 10000)
+
+    report = run_sweep(params, simulation, args.output, args.random, args.seed, args.workers, args.cards, args.ai)
+    print(f"Swept {report['points']} points ({report['computed']} simulated) in {report['seconds']:.1f} seconds")
+    print(f"   Saved {report['path']}")
@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from memory_usage import get_peak_rss_mb
+
+# Benchmarks of the asset pipeline hot paths on synthetic inputs: random 1216x832 raw images like the ones SDXL
+# generates, and cards.data.json files from 40 to 100k nouns. Each case runs in its own process, so the peak RSS
+# reported is that case's alone, and is timed over a few repeats after one untimed warm up. Results are compared to a
+# stored baseline and the run fails if any case is more than --threshold slower (or bigger) than it was.
+#
+# Nothing here needs a GPU or the network: no case loads the diffusion pipeline or calls OpenAI, and the case
+# processes run with the Hugging Face and OpenAI clients set to offline so an accidental call fails instead of
+# downloading or spending.
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Timings only compare on the same machine. The baseline defaults to a file next to this script so a checkout (or CI
+# runner) that saved one keeps it, and CARD_GAME_BENCHMARK_BASELINE points elsewhere, e.g. at a file the CI caches.
+BASELINE_PATH = os.environ.get("CARD_GAME_BENCHMARK_BASELINE", os.path.join(SCRIPTS_DIR, "benchmark_baseline.json"))
+THRESHOLD = 0.25
+# Fast cases are repeated until they've run for at least this long, and regressions of under TIME_SLACK_MS or
+# RSS_SLACK_MB are ignored, so millisecond cases and the interpreter's own footprint don't fail the run
+MIN_SECONDS = 1.0
+MAX_REPEAT = 200
+TIME_SLACK_MS = 5
+RSS_SLACK_MB = 16
+# Cases that write and fsync files depend on the disk more than the code. Their median is compared instead of the
+# fastest run, which a single lucky baseline run would set too low, and they get twice the threshold and more slack.
+IO_CASES = ["save_data", "backup"]
+IO_TIME_SLACK_MS = 25
+
+RAW_SIZE = (1216, 832)
+AVATAR_SIZE = (90, 60)
+NOUN_COUNTS = [40, 1000, 100000]
+
+OFFLINE_ENV = {
+    "HF_HUB_OFFLINE": "1",
+    "TRANSFORMERS_OFFLINE": "1",
+    "CARD_GAME_REQUEST_CACHE": "offline",
+    "OPENAI_API_KEY": "offline",
+    "OPENAI_BASE_URL": "http://127.0.0.1:9/v1",
+}
+
+
+def make_raw_image(seed: int = 0):
+    # Flat color regions with noise on top, so k-means has both easy and busy tiles to work on
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, size=(RAW_SIZE[1] // 64 + 1, RAW_SIZE[0] // 64 + 1, 3))
+    pixels = np.repeat(np.repeat(blocks, 64, axis=0), 64, axis=1)[:RAW_SIZE[1], :RAW_SIZE[0]]
+    pixels = pixels + rng.normal(0, 12, size=pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+
+
+def make_database(tmp_dir: str, nouns: int):
+    from card_database import CardDatabase, generate_synthetic_data
+
+    return CardDatabase(os.path.join(tmp_dir, "cards.data.json"), generate_synthetic_data(nouns, nouns * 2))
+
+
+# Each setup takes a temporary directory and returns the function to time
+
+def setup_kcentroid(tmp_dir: str, engine: str):
+    from pixel_scaler import KCENTROID_ENGINES
+
+    image = make_raw_image()
+    return lambda: KCENTROID_ENGINES[engine](image, AVATAR_SIZE[0], AVATAR_SIZE[1], 2)
+
+
+def setup_determine_best_k(tmp_dir: str, search: str):
+    # scale_image searches the palette of the downscaled avatar
+    from pixel_scaler import determine_best_k, determine_best_k_incremental, kCentroid_numpy
+
+    avatar = kCentroid_numpy(make_raw_image(), AVATAR_SIZE[0], AVATAR_SIZE[1], 2)
+    if search == "incremental":
+        return lambda: determine_best_k_incremental(avatar, 128)
+    return lambda: determine_best_k(avatar, 128)
+
+
+def setup_scale_image(tmp_dir: str, palette: str):
+    from pixel_scaler import scale_image
+
+    raw_path = os.path.join(tmp_dir, "raw.png")
+    make_raw_image().save(raw_path)
+    output_path = os.path.join(tmp_dir, "avatar.png")
+    return lambda: scale_image(raw_path, output_path, AVATAR_SIZE[1], AVATAR_SIZE[0], palette=palette == "palette", cache=False)
+
+
+def setup_save_data(tmp_dir: str, nouns: str):
+    # deck_generator.save_data: serialize, back up and atomically write. A new adjective each run so every save backs up.
+    import data_store
+    import deck_generator
+
+    db = make_database(tmp_dir, int(nouns))
+    db.save()
+    data_store.BACKUP_DIR = os.path.join(tmp_dir, "backups")
+    count = [0]
+
+    def run():
+        count[0] += 1
+        db.add("adjectives", f"Benchmark{count[0]}", 0)
+        deck_generator.save_data(db)
+    return run
+
+
+def setup_backup(tmp_dir: str, nouns: str):
+    import data_store
+
+    db = make_database(tmp_dir, int(nouns))
+    data = db.to_json()
+    count = [0]
+
+    def run():
+        count[0] += 1
+        data_store.backup(data + str(count[0]), os.path.join(tmp_dir, "backups"))
+    return run
+
+
+def setup_remove_dangling_resources(tmp_dir: str, nouns: str):
+    # Every noun has 4 avatars, one in ten of the files is missing. The first run removes them from the deck data, so
+    # later runs time the usual case where the deck data and the avatar folder agree.
+    import deck_generator
+
+    db = make_database(tmp_dir, int(nouns))
+    avatar_dir = os.path.join(tmp_dir, "avatars") + "/"
+    os.makedirs(avatar_dir)
+    for i, avatar in enumerate(db.avatar_paths()):
+        if i % 10:
+            open(os.path.join(avatar_dir, avatar[len(deck_generator.godot_avatar_img_path):]), "w").close()
+    deck_generator.avatar_img_path = avatar_dir
+
+    def run():
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            deck_generator.remove_dangling_resources(db)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return run
+
+
+CASES = {
+    "kCentroid[reference]": (setup_kcentroid, "reference"),
+    "kCentroid[numpy]": (setup_kcentroid, "numpy"),
+    "kCentroid[adaptive]": (setup_kcentroid, "adaptive"),
+    "determine_best_k[reference]": (setup_determine_best_k, "reference"),
+    "determine_best_k[incremental]": (setup_determine_best_k, "incremental"),
+    "scale_image[no palette]": (setup_scale_image, "no palette"),
+    "scale_image[palette]": (setup_scale_image, "palette"),
+}
+for _nouns in NOUN_COUNTS:
+    CASES[f"save_data[{_nouns}]"] = (setup_save_data, str(_nouns))
+    CASES[f"backup[{_nouns}]"] = (setup_backup, str(_nouns))
+    CASES[f"remove_dangling_resources[{_nouns}]"] = (setup_remove_dangling_resources, str(_nouns))
+
+
+def run_case(name: str, repeat: int) -> dict:
+    # Runs in the case's own process
+    setup, param = CASES[name]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fn = setup(tmp_dir, param)
+        fn()
+        timings = []
+        while len(timings) < repeat or (sum(timings) < MIN_SECONDS and len(timings) < MAX_REPEAT):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+    return { "seconds": min(timings), "median_seconds": statistics.median(timings), "peak_rss_mb": get_peak_rss_mb() }
+
+
+def measure(name: str, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, **OFFLINE_ENV, CARD_GAME_CACHE_DIR=cache_dir, CARD_GAME_BACKUP_DIR=os.path.join(cache_dir, "backups"))
+        result = subprocess.run([sys.executable, __file__, "--case", name, "--repeat", str(repeat)], cwd=SCRIPTS_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as file:
+        return json.loads(file.read())
+
+
+def is_io_case(name: str) -> bool:
+    return name.split("[")[0] in IO_CASES
+
+
+def compare(name: str, result: dict, baseline: dict, threshold: float) -> list[str]:
+    # Regressions past the threshold, as text
+    if name not in baseline:
+        return []
+    regressions = []
+    previous = baseline[name]
+    if is_io_case(name):
+        # Baselines saved before medians were recorded only have the fastest run
+        seconds, previous_seconds, time_threshold, slack_ms = result["median_seconds"], previous.get("median_seconds", previous["seconds"]), threshold * 2, IO_TIME_SLACK_MS
+    else:
+        seconds, previous_seconds, time_threshold, slack_ms = result["seconds"], previous["seconds"], threshold, TIME_SLACK_MS
+    if seconds > previous_seconds * (1 + time_threshold) + slack_ms / 1000:
+        label = "median time" if is_io_case(name) else "time"
+        regressions.append(f"{seconds / previous_seconds:.2f}x the baseline {label} ({previous_seconds * 1000:.1f} ms)")
+    if result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + threshold) + RSS_SLACK_MB:
+        regressions.append(f"{result['peak_rss_mb'] / previous['peak_rss_mb']:.2f}x the baseline peak RSS ({previous['peak_rss_mb']:.0f} MB)")
+    return regressions
+
+
+def benchmark(cases: list[str], repeat: int = 3, baseline_path: str = BASELINE_PATH, threshold: float = THRESHOLD, save_baseline=False) -> bool:
+    baseline = load_baseline(baseline_path)
+    if not baseline and not save_baseline:
+        print(f"No baseline at {baseline_path}, only reporting (use --save-baseline on this machine to store one)")
+
+    results = {}
+    passed = True
+    for name in cases:
+        result = results[name] = measure(name, repeat)
+        regressions = compare(name, result, baseline, threshold)
+        passed = passed and not regressions
+        status = "FAIL" if regressions else "OK" if name in baseline else "NEW"
+        change = ""
+        if name in baseline:
+            key = "median_seconds" if is_io_case(name) else "seconds"
+            change = f", {result[key] / baseline[name].get(key, baseline[name]['seconds']) - 1:+.0%} vs baseline"
+        print(f"{status} {name}: {result['seconds'] * 1000:.1f} ms (median {result['median_seconds'] * 1000:.1f} ms{change}), peak RSS {result['peak_rss_mb']:.0f} MB")
+        for regression in regressions:
+            print(f"   {regression}")
+
+    if save_baseline:
+        # Cases that weren't run keep their old baseline
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, "w") as file:
+            file.write(json.dumps({ **baseline, **results }, indent=3, sort_keys=True))
+        print(f"Saved the baseline for {len(results)} cases to {baseline_path}")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the asset pipeline hot paths against a stored baseline.")
+    parser.add_argument("cases", nargs="*", help="Cases to run, or prefixes like kCentroid or save_data. (Defaults to all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Minimum timed runs per case (fast cases run for at least a second), the fastest is compared.")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Fail when a case is more than this fraction slower or bigger than the baseline.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline file. (Also set with the CARD_GAME_BENCHMARK_BASELINE environment variable)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--list", action="store_true", help="List the cases.")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.repeat)))
+        sys.exit(0)
+    if args.list:
+        print("\n".join(CASES))
+        sys.exit(0)
+
+    cases = [ name for name in CASES if not args.cases or any(name == case or name.startswith(case + "[") for case in args.cases) ]
+    if not cases:
+        parser.error(f"No cases match {', '.join(args.cases)} (see --list)")
+    sys.exit(0 if benchmark(cases, args.repeat, args.baseline, args.threshold, args.save_baseline) else 1)
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from json.encoder import encode_basestring_ascii
+
+from data_store import atomic_write
+
+DATA_TYPES = ["nouns", "adjectives"]
+
+
+def normalize_name(name: str) -> str:
+    # Collapses whitespace, the form names are stored in
+    return " ".join(name.split())
+
+
+def get_name_key(name: str) -> str:
+    # Names that only differ in case or whitespace are the same noun or adjective
+    return normalize_name(name).casefold()
+
+
+class CardDatabase:
+    # In-memory model of cards.data.json. The file is parsed once and kept with secondary indexes:
+    # - names by level for nouns and adjectives
+    # - name key (see get_name_key) -> name for nouns and adjectives
+    # - avatar path -> nouns that list it (usually one, but the deck data can list an avatar under several nouns)
+    # - noun -> avatar count
+    # All changes to nouns, adjectives and avatars should go through the methods below so the indexes stay current.
+
+    def __init__(self, path: str, data: dict = None):
+        self.path = path
+        if data is None:
+            with open(path, "r") as file:
+                data = json.loads(file.read())
+        self.data = data
+        self._build_indexes()
+
+    def _build_indexes(self):
+        # Dicts with None values are used as insertion ordered sets
+        self._by_level = { data_type: {} for data_type in DATA_TYPES }
+        self._by_key = { data_type: {} for data_type in DATA_TYPES }
+        for data_type in DATA_TYPES:
+            for name, info in self.data[data_type].items():
+                self._by_level[data_type].setdefault(info["level"], {})[name] = None
+                self._by_key[data_type].setdefault(get_name_key(name), name)
+
+        self._avatar_owners = {}
+        self._avatar_counts = {}
+        for noun, info in self.data["nouns"].items():
+            avatars = info.get("avatars") or []
+            self._avatar_counts[noun] = len(avatars)
+            for avatar in avatars:
+                self._avatar_owners.setdefault(avatar, {})[noun] = None
+
+    @property
+    def nouns(self) -> dict:
+        return self.data["nouns"]
+
+    @property
+    def adjectives(self) -> dict:
+        return self.data["adjectives"]
+
+    def get(self, data_type: str, name: str) -> dict:
+        return self.data[data_type].get(name)
+
+    def levels(self, data_type: str) -> dict[int, list[str]]:
+        return { level: list(names) for level, names in self._by_level[data_type].items() }
+
+    def names_at_level(self, data_type: str, level: int) -> list[str]:
+        return list(self._by_level[data_type].get(level, {}))
+
+    def find(self, data_type: str, name: str) -> str:
+        # The stored spelling of a name, ignoring case and whitespace, or None
+        return self._by_key[data_type].get(get_name_key(name))
+
+    def add(self, data_type: str, name: str, level: int, overwrite=False) -> bool:
+        # Returns True if the value is new. A name that matches an existing one (see find) isn't added again.
+        existing = self.find(data_type, name)
+        if existing is not None:
+            if overwrite:
+                self.set_level(data_type, existing, level)
+            return False
+
+        name = normalize_name(name)
+        self.data[data_type][name] = { "level": int(level) }
+        self._by_level[data_type].setdefault(int(level), {})[name] = None
+        self._by_key[data_type][get_name_key(name)] = name
+        if data_type == "nouns":
+            self._avatar_counts[name] = 0
+        return True
+
+    def set_level(self, data_type: str, name: str, level: int):
+        info = self.data[data_type][name]
+        old_names = self._by_level[data_type][info["level"]]
+        old_names.pop(name, None)
+        if not old_names:
+            del self._by_level[data_type][info["level"]]
+
+        info["level"] = int(level)
+        self._by_level[data_type].setdefault(int(level), {})[name] = None
+
+    def avatars(self, noun: str) -> list[str]:
+        return list(self.data["nouns"][noun].get("avatars") or [])
+
+    def avatar_count(self, noun: str) -> int:
+        return self._avatar_counts.get(noun, 0)
+
+    def avatar_owner(self, avatar: str) -> str:
+        # First noun that lists the avatar, or None
+        return next(iter(self._avatar_owners.get(avatar, {})), None)
+
+    def avatar_owners(self, avatar: str) -> list[str]:
+        return list(self._avatar_owners.get(avatar, {}))
+
+    def avatar_paths(self):
+        return self._avatar_owners.keys()
+
+    @property
+    def avatar_atlas(self) -> str:
+        # Godot path of the atlas index written by `deck_generator.py atlas`, or None before the first pack
+        return self.data.get("avatar_atlas")
+
+    def set_avatar_atlas(self, index_path: str) -> bool:
+        # True if the reference changed and the data needs saving
+        if self.data.get("avatar_atlas") == index_path:
+            return False
+        self.data["avatar_atlas"] = index_path
+        return True
+
+    def add_avatar(self, noun: str, avatar: str):
+        info = self.data["nouns"][noun]
+        if not info.get("avatars"):
+            info["avatars"] = []
+        info["avatars"].append(avatar)
+        self._avatar_owners.setdefault(avatar, {})[noun] = None
+        self._avatar_counts[noun] = len(info["avatars"])
+
+    def set_avatars(self, noun: str, avatars: list[str]):
+        info = self.data["nouns"][noun]
+        for avatar in info.get("avatars") or []:
+            owners = self._avatar_owners.get(avatar, {})
+            owners.pop(noun, None)
+            # Only forget the avatar once no noun lists it
+            if not owners:
+                self._avatar_owners.pop(avatar, None)
+
+        info["avatars"] = list(avatars)
+        for avatar in avatars:
+            self._avatar_owners.setdefault(avatar, {})[noun] = None
+        self._avatar_counts[noun] = len(avatars)
+
+    def sort(self):
+        # Order nouns and adjectives by (level, name), using the level index instead of sorting every entry by level
+        for data_type in DATA_TYPES:
+            entries = self.data[data_type]
+            self.data[data_type] = {
+                name: entries[name]
+                for level in sorted(self._by_level[data_type])
+                for name in sorted(self._by_level[data_type][level])
+            }
+            self._by_level[data_type] = {
+                level: { name: None for name in sorted(self._by_level[data_type][level]) }
+                for level in sorted(self._by_level[data_type])
+            }
+
+    def to_json(self) -> str:
+        # Same output as json.dumps(self.data, indent=3), which can't use the C encoder and spends most of a save on
+        # the nouns and adjectives. Entries with the usual { "level", "avatars" } shape are formatted directly.
+        parts = []
+        for key, value in self.data.items():
+            if key in DATA_TYPES and type(value) is dict and value:
+                body = "{\n      " + ",\n      ".join(_format_entry(name, info) for name, info in value.items()) + "\n   }"
+            else:
+                body = json.dumps(value, indent=3).replace("\n", "\n   ")
+            parts.append(encode_basestring_ascii(key) + ": " + body)
+        return "{\n   " + ",\n   ".join(parts) + "\n}" if parts else "{}"
+
+    def save(self, path: str = None, data: str = None):
+        atomic_write(path or self.path, data if data is not None else self.to_json())
+
+
+def _format_entry(name: str, info: dict) -> str:
+    # A noun or adjective entry at the indentation json.dumps(..., indent=3) gives it
+    level = info.get("level")
+    if type(level) is int and next(iter(info)) == "level" and (len(info) == 1 or (len(info) == 2 and type(info.get("avatars")) is list)):
+        entry = encode_basestring_ascii(name) + ': {\n         "level": ' + int.__repr__(level)
+        if len(info) == 2:
+            avatars = info["avatars"]
+            entry += ',\n         "avatars": ' + ("[\n            " + ",\n            ".join(map(encode_basestring_ascii, avatars)) + "\n         ]" if avatars else "[]")
+        return entry + "\n      }"
+    return encode_basestring_ascii(name) + ": " + json.dumps(info, indent=3).replace("\n", "\n      ")
+
+
+def generate_synthetic_data(noun_count: int, adjective_count: int, avatars_per_noun: int = 4, levels: int = 5, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    nouns = {}
+    for i in range(noun_count):
+        name = f"Noun{i:07d}"
+        nouns[name] = {
+            "level": rng.randrange(levels),
+            "avatars": [ f"res://assets/sprites/avatars/avatar_{name.lower()}_{j}.png" for j in range(avatars_per_noun) ],
+        }
+    adjectives = { f"Adjective{i:07d}": { "level": rng.randrange(levels) } for i in range(adjective_count) }
+    return { "starting_deck": {}, "stats": {}, "nouns": nouns, "adjectives": adjectives }
+
+
+def benchmark(noun_count: int, adjective_count: int, lookups: int = 10000):
+    def timed(label: str, fn):
+        start = time.perf_counter()
+        result = fn()
+        print(f"   {label}: {(time.perf_counter() - start) * 1000:.1f} ms")
+        return result
+
+    print(f"Benchmarking CardDatabase with {noun_count} nouns and {adjective_count} adjectives")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "cards.data.json")
+        with open(path, "w") as file:
+            file.write(json.dumps(generate_synthetic_data(noun_count, adjective_count), indent=3))
+        print(f"   File size: {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+
+        db = timed("Load and index", lambda: CardDatabase(path))
+        nouns = list(db.nouns)
+        rng = random.Random(1)
+        avatars = [ rng.choice(db.avatars(rng.choice(nouns))) for _ in range(lookups) ]
+
+        timed("Group nouns and adjectives by level", lambda: (db.levels("nouns"), db.levels("adjectives")))
+        timed(f"{lookups} avatar -> noun lookups (index)", lambda: [ db.avatar_owner(a) for a in avatars ])
+        timed(f"{lookups // 100} avatar -> noun lookups (linear scan, for comparison)", lambda: [
+            next(n for n, info in db.nouns.items() if a in info["avatars"]) for a in avatars[:lookups // 100]
+        ])
+        timed(f"{lookups} noun avatar counts", lambda: [ db.avatar_count(n) for n in nouns[:lookups] ])
+        timed(f"{lookups} new adjectives", lambda: [ db.add("adjectives", f"New{i}", i % 5) for i in range(lookups) ])
+        timed(f"{lookups} avatar additions", lambda: [ db.add_avatar(nouns[i], f"res://new_{i}.png") for i in range(lookups) ])
+        timed("Sort", db.sort)
+        timed("Save", db.save)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the indexed cards.data.json model on a synthetic file.")
+    parser.add_argument("--nouns", type=int, default=100000, help="Number of synthetic nouns.")
+    parser.add_argument("--adjectives", type=int, default=500000, help="Number of synthetic adjectives.")
+    args = parser.parse_args()
+
+    benchmark(args.nouns, args.adjectives)
@@ -0,0 +1,163 @@
+import argparse
+import collections
+import time
+
+import numpy as np
+
+from card_simulator import AI_DATA_PATH, CARDS_DATA_PATH, GameData, STAT_ACTIONS, SACRIFICE, RARITIES, analyze_pools_task, _init_worker
+from memory_usage import get_peak_rss_mb
+
+# Vectorized card pool sampler. Which stats a card ends up with only depends on its template and ability_costs, so the
+# exact distribution of outcomes of the ability point loop in CardGenerator is worked out once per (rarity, cost).
+# Pools are then drawn batch_size at a time as arrays of (stat, noun, adjective) indices, and the CardPoolAnalysis
+# histograms are counted per batch with bincounts and sorted run lengths, so memory stays fixed however many pools are
+# drawn. Avatars and foils don't show up in the analysis and aren't drawn.
+
+BATCH_SIZE = 20000
+
+
+def get_outcomes(template: dict, costs: dict) -> dict[tuple, float]:
+    # (attack, health, abilities) -> probability, following generate_card: a uniformly random affordable stat until
+    # none is left
+    outcomes = collections.defaultdict(float)
+
+    def spend(points: int, attack: int, health: int, abilities: list, probability: float):
+        actions = [ action for action in STAT_ACTIONS if action[0] in costs and costs[action[0]] <= points and action[1](abilities) ]
+        if not actions:
+            outcomes[(attack, health, tuple(sorted(abilities)))] += probability
+            return
+        for name, _, add_attack, add_health, ability in actions:
+            spend(points - costs[name], attack + add_attack, health + add_health, abilities + ([ ability ] if ability is not None else []), probability / len(actions))
+
+    spend(template.get("ability_points", 0), template["attack"], template["health"], [], 1.0)
+    return outcomes
+
+
+def get_slot_distributions(data: GameData) -> list[tuple]:
+    # (rarity, cost, cards per pool, {card key: probability}) in pool order
+    templates = data.stats["card_templates"]
+    costs = data.stats["ability_costs"]
+    pool_size = data.stats["pool_size"]
+    slots = [ (SACRIFICE, 0, pool_size["sacrifice"], [ templates["sacrifice"] ]) ]
+    for rarity in range(1, len(RARITIES)):
+        for cost, count in pool_size[RARITIES[rarity].lower()].items():
+            slots.append((rarity, int(cost), count, templates[RARITIES[rarity].lower()][str(cost)]))
+
+    distributions = []
+    for rarity, cost, count, options in slots:
+        if count == 0:
+            continue
+        weights = np.array([ option.get("prob", 1) for option in options ], dtype=np.float64)
+        keys = collections.defaultdict(float)
+        for option, weight in zip(options, weights / weights.sum()):
+            for (attack, health, abilities), probability in get_outcomes(option, costs).items():
+                keys[(cost, rarity, attack, health, len(abilities), abilities)] += weight * probability
+        distributions.append((rarity, cost, count, keys))
+    return distributions
+
+
+def run_lengths(values: np.ndarray) -> np.ndarray:
+    # Histogram of how many times each distinct value appears in each row: result[n] is the number of (row, value)
+    # pairs that appear n times, like counting every pool's Counter values
+    ordered = np.sort(values, axis=1)
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    positions = np.flatnonzero(starts.ravel())
+    lengths = np.diff(np.append(positions, ordered.size))
+    return np.bincount(lengths)
+
+
+class PoolSampler:
+    def __init__(self, data: GameData):
+        self.distributions = get_slot_distributions(data)
+        self.keys = sorted({ key for _, _, _, keys in self.distributions for key in keys })
+        key_ids = { key: i for i, key in enumerate(self.keys) }
+
+        # Nouns and adjectives are numbered across levels so a name is adjective * noun count + noun
+        self.nouns = sorted({ name for names in data.nouns.values() for name, _ in names })
+        self.adjectives = sorted({ name for names in data.adjectives.values() for name in names })
+        noun_ids = { name: i for i, name in enumerate(self.nouns) }
+        adjective_ids = { name: i for i, name in enumerate(self.adjectives) }
+
+        # Per slot: cumulative probabilities with their key ids, and the noun and adjective ids it draws from
+        self.slots = []
+        for rarity, cost, count, keys in self.distributions:
+            nouns = [ noun_ids[name] for name, _ in data.nouns.get(cost, []) ]
+            if not nouns:
+                raise ValueError(f"No level {cost} nouns to name a cost {cost} card")
+            adjectives = [ adjective_ids[name] for name in data.adjectives.get(min(rarity, 2), []) ]
+            if not adjectives:
+                raise ValueError(f"No level {min(rarity, 2)} adjectives to name a {RARITIES[rarity]} card")
+            cumulative = np.cumsum([ probability for probability in keys.values() ])
+            self.slots.append((count, cumulative / cumulative[-1], np.array([ key_ids[key] for key in keys ]), np.array(nouns), np.array(adjectives)))
+        self.pool_size = sum(slot[0] for slot in self.slots)
+
+    def sample(self, pools: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (key ids, noun ids, adjective ids) as (pools, pool size) arrays
+        keys = np.empty((pools, self.pool_size), dtype=np.int32)
+        nouns = np.empty((pools, self.pool_size), dtype=np.int32)
+        adjectives = np.empty((pools, self.pool_size), dtype=np.int32)
+        column = 0
+        for count, cumulative, key_ids, noun_ids, adjective_ids in self.slots:
+            shape = (pools, count)
+            picks = np.minimum(np.searchsorted(cumulative, rng.random(shape), side="right"), len(key_ids) - 1)
+            keys[:, column:column + count] = key_ids[picks]
+            nouns[:, column:column + count] = noun_ids[rng.integers(len(noun_ids), size=shape)]
+            adjectives[:, column:column + count] = adjective_ids[rng.integers(len(adjective_ids), size=shape)]
+            column += count
+        return keys, nouns, adjectives
+
+    def analyze(self, pools: int, seed: int = 0, batch_size: int = BATCH_SIZE) -> tuple[collections.Counter, list[collections.Counter]]:
+        # Same (totals, [card info, adjective, noun, name histograms]) as card_simulator.analyze_pools_task
+        rng = np.random.default_rng(seed)
+        totals = np.zeros(len(self.keys), dtype=np.int64)
+        histograms = [ np.zeros(1, dtype=np.int64) for _ in range(4) ]
+        for start in range(0, pools, batch_size):
+            keys, nouns, adjectives = self.sample(min(batch_size, pools - start), rng)
+            totals += np.bincount(keys.ravel(), minlength=len(self.keys))
+            names = adjectives.astype(np.int64) * len(self.nouns) + nouns
+            for i, values in enumerate((keys, adjectives, nouns, names)):
+                counts = run_lengths(values)
+                if len(counts) > len(histograms[i]):
+                    histograms[i] = np.pad(histograms[i], (0, len(counts) - len(histograms[i])))
+                histograms[i][:len(counts)] += counts
+
+        totals = collections.Counter({ self.keys[i]: int(count) for i, count in enumerate(totals) if count })
+        return totals, [ collections.Counter({ n: int(count) for n, count in enumerate(histogram) if count }) for histogram in histograms ]
+
+
+def compare_engines(pools: int, seed: int = 0, cards_path: str = CARDS_DATA_PATH, ai_path: str = AI_DATA_PATH) -> float:
+    # Largest difference in the share of any card stat line between this sampler and the per card generator
+    _init_worker(cards_path, ai_path)
+    python_totals, _ = analyze_pools_task(seed, pools)
+    numpy_totals, _ = PoolSampler(GameData(cards_path, ai_path)).analyze(pools, seed)
+    python_count, numpy_count = sum(python_totals.values()), sum(numpy_totals.values())
+    worst = 0
+    for key in set(python_totals) | set(numpy_totals):
+        difference = abs(python_totals[key] / python_count - numpy_totals[key] / numpy_count)
+        worst = max(worst, difference)
+    return worst
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized card pool sampler.")
+    parser.add_argument("--cards", type=int, default=10000000, help="Number of cards to draw.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Pools drawn at a time.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the pools.")
+    parser.add_argument("--compare", type=int, default=0, metavar="POOLS", help="Also check the stat distribution against the per card generator on this many pools.")
+    args = parser.parse_args()
+
+    sampler = PoolSampler(GameData())
+    pools = -(-args.cards // sampler.pool_size)
+    start = time.perf_counter()
+    totals, histograms = sampler.analyze(pools, args.seed, args.batch_size)
+    seconds = time.perf_counter() - start
+    print(f"Sampled {pools} pools ({sum(totals.values())} cards, {len(totals)} stat lines) in {seconds:.2f} seconds, "
+          f"peak RSS {get_peak_rss_mb():.0f} MB")
+    for label, histogram in zip(("Card stats", "Adjective", "Noun", "Card name"), histograms):
+        print(f"   {label} collisions: {dict(sorted(histogram.items())[:6])}")
+
+    if args.compare:
+        start = time.perf_counter()
+        print(f"Largest difference in a stat line's share against the per card generator over {args.compare} pools: {compare_engines(args.compare, args.seed):.4f} "
+              f"({time.perf_counter() - start:.1f} seconds)")
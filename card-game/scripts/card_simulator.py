@@ -0,0 +1,979 @@
+import argparse
+import collections
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from card_database import CardDatabase
+
+# Headless port of the card pool and game balance analysis in scenes/test (CardPoolAnalyzer.cs, GameAnalyzer.cs),
+# with the card generator (CardGenerator.cs), enemy AI (AIGenerator.cs, EnemyAI.cs) and game simulator
+# (GameSimulator.cs) they use. Reads the same settings/cards.data.json and settings/ai.data.json, runs pools and games
+# on a process pool and writes the same CSV files the analysis notebooks read.
+#
+# The rules and heuristics follow the C# code. Random numbers come from Python's random module, so a seed doesn't
+# reproduce a Godot run, but every run with the same seed and settings gives the same CSVs.
+
+CARDS_DATA_PATH = "../settings/cards.data.json"
+AI_DATA_PATH = "../settings/ai.data.json"
+OUTPUT_DIR = "analysis/data"
+
+RARITIES = ["Sacrifice", "Common", "Uncommon", "Rare"]
+SACRIFICE, COMMON, UNCOMMON, RARE = range(4)
+BLOOD_COSTS = ["Zero", "One", "Two", "Three"]
+ABILITIES = ["None", "Flying", "Tall", "Lethal"]
+FLYING, TALL, LETHAL = 1, 2, 3
+MAX_CARD_ABILITIES = 2
+DIFFICULTIES = ["Easy", "Medium", "Hard"]
+ROUND_RESULTS = ["PlayerWin", "EnemyWin", "Stalemate", "MaxTurnsReached"]
+PLAYER_WIN, ENEMY_WIN, STALEMATE, MAX_TURNS_REACHED = range(4)
+
+# Lanes are a flat list indexed by column * ROW_COUNT + row
+COL_COUNT = 4
+ROW_COUNT = 3
+PLAYER_ROW, ENEMY_ROW, STAGE_ROW = range(3)
+
+# Draw actions
+NO_DRAW, DRAW_CREATURE, DRAW_SACRIFICE = range(3)
+MIN_HEURISTIC_SCORE = 1
+
+# C# Random.Next() range, used for per game seeds
+MAX_SEED = 2**31 - 1
+
+
+class Card:
+    # CardInfo. Cards are never changed once generated, damage is tracked by the simulator.
+    __slots__ = ("noun", "adjective", "avatar", "foil", "attack", "health", "abilities", "cost", "rarity", "flying", "tall", "lethal", "key")
+
+    def __init__(self, noun: str, adjective: str, avatar: str, foil: str, attack: int, health: int, abilities: tuple, cost: int, rarity: int):
+        self.noun = noun
+        self.adjective = adjective
+        self.avatar = avatar
+        self.foil = foil
+        self.attack = attack
+        self.health = health
+        self.abilities = tuple(sorted(abilities))
+        self.cost = cost
+        self.rarity = rarity
+        self.flying = FLYING in abilities
+        self.tall = TALL in abilities
+        self.lethal = LETHAL in abilities
+        # CardAnalysisKey, which also sorts the analysis CSVs: cost, rarity, attack, health, ability count, abilities
+        self.key = (cost, rarity, attack, health, len(self.abilities), self.abilities)
+
+    @property
+    def name(self) -> str:
+        return f"{self.adjective} {self.noun}"
+
+    def renamed(self, noun: str, adjective: str, avatar: str) -> "Card":
+        return Card(noun, adjective, avatar, self.foil, self.attack, self.health, self.abilities, self.cost, self.rarity)
+
+
+class GameData:
+    # The parts of cards.data.json and ai.data.json the generators use, with nouns and adjectives grouped by level
+    def __init__(self, cards_path: str = CARDS_DATA_PATH, ai_path: str = AI_DATA_PATH, cards_data: dict = None, ai_data: dict = None):
+        db = CardDatabase(cards_path, cards_data)
+        self.stats = db.data["stats"]
+        self.starting_deck = db.data["starting_deck"]
+        self.nouns = { level: [ (name, db.avatars(name)) for name in names ] for level, names in db.levels("nouns").items() }
+        self.adjectives = db.levels("adjectives")
+        self.noun_avatars = { name: db.avatars(name) for name in db.nouns }
+        if ai_data is None:
+            import json
+            with open(ai_path, "r") as file:
+                ai_data = json.loads(file.read())
+        self.ai = ai_data
+
+
+def select_odds(rnd: random.Random, values: list, odds: list):
+    # RandomGenerator.SelectRandomOdds
+    value = rnd.randrange(sum(odds))
+    total = 0
+    for item, weight in zip(values, odds):
+        total += weight
+        if total > value:
+            return item
+    raise ValueError(f"Invalid odds, nothing selected (value {value}, odds {odds})")
+
+
+def next_float(rnd: random.Random, low: float, high: float) -> float:
+    return rnd.random() * (high - low) + low
+
+
+# --- Card pools (CardGenerator.cs) ---
+
+def _can_add_ability(ability: int, blocked_by: int = None):
+    return lambda abilities: len(abilities) < MAX_CARD_ABILITIES and ability not in abilities and blocked_by not in abilities
+
+
+# (ability_costs name, can apply, attack, health, ability), in the order CardGenerator.StatActions lists them
+STAT_ACTIONS = [
+    ("flying", _can_add_ability(FLYING, TALL), 0, 0, FLYING),
+    ("attack", lambda abilities: True, 1, 0, None),
+    ("tall", _can_add_ability(TALL, FLYING), 0, 0, TALL),
+    ("health", lambda abilities: True, 0, 1, None),
+    ("lethal", _can_add_ability(LETHAL), 0, 0, LETHAL),
+]
+
+
+def generate_card(data: GameData, rarity: int, cost: int, rnd: random.Random) -> Card:
+    nouns = data.nouns.get(cost)
+    if not nouns:
+        raise ValueError(f"No level {cost} nouns to name a {BLOOD_COSTS[cost]} cost card")
+    noun, avatars = nouns[rnd.randrange(len(nouns))]
+    adjective_level = min(rarity, 2)
+    adjectives = data.adjectives.get(adjective_level)
+    if not adjectives:
+        raise ValueError(f"No level {adjective_level} adjectives to name a {RARITIES[rarity]} card")
+    adjective = adjectives[rnd.randrange(len(adjectives))]
+    avatar = avatars[rnd.randrange(len(avatars))] if avatars else None
+
+    templates = data.stats["card_templates"]
+    foil = None
+    if rarity == SACRIFICE:
+        options = [ templates["sacrifice"] ]
+    else:
+        options = templates[RARITIES[rarity].lower()][str(cost)]
+    if rarity == RARE:
+        color = [ next_float(rnd, 0.25, 0.75), next_float(rnd, 0.25, 0.80), next_float(rnd, 0.25, 0.75) ]
+        foil = "".join(f"{round(c * 255):02x}" for c in color) + "ff"
+    template = select_odds(rnd, options, [ option.get("prob", 1) for option in options ])
+
+    # Spend the template's ability points on random affordable stats until none is left
+    costs = data.stats["ability_costs"]
+    points = template.get("ability_points", 0)
+    attack = template["attack"]
+    health = template["health"]
+    abilities = []
+    for _ in range(1000):
+        actions = [ action for action in STAT_ACTIONS if action[0] in costs and costs[action[0]] <= points and action[1](abilities) ]
+        if not actions:
+            break
+        name, _, add_attack, add_health, ability = actions[rnd.randrange(len(actions))]
+        attack += add_attack
+        health += add_health
+        if ability is not None:
+            abilities.append(ability)
+        points -= costs[name]
+
+    return Card(noun, adjective, avatar, foil, attack, health, abilities, cost, rarity)
+
+
+def generate_card_pool(data: GameData, rnd: random.Random, pool_size: dict = None) -> list[Card]:
+    pool_size = pool_size or data.stats["pool_size"]
+    cards = [ generate_card(data, SACRIFICE, 0, rnd) for _ in range(pool_size["sacrifice"]) ]
+    for rarity in (COMMON, UNCOMMON, RARE):
+        for cost, count in pool_size[RARITIES[rarity].lower()].items():
+            cards.extend(generate_card(data, rarity, int(cost), rnd) for _ in range(count))
+    return cards
+
+
+def override_card_pool(data: GameData, pool: list[Card], rnd: random.Random, level: int, noun: str, adjective: str) -> list[Card]:
+    # CardGenerator.OverrideCardPool, "*" picks a noun or adjective that fits the level
+    if noun == "*":
+        noun_level = 0 if level == 1 else 1 if level <= 4 else 2 if level <= 7 else 3
+        names = [ name for name, _ in data.nouns.get(noun_level, []) ]
+        noun = names[rnd.randrange(len(names))]
+    if adjective == "*":
+        adjective_level = 0 if level == 1 else 1 if level <= 5 else 2
+        names = data.adjectives.get(adjective_level, [])
+        adjective = names[rnd.randrange(len(names))]
+    if noun and noun not in data.noun_avatars:
+        print(f"[OverrideCard] Noun {noun} not found in generator data.")
+        noun = None
+
+    cards = []
+    for card in pool:
+        avatar = card.avatar
+        if noun:
+            avatars = data.noun_avatars[noun]
+            avatar = avatars[rnd.randrange(len(avatars))] if avatars else None
+        cards.append(card.renamed(noun or card.noun, adjective or card.adjective, avatar))
+    return cards
+
+
+# --- Enemy AI (AIGenerator.cs, EnemyAI.cs) ---
+
+def linear_scale(x: int, parameters: dict, rnd: random.Random = None) -> int:
+    low, high = parameters.get("min", 0), parameters.get("max", 0)
+    y = (x - parameters.get("x_intercept", 0)) * parameters.get("rate", 0) + parameters.get("y_intercept", 0)
+    if rnd is not None:
+        amount = parameters.get("random", 0)
+        y += next_float(rnd, -amount, amount)
+    y = min(max(y, low), high)
+    return min(max(round(y + 1e-6), low), high)
+
+
+def value_for_turn(turn: int, values: list):
+    return values[min(max(turn, 0), len(values) - 1)]
+
+
+def cost_odds(turn: int, parameters: dict, allow_zero=True) -> list[int]:
+    odds = [ value_for_turn(turn, parameters[f"play_{name}_cost_probability"]) for name in ("one", "two", "three") ]
+    return [ 100 - sum(odds) if allow_zero else 0 ] + odds
+
+
+def rarity_odds(level: int, parameters: dict) -> list[int]:
+    uncommon = linear_scale(level, parameters["play_uncommon_probability"])
+    rare = linear_scale(level, parameters["play_rare_probability"])
+    return [ 100 - uncommon - rare, uncommon, rare ]
+
+
+class EnemyAI:
+    # Scripted moves are (turn, card, lane or None). Only which moves were played and the lane RNG change while a
+    # game is simulated, so a clone shares the moves.
+    __slots__ = ("moves", "resolved", "rnd", "max_turn", "is_template")
+
+    def __init__(self, moves: list[tuple], rnd: random.Random, is_template=False, resolved: set = None):
+        self.moves = moves
+        self.resolved = resolved or set()
+        self.rnd = random.Random()
+        self.rnd.setstate(rnd.getstate())
+        self.max_turn = max((move[0] for move in moves), default=0)
+        self.is_template = is_template
+
+    def clone(self) -> "EnemyAI":
+        return EnemyAI(self.moves, self.rnd, self.is_template, set(self.resolved))
+
+    def moves_for_turn(self, turn: int, occupied: list[bool]) -> list[tuple]:
+        # (card, lane) for each move due by this turn that fits in a free staging lane
+        played = []
+        for index, (move_turn, card, lane) in enumerate(self.moves):
+            if move_turn > turn or index in self.resolved:
+                continue
+            if all(occupied):
+                break
+            if lane is not None:
+                if lane < 0 or lane >= len(occupied):
+                    print(f"Scripted Move has an invalid lane value {lane}.")
+                    self.resolved.add(index)
+                    continue
+                if occupied[lane]:
+                    continue
+            else:
+                free = [ column for column, taken in enumerate(occupied) if not taken ]
+                lane = free[self.rnd.randrange(len(free))]
+            occupied[lane] = True
+            self.resolved.add(index)
+            played.append((card, lane))
+        return played
+
+
+def pick_card(pool: list[Card], rnd: random.Random, cost: int, rarity: int, min_attack: int = None) -> Card:
+    cards = [ card for card in pool if card.cost == cost and card.rarity == rarity and (min_attack is None or card.attack >= min_attack) ]
+    return cards[rnd.randrange(len(cards))] if cards else None
+
+
+def best_matching_card(pool: list[Card], rnd: random.Random, move: dict, cost: int, rarity: int) -> Card:
+    # Filters that would leave no cards are skipped, so the earlier ones matter most
+    filters = [
+        lambda card: ABILITIES.index(move["ability"]) in card.abilities if move.get("ability") else None,
+        lambda card: card.attack == move["attack"] if move.get("attack") is not None else None,
+        lambda card: card.health == move["health"] if move.get("health") is not None else None,
+        lambda card: card.cost == cost,
+        lambda card: card.rarity == rarity,
+    ]
+    cards = pool
+    for check in filters:
+        matching = [ card for card in cards if check(card) ]
+        if matching and check(matching[0]) is not None:
+            cards = matching
+    return cards[rnd.randrange(len(cards))] if cards else None
+
+
+def generate_random_ai(pool: list[Card], level: int, rnd: random.Random, parameters: dict) -> EnemyAI:
+    total_cards = linear_scale(level, parameters["total_cards"], rnd)
+    count_odds = [ linear_scale(level, parameters[f"play_{name}_probability"]) for name in ("one_card", "two_cards", "three_cards", "four_cards") ]
+    count_odds.insert(0, 100 - sum(count_odds))
+    rarities = rarity_odds(level, parameters)
+
+    turn = 0
+    played = 0
+    moves = []
+    while played < total_cards:
+        count = select_odds(rnd, [0, 1, 2, 3, 4], count_odds)
+        costs = cost_odds(turn, parameters)
+
+        # Guardrails: play a card by turn 2 and some attack by turn 3
+        if not moves and turn == 1:
+            count = 1
+        min_attack = None
+        if turn == 2 and sum(move[1].attack for move in moves) == 0:
+            count = 1
+            min_attack = 1
+            costs[0] = 0
+
+        for _ in range(count):
+            cost = select_odds(rnd, [0, 1, 2, 3], costs)
+            rarity = select_odds(rnd, [COMMON, UNCOMMON, RARE], rarities)
+            if cost == 0 and rarity == COMMON:
+                rarity = SACRIFICE
+            card = pick_card(pool, rnd, cost, rarity, min_attack)
+            if card is None:
+                continue
+            # Uncommon and rare cards count as two
+            played += 1 if rarity in (SACRIFICE, COMMON) else 2
+            moves.append((turn, card, None))
+
+        # Playing 3 or 4 cards skips the next turn or two
+        turn += 1 + { 3: 1, 4: 2 }.get(count, 0)
+
+    return EnemyAI(moves, rnd)
+
+
+def generate_template_ai(data: GameData, pool: list[Card], template: dict, level: int, rnd: random.Random) -> EnemyAI:
+    parameters = data.ai["ai_generator_probabilities"]
+    if template.get("noun_override") or template.get("adjective_override"):
+        pool = override_card_pool(data, pool, rnd, level, template.get("noun_override"), template.get("adjective_override"))
+    if not template.get("scripted_moves"):
+        return generate_random_ai(pool, level, rnd, parameters)
+
+    moves = []
+    for move in template["scripted_moves"]:
+        if (move.get("min_level") is not None and level < move["min_level"]) or (move.get("max_level") is not None and level > move["max_level"]):
+            continue
+        # Unspecified costs and rarities follow the random AI curves (without changing the template, unlike the C#)
+        cost = BLOOD_COSTS.index(move["cost"]) if move.get("cost") else select_odds(rnd, [0, 1, 2, 3], cost_odds(move["turn"], parameters))
+        rarity = RARITIES.index(move["rarity"]) if move.get("rarity") else select_odds(rnd, [COMMON, UNCOMMON, RARE], rarity_odds(level, parameters))
+        card = best_matching_card(pool, rnd, move, cost, rarity)
+        if card is not None:
+            moves.append((move["turn"], card, move.get("lane")))
+    return EnemyAI(moves, rnd, is_template=True)
+
+
+def generate_enemy_ai(data: GameData, pool: list[Card], level: int, rnd: random.Random) -> EnemyAI:
+    templates = [ template for template in data.ai["ai_templates"]
+                  if (template.get("min_level") is None or template["min_level"] <= level) and (template.get("max_level") is None or template["max_level"] >= level) ]
+    use_template = rnd.randrange(100) < value_for_turn(level, data.ai["levels"]["use_template_probability"])
+    if use_template and templates:
+        template = select_odds(rnd, templates, [ template.get("weight") or 1 for template in templates ])
+        return generate_template_ai(data, pool, template, level, rnd)
+    return generate_random_ai(pool, level, rnd, data.ai["ai_generator_probabilities"])
+
+
+# --- Player progress (GameAnalyzer.cs, GameLobby.cs) ---
+
+def take_random(cards: list, count: int, rnd: random.Random) -> list:
+    cards = list(cards)
+    return [ cards.pop(rnd.randrange(len(cards))) for _ in range(count) ]
+
+
+def generate_starting_deck(data: GameData, pool: list[Card], rnd: random.Random) -> list[Card]:
+    deck_size = data.starting_deck["starting_deck_size"]
+    sacrifices = data.starting_deck["starting_sacrifice_count"]
+    # 25-50% of the starting creatures cost one, the rest two or three
+    creatures = deck_size - sacrifices
+    one_cost = math.ceil(next_float(rnd, 0.25, 0.50) * creatures)
+    deck = take_random([ card for card in pool if card.rarity == SACRIFICE ], sacrifices, rnd)
+    deck += take_random([ card for card in pool if card.cost == 1 and card.rarity == COMMON ], one_cost, rnd)
+    deck += take_random([ card for card in pool if card.cost > 1 and card.rarity == COMMON ], creatures - one_cost, rnd)
+    return deck
+
+
+def draft_cards(pool: list[Card], count: int, rnd: random.Random, rarity: int) -> list[Card]:
+    options = [ card for card in pool if card.rarity == rarity ]
+    if not options:
+        raise ValueError("Not enough cards to draft")
+    return options if len(options) <= count else take_random(options, count, rnd)
+
+
+def generate_progress(data: GameData, pool: list[Card], level: int, rnd: random.Random) -> tuple[list[Card], int]:
+    # (deck, hand size) after playing level - 1 levels with made up difficulties
+    hand_size = data.starting_deck["starting_hand_size"]
+    deck = generate_starting_deck(data, pool, rnd)
+    levels = data.ai["levels"]
+    for _ in range(level):
+        difficulty = select_odds(rnd, DIFFICULTIES, [50, 30, 20])
+        if level == 1:
+            difficulty = "Easy"
+        if level <= 3 and difficulty == "Hard":
+            difficulty = "Medium"
+        odds = levels["reward_odds"][difficulty]
+        reward = select_odds(rnd, list(odds), list(odds.values()))
+
+        if reward == "AddResource":
+            deck += draft_cards(pool, levels["sacrifices_to_add_per_reward"], rnd, SACRIFICE)
+        elif reward == "AddCreature":
+            deck += draft_cards(pool, 1, rnd, COMMON)
+        elif reward == "AddUncommonCreature":
+            deck += draft_cards(pool, 1, rnd, UNCOMMON)
+        elif reward == "AddRareCreature":
+            deck += draft_cards(pool, 1, rnd, RARE)
+        elif reward == "IncreaseHandSize":
+            hand_size += 1
+        elif reward == "RemoveCard":
+            commons = [ card for card in deck if card.rarity == COMMON ]
+            if commons:
+                deck.remove(commons[rnd.randrange(len(commons))])
+    return deck, hand_size
+
+
+def shuffle(cards: list, rnd: random.Random) -> list:
+    # Deck.ShuffleCards, cards are drawn from the end
+    cards = list(cards)
+    for i in range(len(cards) - 1, 0, -1):
+        j = rnd.randrange(i + 1)
+        cards[i], cards[j] = cards[j], cards[i]
+    return cards
+
+
+# --- Game simulator (GameSimulator.cs) ---
+
+def card_damage(attacker: Card, defender: Card) -> int:
+    # Lethal takes all of the defender's health
+    if attacker.lethal and defender is not None:
+        return defender.health
+    return attacker.attack
+
+
+def is_blocked(attacker: Card, defender: Card) -> bool:
+    # Flying attackers go over defenders that can't fly and aren't tall
+    if defender is None:
+        return False
+    return not (attacker.flying and not defender.flying and not defender.tall)
+
+
+class State:
+    # Cards in play are (id, card, damage received) tuples, replaced rather than changed when damaged, so a clone only
+    # copies the lists. The decks are shared, each state only tracks how many cards were drawn.
+    __slots__ = ("turn", "is_player_move", "player_damage", "enemy_damage", "hand", "lanes", "creatures_drawn", "sacrifices_drawn", "player_graveyard", "enemy_graveyard", "ai")
+
+    def clone(self) -> "State":
+        state = State()
+        state.turn = self.turn
+        state.is_player_move = self.is_player_move
+        state.player_damage = self.player_damage
+        state.enemy_damage = self.enemy_damage
+        state.hand = list(self.hand)
+        state.lanes = list(self.lanes)
+        state.creatures_drawn = self.creatures_drawn
+        state.sacrifices_drawn = self.sacrifices_drawn
+        state.player_graveyard = list(self.player_graveyard)
+        state.enemy_graveyard = list(self.enemy_graveyard)
+        state.ai = self.ai.clone()
+        return state
+
+
+class GameSimulator:
+    def __init__(self, max_turns=50, max_branch_per_turn=1, max_queue_size=10000, max_state_iterations=100000,
+                 always_draw_creature=False, always_draw_sacrifice=False, check_duplicate_states=True):
+        self.max_turns = max_turns
+        self.max_branch_per_turn = max_branch_per_turn
+        self.max_queue_size = max_queue_size
+        self.max_state_iterations = max_state_iterations
+        self.always_draw_creature = always_draw_creature
+        self.always_draw_sacrifice = always_draw_sacrifice
+        self.check_duplicate_states = check_duplicate_states
+        self.circuit_breaker_tripped = False
+
+    def simulate(self, creatures: list[Card], sacrifices: list[Card], hand_size: int, ai: EnemyAI, card_summary=True) -> dict:
+        # Explores the game breadth first, branching on the best few player actions each turn. Returns the result of
+        # every explored game ("rounds") and per card summaries for both sides.
+        self.next_card_id = 0
+        self.lane_analysis = {}
+        self.creatures = [ self._new_card(card) for card in creatures ]
+        self.sacrifices = [ self._new_card(card) for card in sacrifices ]
+        self.player_summary = {} if card_summary else None
+        self.enemy_summary = {} if card_summary else None
+
+        state = State()
+        state.turn = 1
+        state.is_player_move = True
+        state.player_damage = 0
+        state.enemy_damage = 0
+        state.hand = []
+        state.lanes = [None] * (COL_COUNT * ROW_COUNT)
+        state.creatures_drawn = 0
+        state.sacrifices_drawn = 0
+        state.player_graveyard = []
+        state.enemy_graveyard = []
+        state.ai = ai
+        for _ in range(min(hand_size, len(self.creatures))):
+            state.hand.append(self._draw(state, creatures=True))
+        for card, lane in ai.moves_for_turn(0, [False] * COL_COUNT):
+            self._play(state, self._new_card(card), lane, enemy=True)
+
+        rounds = []
+        queue = collections.deque([ state ])
+        seen = set()
+        duplicates = 0
+        iterations = 0
+        while queue:
+            iterations += 1
+            if iterations > self.max_state_iterations:
+                break
+            if len(queue) > self.max_queue_size:
+                self.circuit_breaker_tripped = True
+
+            state = queue.popleft()
+            next_states = self._step_player(state) if state.is_player_move else [ self._step_enemy(state) ]
+            for next_state in next_states:
+                if self.check_duplicate_states:
+                    key = self._state_key(next_state)
+                    if key in seen:
+                        duplicates += 1
+                        continue
+                result = self._round_result(next_state)
+                if result is None:
+                    queue.append(next_state)
+                    if self.check_duplicate_states:
+                        seen.add(key)
+                else:
+                    rounds.append((result, next_state.turn, next_state.player_damage, next_state.enemy_damage))
+                    self._summarize_round(next_state, result)
+
+        return { "rounds": rounds, "player_summary": self.player_summary, "enemy_summary": self.enemy_summary, "duplicate_states": duplicates }
+
+    def _new_card(self, card: Card) -> tuple:
+        self.next_card_id += 1
+        return (self.next_card_id, card, 0)
+
+    def _draw(self, state: State, creatures: bool) -> tuple:
+        if creatures:
+            state.creatures_drawn += 1
+            return self.creatures[-state.creatures_drawn]
+        state.sacrifices_drawn += 1
+        return self.sacrifices[-state.sacrifices_drawn]
+
+    def _play(self, state: State, card: tuple, column: int, enemy: bool):
+        index = column * ROW_COUNT + (STAGE_ROW if enemy else PLAYER_ROW)
+        if state.lanes[index] is not None:
+            raise ValueError(f"Attempted to play card in occupied lane {column}!")
+        state.lanes[index] = card
+
+    @staticmethod
+    def _state_key(state: State) -> tuple:
+        # SimulatorState.Equals: hand order doesn't matter, board order and damage do, the AI is ignored
+        return (state.turn, state.is_player_move, state.player_damage, state.enemy_damage, state.creatures_drawn, state.sacrifices_drawn,
+                frozenset(card[0] for card in state.hand), tuple((card[0], card[2]) if card else None for card in state.lanes))
+
+    def _round_result(self, state: State) -> int:
+        if abs(state.enemy_damage - state.player_damage) >= 5 or state.turn > 100:
+            return PLAYER_WIN if state.player_damage < state.enemy_damage else ENEMY_WIN
+        if not state.hand and state.creatures_drawn == len(self.creatures) and state.ai.max_turn < state.turn:
+            player_attack = sum(card[1].attack for card in state.lanes[PLAYER_ROW::ROW_COUNT] if card)
+            enemy_attack = sum(card[1].attack for card in state.lanes[ENEMY_ROW::ROW_COUNT] + state.lanes[STAGE_ROW::ROW_COUNT] if card)
+            if player_attack == enemy_attack:
+                return STALEMATE
+        if state.turn > self.max_turns:
+            return MAX_TURNS_REACHED
+        return None
+
+    def _summarize_round(self, state: State, result: int):
+        if self.player_summary is None:
+            return
+        # Cards still on the board (not the enemy staging row) and in the graveyard
+        player_cards = [ card[1] for card in state.lanes[PLAYER_ROW::ROW_COUNT] if card ] + [ card[1] for card in state.player_graveyard ]
+        enemy_cards = [ card[1] for card in state.lanes[ENEMY_ROW::ROW_COUNT] if card ] + [ card[1] for card in state.enemy_graveyard ]
+        for cards, summary, won, lost in ((player_cards, self.player_summary, PLAYER_WIN, ENEMY_WIN), (enemy_cards, self.enemy_summary, ENEMY_WIN, PLAYER_WIN)):
+            for card in cards:
+                entry = _summary_entry(summary, card)
+                entry[0] += 1
+                if result == won:
+                    entry[3] += 1
+                elif result == lost:
+                    entry[4] += 1
+
+    def _resolve_combat(self, state: State, player_turn: bool):
+        attack_row, defend_row = (PLAYER_ROW, ENEMY_ROW) if player_turn else (ENEMY_ROW, PLAYER_ROW)
+        attack_summary, defend_summary = (self.player_summary, self.enemy_summary) if player_turn else (self.enemy_summary, self.player_summary)
+        graveyard = state.enemy_graveyard if player_turn else state.player_graveyard
+        for column in range(COL_COUNT):
+            attacker = state.lanes[column * ROW_COUNT + attack_row]
+            if attacker is None:
+                continue
+            defender = state.lanes[column * ROW_COUNT + defend_row]
+            defender_card = defender[1] if defender else None
+            damage = card_damage(attacker[1], defender_card)
+            if attack_summary is not None:
+                _summary_entry(attack_summary, attacker[1])[1] += damage
+
+            if is_blocked(attacker[1], defender_card):
+                defender = (defender[0], defender_card, defender[2] + damage)
+                if defend_summary is not None:
+                    _summary_entry(defend_summary, defender_card)[2] += damage
+                if defender[2] >= defender_card.health:
+                    state.lanes[column * ROW_COUNT + defend_row] = None
+                    graveyard.append(defender)
+                else:
+                    state.lanes[column * ROW_COUNT + defend_row] = defender
+            elif player_turn:
+                state.enemy_damage += damage
+            else:
+                state.player_damage += damage
+
+    def _step_player(self, state: State) -> list[State]:
+        next_states = []
+        for draw, card_actions, _ in self._player_actions(state):
+            next_state = state.clone()
+            if draw != NO_DRAW:
+                next_state.hand.append(self._draw(next_state, creatures=draw == DRAW_CREATURE))
+            for card, column, sacrifices in card_actions:
+                self._play_from_hand(next_state, card, column, sacrifices)
+            self._resolve_combat(next_state, player_turn=True)
+            next_state.is_player_move = False
+            next_states.append(next_state)
+        return next_states
+
+    def _step_enemy(self, state: State) -> State:
+        # Changes the state in place, the enemy turn doesn't branch
+        lanes = state.lanes
+        for column in range(COL_COUNT):
+            staged = column * ROW_COUNT + STAGE_ROW
+            if lanes[staged - 1] is None and lanes[staged] is not None:
+                lanes[staged - 1] = lanes[staged]
+                lanes[staged] = None
+
+        occupied = [ card is not None for card in lanes[STAGE_ROW::ROW_COUNT] ]
+        for card, lane in state.ai.moves_for_turn(state.turn, occupied):
+            self._play(state, self._new_card(card), lane, enemy=True)
+        self._resolve_combat(state, player_turn=False)
+        state.turn += 1
+        state.is_player_move = True
+        return state
+
+    def _play_from_hand(self, state: State, card: tuple, column: int, sacrifices: list[tuple]):
+        for sacrifice in sacrifices:
+            if _remove_by_id(state.hand, sacrifice[0]):
+                continue
+            if _remove_by_id(state.lanes, sacrifice[0], replace=True):
+                state.player_graveyard.append(sacrifice)
+                continue
+            raise ValueError(f"Attempted to sacrifice a card that was not in the hand or on the board! [{sacrifice[1].name}]")
+        if not _remove_by_id(state.hand, card[0]):
+            raise ValueError(f"Attempted to play a card that was not in the hand! [{card[1].name}]")
+        self._play(state, card, column, enemy=False)
+
+    def _player_actions(self, state: State) -> list[tuple]:
+        # (draw action, [(card, column, sacrifices)], heuristic score) for the best few actions
+        count = 1 if self.circuit_breaker_tripped else self.max_branch_per_turn
+        top = []
+        for creatures in (False, True):
+            for action in self._best_actions_after_draw(state, creatures):
+                if action[2] >= MIN_HEURISTIC_SCORE:
+                    _add_if_in_top(top, count, action)
+
+        if not top:
+            # Nothing worth playing, just draw
+            if state.sacrifices_drawn < len(self.sacrifices):
+                top.append((DRAW_SACRIFICE, [], None))
+            elif state.creatures_drawn < len(self.creatures):
+                top.append((DRAW_CREATURE, [], None))
+            else:
+                top.append((NO_DRAW, [], None))
+        return top
+
+    def _best_actions_after_draw(self, state: State, creatures: bool) -> list[tuple]:
+        deck, drawn = (self.creatures, state.creatures_drawn) if creatures else (self.sacrifices, state.sacrifices_drawn)
+        if drawn == len(deck):
+            return []
+        draw = DRAW_CREATURE if creatures else DRAW_SACRIFICE
+        actions = self._best_card_actions(draw, state.hand + [ deck[-drawn - 1] ], state.lanes)
+        if self.always_draw_creature if creatures else self.always_draw_sacrifice:
+            actions.append((draw, [], MIN_HEURISTIC_SCORE))
+        return actions
+
+    def _best_card_actions(self, draw: int, hand: list[tuple], lanes: list) -> list[tuple]:
+        # The best lane for each creature that can be paid for, keeping the top max_branch_per_turn
+        board = sorted((card for card in lanes[PLAYER_ROW::ROW_COUNT] if card), key=lambda card: self._sacrifice_cost(card, lanes))
+        hand_sacrifices = [ card for card in hand if card[1].cost == 0 ]
+        open_lanes = COL_COUNT - len(board)
+
+        best = []
+        for creature in hand:
+            needed = creature[1].cost
+            if needed == 0:
+                continue
+            from_hand = min(needed, len(hand_sacrifices), open_lanes)
+            sacrifices = hand_sacrifices[:from_hand] + board[:needed - from_hand]
+            if len(sacrifices) != needed:
+                continue
+
+            sacrifice_cost = sum(self._sacrifice_cost(card, lanes) for card in sacrifices)
+            sacrificed_ids = { card[0] for card in sacrifices }
+            best_for_card = None
+            for column in range(COL_COUNT):
+                existing = lanes[column * ROW_COUNT + PLAYER_ROW]
+                if existing is not None and existing[0] not in sacrificed_ids:
+                    continue
+                score = self._play_score(creature, column, lanes) - sacrifice_cost
+                if best_for_card is None or score > best_for_card[2]:
+                    best_for_card = (draw, [ (creature, column, sacrifices) ], score)
+            if best_for_card is not None:
+                _add_if_in_top(best, self.max_branch_per_turn, best_for_card)
+        return best
+
+    def _sacrifice_cost(self, card: tuple, lanes: list) -> int:
+        # Damage the card would prevent and deal over the next turns if it stayed on the board (0 if it isn't on it)
+        for column in range(COL_COUNT):
+            base = column * ROW_COUNT
+            if lanes[base + PLAYER_ROW] is not None and lanes[base + PLAYER_ROW][0] == card[0]:
+                enemy, staged = lanes[base + ENEMY_ROW], lanes[base + STAGE_ROW]
+                stay = self._analyze_lane(card, enemy, staged)
+                leave = self._analyze_lane(None, enemy, staged)
+                return (leave[0] - stay[0]) + (stay[1] - leave[1])
+        return 0
+
+    def _play_score(self, card: tuple, column: int, lanes: list) -> int:
+        # Damage prevented and dealt over the next turns by playing the card in the lane (assuming it's emptied first)
+        enemy, staged = lanes[column * ROW_COUNT + ENEMY_ROW], lanes[column * ROW_COUNT + STAGE_ROW]
+        without = self._analyze_lane(None, enemy, staged)
+        playing = self._analyze_lane(card, enemy, staged)
+        return (without[0] - playing[0]) + (playing[1] - without[1])
+
+    def _analyze_lane(self, player: tuple, enemy: tuple, staged: tuple, turns: int = 3) -> tuple[int, int]:
+        # (player damage, enemy damage) over the next turns of combat in one lane, player first. Cached per game on
+        # the cards and their damage, the same lanes are analyzed over and over.
+        key = (player[1] if player else None, player[2] if player else 0, enemy[1] if enemy else None, enemy[2] if enemy else 0, staged[1] if staged else None, staged[2] if staged else 0)
+        result = self.lane_analysis.get(key)
+        if result is not None:
+            return result
+
+        player_card, player_hit, enemy_card, enemy_hit, staged_card, staged_hit = key
+        player_damage = enemy_damage = 0
+        for _ in range(turns):
+            if player_card is not None:
+                damage = card_damage(player_card, enemy_card)
+                if is_blocked(player_card, enemy_card):
+                    enemy_hit += damage
+                    if enemy_hit >= enemy_card.health:
+                        enemy_card = None
+                else:
+                    enemy_damage += damage
+
+            if enemy_card is None and staged_card is not None:
+                enemy_card, enemy_hit, staged_card = staged_card, staged_hit, None
+            if enemy_card is not None:
+                damage = card_damage(enemy_card, player_card)
+                if is_blocked(enemy_card, player_card):
+                    player_hit += damage
+                    if player_hit >= player_card.health:
+                        player_card = None
+                else:
+                    player_damage += damage
+
+        result = (player_damage, enemy_damage)
+        self.lane_analysis[key] = result
+        return result
+
+
+def _summary_entry(summary: dict, card: Card) -> list:
+    # [played, damage dealt, damage received, won, lost] per card stats
+    entry = summary.get(card.key)
+    if entry is None:
+        entry = summary[card.key] = [0, 0, 0, 0, 0]
+    return entry
+
+
+def _add_if_in_top(top: list, count: int, action: tuple):
+    # PlayerTurnAction.AddIfInTopN, including its partial ordering
+    if len(top) < count:
+        top.append(action)
+    elif action[2] > top[count - 1][2]:
+        top[count - 1] = action
+        for i in range(len(top) - 1, 0, -1):
+            if top[i - 1][2] < top[i][2]:
+                top[i - 1], top[i] = top[i], top[i - 1]
+
+
+def _remove_by_id(cards: list, card_id: int, replace=False) -> bool:
+    for i, card in enumerate(cards):
+        if card is not None and card[0] == card_id:
+            if replace:
+                cards[i] = None
+            else:
+                del cards[i]
+            return True
+    return False
+
+
+def merge_summaries(total: dict, summary: dict):
+    for key, values in summary.items():
+        entry = total.get(key)
+        if entry is None:
+            total[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                entry[i] += value
+
+
+# --- Analysis (CardPoolAnalyzer.cs, GameAnalyzer.cs) ---
+
+_data = None
+
+
+def _init_worker(cards_path: str, ai_path: str, cards_data: dict = None, ai_data: dict = None):
+    # Each worker process parses the settings once
+    global _data
+    _data = GameData(cards_path, ai_path, cards_data, ai_data)
+
+
+def analyze_pools_task(seed: int, count: int) -> tuple:
+    # Card stat counts and collision histograms for count pools
+    rnd = random.Random(seed)
+    totals = collections.Counter()
+    histograms = [ collections.Counter() for _ in range(4) ]
+    for _ in range(count):
+        pool = generate_card_pool(_data, rnd)
+        totals.update(card.key for card in pool)
+        per_pool = [ collections.Counter(card.key for card in pool), collections.Counter(card.adjective for card in pool),
+                     collections.Counter(card.noun for card in pool), collections.Counter(card.name for card in pool) ]
+        for histogram, counts in zip(histograms, per_pool):
+            histogram.update(counts.values())
+    return totals, histograms
+
+
+def simulate_games_task(pool_id: int, pool_seed: int, level: int, games: int, seed: int) -> tuple:
+    # Regenerates the pool from its seed rather than pickling it to the worker.
+    # Returns ([(pool, level, [result counts])], player summary, enemy summary).
+    pool = generate_card_pool(_data, random.Random(pool_seed))
+    root = random.Random(seed)
+    rows = []
+    player_summary = {}
+    enemy_summary = {}
+    for _ in range(games):
+        game_seed = root.randrange(MAX_SEED)
+        rnd = random.Random(game_seed)
+        deck, hand_size = generate_progress(_data, pool, level, rnd)
+        # GameAI.GenerateGameLevel restarts from the game seed. Its difficulty estimate (another full simulation)
+        # and reward don't change the game, so they're skipped.
+        ai = generate_enemy_ai(_data, pool, level, random.Random(game_seed))
+        sacrifices = shuffle([ card for card in deck if card.rarity == SACRIFICE ], rnd)
+        creatures = shuffle([ card for card in deck if card.rarity != SACRIFICE ], rnd)
+
+        simulator = GameSimulator(max_turns=20, max_branch_per_turn=2, max_queue_size=1000, always_draw_creature=True, always_draw_sacrifice=True)
+        result = simulator.simulate(creatures, sacrifices, hand_size, ai)
+        counts = [0] * len(ROUND_RESULTS)
+        for round_result in result["rounds"]:
+            counts[round_result[0]] += 1
+        rows.append((pool_id, level, counts))
+        merge_summaries(player_summary, result["player_summary"])
+        merge_summaries(enemy_summary, result["enemy_summary"])
+    return rows, player_summary, enemy_summary
+
+
+def format_key(key: tuple) -> list:
+    cost, rarity, attack, health, count, abilities = key
+    return [ RARITIES[rarity], BLOOD_COSTS[cost], attack, health, count, "-".join(ABILITIES[a] for a in abilities) if abilities else ABILITIES[0] ]
+
+
+def write_csv(path: str, header: list[str], rows) -> None:
+    # Same ", " separated format as the Godot analyzers (the notebooks read them with skipinitialspace=True)
+    with open(path, "w", newline="") as file:
+        file.write(", ".join(header) + "\n")
+        for row in rows:
+            file.write(", ".join(str(value) for value in row) + "\n")
+
+
+def write_pool_analysis(output_dir: str, totals: collections.Counter, histograms: list) -> list[str]:
+    os.makedirs(output_dir, exist_ok=True)
+    card_columns = ["Rarity", "BloodCost", "Attack", "Health", "AbilitiesCount", "Abilities"]
+    files = [ ("CardPoolAnalysis_TotalCardInfo.csv", card_columns + ["Count"], [ format_key(key) + [count] for key, count in sorted(totals.items()) ]) ]
+    names = [ ("CardInfoHist", "Card Stats"), ("AdjHist", "Adjective"), ("NounHist", "Noun"), ("NameHist", "Card Name") ]
+    for (name, label), histogram in zip(names, histograms):
+        files.append((f"CardPoolAnalysis_{name}.csv", [f"{label} Collision Count", "Count"], sorted(histogram.items())))
+
+    paths = []
+    for filename, header, rows in files:
+        paths.append(os.path.join(output_dir, filename))
+        write_csv(paths[-1], header, rows)
+    return paths
+
+
+def write_game_analysis(output_dir: str, rows: list, player_summary: dict, enemy_summary: dict) -> list[str]:
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for pool_id, level, counts in rows:
+        games = sum(counts)
+        win_rate = f"{counts[PLAYER_WIN] / games:.2f}" if games else "NaN"
+        results.append([pool_id, level, games, win_rate] + counts)
+    paths = [ os.path.join(output_dir, filename) for filename in ("GameAnalysis_Results.csv", "GameAnalysis_PlayerCardPerformance.csv", "GameAnalysis_EnemyCardPerformance.csv") ]
+    write_csv(paths[0], ["Pool", "Level", "TotalGames", "WinRate", "PlayerWin", "EnemyWin", "Stalemate", "MaxTurnsReached"], results)
+
+    card_columns = ["Rarity", "BloodCost", "Attack", "Health", "AbilitiesCount", "Abilities", "Played Count", "Win Count", "Lose Count", "Total Damage Dealt", "Total Damage Received"]
+    for path, summary in zip(paths[1:], (player_summary, enemy_summary)):
+        # [played, dealt, received, won, lost] -> played, won, lost, dealt, received
+        write_csv(path, card_columns, [ format_key(key) + [ v[0], v[3], v[4], v[1], v[2] ] for key, v in sorted(summary.items()) ])
+    return paths
+
+
+def analyze_card_pools(pools: int, output_dir: str = OUTPUT_DIR, workers: int = None, seed: int = 0, chunk_size: int = 1000, engine: str = "numpy",
+                       cards_path: str = CARDS_DATA_PATH, ai_path: str = AI_DATA_PATH, cards_data: dict = None, ai_data: dict = None) -> dict:
+    # The numpy engine (card_pool_sampler) draws the same distribution of pools in one process, a few hundred times faster
+    start = time.time()
+    if engine == "numpy":
+        from card_pool_sampler import PoolSampler
+        totals, histograms = PoolSampler(GameData(cards_path, ai_path, cards_data, ai_data)).analyze(pools, seed)
+        paths = write_pool_analysis(output_dir, totals, histograms)
+        return { "pools": pools, "cards": sum(totals.values()), "paths": paths, "seconds": time.time() - start }
+
+    seeds = random.Random(seed)
+    chunks = [ (seeds.randrange(MAX_SEED), min(chunk_size, pools - i)) for i in range(0, pools, chunk_size) ]
+    totals = collections.Counter()
+    histograms = [ collections.Counter() for _ in range(4) ]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cards_path, ai_path, cards_data, ai_data)) as executor:
+        for chunk_totals, chunk_histograms in executor.map(analyze_pools_task, *zip(*chunks)):
+            totals.update(chunk_totals)
+            for histogram, counts in zip(histograms, chunk_histograms):
+                histogram.update(counts)
+    paths = write_pool_analysis(output_dir, totals, histograms)
+    return { "pools": pools, "cards": sum(totals.values()), "paths": paths, "seconds": time.time() - start }
+
+
+def get_game_tasks(pools: int, games: int, min_level: int, max_level: int, seed: int = 0) -> list[tuple]:
+    # simulate_games_task arguments, one task per (pool, level) like GameAnalyzer.SimulateGames
+    seeds = random.Random(seed)
+    pool_seeds = [ seeds.randrange(MAX_SEED) for _ in range(pools) ]
+    return [ (pool_id, pool_seeds[pool_id], level, games, seeds.randrange(MAX_SEED)) for pool_id in range(pools) for level in range(min_level, max_level + 1) ]
+
+
+def analyze_game_balance(pools: int = 3, games: int = 10, min_level: int = 1, max_level: int = 12, output_dir: str = OUTPUT_DIR, workers: int = None, seed: int = 0,
+                         cards_path: str = CARDS_DATA_PATH, ai_path: str = AI_DATA_PATH, cards_data: dict = None, ai_data: dict = None) -> dict:
+    start = time.time()
+    tasks = get_game_tasks(pools, games, min_level, max_level, seed)
+    rows = []
+    player_summary = {}
+    enemy_summary = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cards_path, ai_path, cards_data, ai_data)) as executor:
+        for task_rows, task_player, task_enemy in executor.map(simulate_games_task, *zip(*tasks)):
+            rows += task_rows
+            merge_summaries(player_summary, task_player)
+            merge_summaries(enemy_summary, task_enemy)
+    paths = write_game_analysis(output_dir, rows, player_summary, enemy_summary)
+    return { "games": len(rows), "rounds": sum(sum(counts) for _, _, counts in rows), "paths": paths, "seconds": time.time() - start }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate card pools and simulate games without Godot, writing the CardPoolAnalysis_*/GameAnalysis_* CSVs.")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Directory for the CSV files.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes. (Defaults to the number of CPUs)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the card pools and games.")
+    parser.add_argument("--cards", default=CARDS_DATA_PATH, help="Path to cards.data.json.")
+    parser.add_argument("--ai", default=AI_DATA_PATH, help="Path to ai.data.json.")
+    subparser = parser.add_subparsers(dest="command")
+
+    pools_command = subparser.add_parser("pools", help="Card stats and name collisions over many generated card pools. (CardPoolAnalyzer)")
+    pools_command.add_argument("--pools", type=int, default=10000, help="Number of card pools.")
+    pools_command.add_argument("--engine", choices=["numpy", "python"], default="numpy", help="Draw pools with the vectorized sampler or generate every card like the game does.")
+
+    games_command = subparser.add_parser("games", help="Win rates and card performance over simulated games. (GameAnalyzer)")
+    games_command.add_argument("--pools", type=int, default=3, help="Number of card pools.")
+    games_command.add_argument("--games", type=int, default=10, help="Games per pool and level.")
+    games_command.add_argument("--min-level", type=int, default=1, help="First level to simulate.")
+    games_command.add_argument("--max-level", type=int, default=12, help="Last level to simulate.")
+    args = parser.parse_args()
+
+    if args.command == "pools":
+        report = analyze_card_pools(args.pools, args.output_dir, args.workers, args.seed, engine=args.engine, cards_path=args.cards, ai_path=args.ai)
+        print(f"Generated {report['pools']} card pools ({report['cards']} cards) in {report['seconds']:.1f} seconds")
+    elif args.command == "games":
+        report = analyze_game_balance(args.pools, args.games, args.min_level, args.max_level, args.output_dir, args.workers, args.seed, cards_path=args.cards, ai_path=args.ai)
+        print(f"Simulated {report['games']} games ({report['rounds']} explored rounds) in {report['seconds']:.1f} seconds: "
+              f"{report['games'] / report['seconds'] * 3600:.0f} games/hour")
+    else:
+        parser.print_help()
+        raise SystemExit(1)
+    for path in report["paths"]:
+        print(f"   Saved {path}")
@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+import pytest
+
+# Shared setup for the script tests: the scripts open their prompts and settings with paths relative to this folder,
+# and the tests must never touch the real cache directory. Set before the tests import scale_cache.
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ["CARD_GAME_CACHE_DIR"] = tempfile.mkdtemp(prefix="card-game-tests-")
+
+
+@pytest.fixture(autouse=True)
+def scripts_dir(monkeypatch):
+    monkeypatch.chdir(SCRIPTS_DIR)
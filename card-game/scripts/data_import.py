@@ -0,0 +1,243 @@
+import argparse
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from card_database import CardDatabase, generate_synthetic_data, get_name_key, normalize_name
+
+# Streaming import of nouns/adjectives from large candidate lists (e.g. LLM output), without reading the whole file:
+# - .json: an array of names, or of { "name": ..., "level": ... } objects, parsed one element at a time
+# - .txt: one name per line
+# - .jsonl: one name or { "name": ..., "level": ... } object per line
+# - .csv: a header row with a name (or value) column and an optional level column
+# Rows without a level use the level passed to import_values. Names are normalized and checked against the existing
+# names in batches, and a single summary is printed at the end instead of a line per value.
+
+IMPORT_EXTENSIONS = [".json", ".txt", ".jsonl", ".csv"]
+
+BATCH_SIZE = 10000
+READ_SIZE = 64 * 1024
+
+
+def is_import_file(value: str) -> bool:
+    return os.path.splitext(value)[1].lower() in IMPORT_EXTENSIONS
+
+
+def normalize(value) -> str:
+    # Collapses whitespace, returns None for values that can't be names
+    if not isinstance(value, str):
+        return None
+    return normalize_name(value) or None
+
+
+def read_record(item) -> tuple:
+    # (name, level) from a bare name or a { "name"/"value": ..., "level": ... } object
+    if isinstance(item, dict):
+        return item.get("name", item.get("value")), item.get("level")
+    return item, None
+
+
+def iter_json_array(file: io.TextIOBase, read_size: int = READ_SIZE):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+
+    def fill() -> bool:
+        # Drops everything already parsed and reads more, False at the end of the file
+        nonlocal buffer, position
+        more = file.read(read_size)
+        buffer = buffer[position:] + more
+        position = 0
+        return bool(more)
+
+    def next_char() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not fill():
+                return ""
+
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array")
+    position += 1
+
+    while True:
+        char = next_char()
+        if char == "]":
+            return
+        if char == ",":
+            position += 1
+            continue
+        if char == "":
+            raise ValueError("Unexpected end of the JSON array")
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            item, end = None, None
+
+        # A value cut off by the end of the buffer (including numbers, where "1." parses as 1) continues in the next read
+        if end is None or end == len(buffer) or buffer[end] not in ",] \t\r\n":
+            if fill():
+                continue
+            if end is None:
+                decoder.raw_decode(buffer, position)
+
+        yield item
+        position = end
+
+
+def iter_records(path: str):
+    # Yields (name, level) pairs, level is None when the row doesn't have one
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "r", encoding="utf-8", newline="" if ext == ".csv" else None) as file:
+        if ext == ".json":
+            for item in iter_json_array(file):
+                yield read_record(item)
+        elif ext == ".jsonl":
+            for line in file:
+                if line.strip():
+                    yield read_record(json.loads(line))
+        elif ext == ".csv":
+            reader = csv.DictReader(file)
+            fields = { field.strip().lower(): field for field in reader.fieldnames or [] }
+            name_field = fields.get("name") or fields.get("value") or (reader.fieldnames or [None])[0]
+            level_field = fields.get("level")
+            for row in reader:
+                level = row.get(level_field) if level_field else None
+                yield row.get(name_field), level if level not in ("", None) else None
+        else:
+            for line in file:
+                yield line, None
+
+
+def import_values(db: CardDatabase, data_type: str, path: str, level: int = 0, overwrite=False, batch_size: int = BATCH_SIZE) -> dict:
+    stats = { "read": 0, "added": 0, "updated": 0, "existing": 0, "duplicates": 0, "invalid": 0 }
+
+    # Names are matched like CardDatabase.find, so "goblin" from one list doesn't add a second Goblin
+    handled = set()
+
+    def add_batch(batch: list[tuple]):
+        for name, row_level in batch:
+            key = get_name_key(name)
+            if key in handled:
+                stats["duplicates"] += 1
+                continue
+            handled.add(key)
+
+            existing = db.find(data_type, name)
+            if existing is not None:
+                stats["existing"] += 1
+                if overwrite and db.get(data_type, existing)["level"] != row_level:
+                    db.set_level(data_type, existing, row_level)
+                    stats["updated"] += 1
+                continue
+
+            db.add(data_type, name, row_level)
+            stats["added"] += 1
+
+    level = int(level)
+    batch = []
+    for name, row_level in iter_records(path):
+        stats["read"] += 1
+        name = normalize(name)
+        if row_level is None:
+            row_level = level
+        else:
+            try:
+                row_level = int(row_level)
+            except (TypeError, ValueError):
+                row_level = None
+        if name is None or row_level is None:
+            stats["invalid"] += 1
+            continue
+
+        batch.append((name, row_level))
+        if len(batch) >= batch_size:
+            add_batch(batch)
+            batch = []
+    add_batch(batch)
+
+    return stats
+
+
+def print_summary(data_type: str, path: str, stats: dict, seconds: float = None) -> None:
+    timing = f" in {seconds:.1f} seconds" if seconds is not None else ""
+    print(f"Imported {stats['read']} rows from {path}{timing}:")
+    print(f"   Added {stats['added']} {data_type}, {stats['existing']} already existed ({stats['updated']} level changes), "
+          f"{stats['duplicates']} repeated in the file, {stats['invalid']} invalid")
+
+
+def write_synthetic_file(path: str, count: int, levels: int = 5, existing: int = 0) -> None:
+    # Some names repeat, some differ only in case, and some are already in the synthetic deck data
+    ext = os.path.splitext(path)[1]
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file) if ext == ".csv" else None
+        if writer:
+            writer.writerow(["name", "level"])
+        if ext == ".json":
+            file.write("[\n")
+        for i in range(count):
+            if i % 10 == 9:
+                name = f"candidate {i - 2:07d}".upper()
+            elif i % 10 == 8 and existing:
+                name = f"Adjective{i % existing:07d}"
+            else:
+                name = f"Candidate {i:07d}"
+            level = i % levels
+            if ext == ".json":
+                file.write(("," if i else "") + json.dumps(name) + "\n")
+            elif ext == ".jsonl":
+                file.write(json.dumps({ "name": name, "level": level }) + "\n")
+            elif writer:
+                writer.writerow([name, level])
+            else:
+                file.write(name + "\n")
+        if ext == ".json":
+            file.write("]\n")
+
+
+def benchmark(count: int, formats: list[str], adjectives: int = 100000) -> None:
+    def timed(fn) -> float:
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    def peak_mb(fn) -> float:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak / (1024 * 1024)
+
+    print(f"Benchmarking imports of {count} candidate adjectives into {adjectives} existing ones")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for ext in formats:
+            path = os.path.join(tmp_dir, f"candidates{ext}")
+            write_synthetic_file(path, count, existing=adjectives)
+            print(f"{ext}: {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+
+            db = CardDatabase(None, generate_synthetic_data(0, adjectives))
+            stats = {}
+            seconds = timed(lambda: stats.update(import_values(db, "adjectives", path)))
+            # Memory used to read the file, the names that are added to the deck data are needed either way
+            read_mb = peak_mb(lambda: sum(1 for _ in iter_records(path)))
+            print(f"   Streaming: {seconds:.2f} s to import, {read_mb:.1f} MB peak to read the file")
+            print_summary("adjectives", path, stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streaming noun/adjective imports on synthetic candidate lists.")
+    parser.add_argument("--values", type=int, default=1000000, help="Number of candidate names per file.")
+    parser.add_argument("--adjectives", type=int, default=100000, help="Number of existing adjectives.")
+    parser.add_argument("--formats", nargs="+", default=IMPORT_EXTENSIONS, choices=IMPORT_EXTENSIONS, help="File formats to import.")
+    args = parser.parse_args()
+
+    benchmark(args.values, args.formats, args.adjectives)
@@ -0,0 +1,172 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+# Atomic saves and rotating compressed backups for cards.data.json.
+# Files are written to a temporary file next to the target and renamed over it, so a crash mid-save never leaves a
+# truncated file. Every save also stores a gzipped snapshot of the new contents in one of MAX_BACKUPS slots, tracked
+# by an index file, so rotation just overwrites the next slot instead of listing and sorting the backup directory.
+# A save with the same contents as the last snapshot doesn't take a new one.
+
+BACKUP_DIR = os.environ.get("CARD_GAME_BACKUP_DIR", os.path.join(os.path.expanduser("~"), "Documents", "Backups"))
+BACKUP_INDEX_FILENAME = "cards.data.backups.json"
+MAX_BACKUPS = 50
+# Level 1 is several times faster than the default and the deck data still shrinks about 18x
+COMPRESS_LEVEL = 1
+
+
+def atomic_write(path: str, data: str | bytes) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    binary = isinstance(data, bytes)
+    file = tempfile.NamedTemporaryFile("wb" if binary else "w", dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False, encoding=None if binary else "utf-8")
+    try:
+        with file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        # Temporary files are created owner-only, keep the permissions of the file being replaced
+        os.chmod(file.name, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        os.replace(file.name, path)
+    except BaseException:
+        os.remove(file.name)
+        raise
+
+
+def get_index_path(backup_dir: str = None) -> str:
+    return os.path.join(backup_dir or BACKUP_DIR, BACKUP_INDEX_FILENAME)
+
+
+def read_index(backup_dir: str = None) -> dict:
+    try:
+        with open(get_index_path(backup_dir), "r") as file:
+            return json.loads(file.read())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return { "count": 0, "backups": {} }
+
+
+def backup(data: str, backup_dir: str = None, max_backups: int = MAX_BACKUPS, name: str = "cards.data") -> str:
+    # Returns the snapshot path, or None if the data matches the newest snapshot
+    backup_dir = backup_dir or BACKUP_DIR
+    os.makedirs(backup_dir, exist_ok=True)
+    encoded = data.encode("utf-8")
+    digest = hashlib.sha256(encoded).hexdigest()
+
+    # Backups are numbered in order, backup n lives in slot n % max_backups
+    index = read_index(backup_dir)
+    newest = index["backups"].get(str((index["count"] - 1) % max_backups))
+    if newest is not None and newest["number"] == index["count"] - 1 and newest["sha256"] == digest:
+        return None
+
+    slot = index["count"] % max_backups
+    filename = f"{name}.{slot:02d}.json.gz"
+    path = os.path.join(backup_dir, filename)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(gzip.compress(encoded, compresslevel=COMPRESS_LEVEL, mtime=0))
+    os.replace(tmp_path, path)
+
+    index["backups"][str(slot)] = { "number": index["count"], "file": filename, "time": datetime.now().isoformat(timespec="seconds"), "sha256": digest, "size": len(encoded) }
+    index["count"] += 1
+    atomic_write(get_index_path(backup_dir), json.dumps(index, indent=3))
+    return path
+
+
+def list_backups(backup_dir: str = None) -> list[dict]:
+    # Newest first
+    backups = read_index(backup_dir)["backups"]
+    return sorted(( dict(entry, slot=int(slot)) for slot, entry in backups.items() ), key=lambda entry: entry["number"], reverse=True)
+
+
+def read_backup(slot: int, backup_dir: str = None) -> str:
+    entry = read_index(backup_dir)["backups"][str(slot)]
+    with gzip.open(os.path.join(backup_dir or BACKUP_DIR, entry["file"]), "rt", encoding="utf-8") as file:
+        return file.read()
+
+
+def save(path: str, data: str, backup_dir: str = None, max_backups: int = MAX_BACKUPS, make_backup=True) -> str:
+    # Backs up the contents being written (the previous contents were backed up by the save that wrote them), except
+    # the first time, when the file on disk is snapshotted first so it can still be recovered
+    backup_path = None
+    if make_backup:
+        if not read_index(backup_dir)["backups"] and os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as file:
+                backup(file.read(), backup_dir, max_backups)
+        backup_path = backup(data, backup_dir, max_backups)
+    atomic_write(path, data)
+    return backup_path
+
+
+def restore(path: str, slot: int, backup_dir: str = None) -> None:
+    # Snapshot the file as it is now (it may have been edited outside these scripts), then put the backup back
+    if os.path.isfile(path):
+        with open(path, "r", encoding="utf-8") as file:
+            backup(file.read(), backup_dir)
+    atomic_write(path, read_backup(slot, backup_dir))
+
+
+def benchmark(nouns: int, adjectives: int, saves: int = 5) -> None:
+    from card_database import CardDatabase, generate_synthetic_data
+
+    def legacy_save(db: CardDatabase, backup_dir: str):
+        # The previous save_data: copy the whole file, list and sort every backup, then rewrite it in place
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        shutil.copy(db.path, os.path.join(backup_dir, f"cards.data.{timestamp}.json"))
+        backups = sorted([ os.path.join(backup_dir, f) for f in os.listdir(backup_dir) if f.startswith("cards.data") ], key=os.path.getctime)
+        for old_backup in backups[:-MAX_BACKUPS]:
+            os.remove(old_backup)
+        with open(db.path, "w") as file:
+            file.write(json.dumps(db.data, indent=3))
+
+    def timed(label: str, fn, backup_dir: str):
+        timings = []
+        for i in range(saves):
+            db.add("adjectives", f"Benchmark{label}{i}", 0)
+            start = time.perf_counter()
+            fn(db, backup_dir)
+            timings.append(time.perf_counter() - start)
+        size = sum(os.path.getsize(os.path.join(backup_dir, f)) for f in os.listdir(backup_dir))
+        print(f"   {label}: {sorted(timings)[len(timings) // 2] * 1000:.0f} ms per save (median of {saves}), backups use {size / (1024 * 1024):.1f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "cards.data.json")
+        db = CardDatabase(path, generate_synthetic_data(nouns, adjectives))
+        db.save()
+        print(f"Benchmarking saves of a {os.path.getsize(path) / (1024 * 1024):.1f} MB data file ({nouns} nouns, {adjectives} adjectives)")
+
+        legacy_dir = os.path.join(tmp_dir, "legacy")
+        os.makedirs(legacy_dir)
+        # Start both with a full set of backups, so the legacy rotation pays for its directory scan
+        for i in range(MAX_BACKUPS):
+            shutil.copy(path, os.path.join(legacy_dir, f"cards.data.{i:014d}.json"))
+        timed("Copy + rotate by directory scan + rewrite in place", legacy_save, legacy_dir)
+
+        store_dir = os.path.join(tmp_dir, "store")
+        for i in range(MAX_BACKUPS):
+            backup(f"{i}", store_dir)
+        timed("Atomic write + compressed snapshot", lambda db, backup_dir: save(db.path, db.to_json(), backup_dir), store_dir)
+
+        start = time.perf_counter()
+        expected = json.dumps(db.data, indent=3)
+        dumps_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        data = db.to_json()
+        print(f"   Serializing: {dumps_ms:.0f} ms with json.dumps(indent=3), {(time.perf_counter() - start) * 1000:.0f} ms with CardDatabase.to_json (same output: {data == expected})")
+        start = time.perf_counter()
+        save(db.path, data, store_dir)
+        print(f"   Saving unchanged data (snapshot skipped): {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cards.data.json saves with backups on a synthetic file.")
+    parser.add_argument("--nouns", type=int, default=20000, help="Number of synthetic nouns.")
+    parser.add_argument("--adjectives", type=int, default=100000, help="Number of synthetic adjectives.")
+    parser.add_argument("--saves", type=int, default=5, help="Timed saves per method.")
+    args = parser.parse_args()
+
+    benchmark(args.nouns, args.adjectives, args.saves)
@@ -1,88 +1,52 @@
 import argparse
 import os
 import json
-
-import shutil
-from datetime import datetime
-
-from diffusers import StableDiffusionXLPipeline
-from avatar_generator_local import format_image, generate_pixel_art_avatar, initialize_diffusion_pipeline
+import sys
+import threading
+import time
+
+from avatar_generator_local import MAX_BATCH_SIZE
+from avatar_rescaler import AVATAR_SIZE, rescale_avatars
+from avatar_scheduler import downscale_avatar, schedule_avatars
+from card_database import CardDatabase
+import data_store
+import scale_cache
+import tracing
 
 data_path = "../settings/cards.data.json"
 
+# Append-only log of finished avatar work, so an interrupted avatars run can resume where it stopped
+journal_path = "../settings/cards.data.journal"
+journal_lock = threading.Lock()
+
 raw_img_path = "../assets/sprites/avatars/raw/"
 avatar_img_path = "../assets/sprites/avatars/"
 
 godot_avatar_img_path = "res://assets/sprites/avatars/"
 
-MAX_BACKUPS = 50
+atlas_img_path = "../assets/sprites/avatars/atlas/"
+godot_atlas_img_path = "res://assets/sprites/avatars/atlas/"
 
 
-def load_data() -> dict:
-    with open(data_path, "r") as file:
-        return json.loads(file.read())
+def load_data() -> CardDatabase:
+    return CardDatabase(data_path)
 
 
-def load_array(value: str) -> list[str]:
-    if value.endswith(".json"):
-        with open(value, "r") as file:
-            return json.loads(file.read())
-        
-    if value.endswith(".txt"):
-        with open(value, "r") as file:
-            return [ line.strip() for line in file.readlines() ]
-        
-    return [ value ]
+def save_data(db: CardDatabase, backup=True, sort=False):
+    if sort:
+        db.sort()
 
+    # Serialize once for both the snapshot and the data file
+    with tracing.span("save data"):
+        data = db.to_json()
+        backup_path = data_store.save(db.path, data, make_backup=backup)
+    if backup_path:
+        print(f"Backed up file to {backup_path}")
 
-def save_data(new_data, backup=True, sort=False):
-    if sort:
-        new_data = {
-            "nouns": { k: v for k, v in sorted(new_data["nouns"].items(), key=lambda x: (x[1]['level'], x[0])) },
-            "adjectives": { k: v for k, v in sorted(new_data["adjectives"].items(), key=lambda x: (x[1]['level'], x[0])) }
-        }
-
-    if backup:
-        backup_data()    
-
-    data = load_data()
-    data["nouns"] = new_data["nouns"]
-    data["adjectives"] = new_data["adjectives"]
-
-    with open(data_path, "w") as file:
-        file.write(json.dumps(data, indent=3))
-
-
-def backup_data():
-    backup_dir = os.path.join(os.environ['USERPROFILE'], 'Documents', 'Backups')
-    os.makedirs(backup_dir, exist_ok=True)
-
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    backup_file = os.path.join(backup_dir, f"cards.data.{timestamp}.json")
-    shutil.copy(data_path, backup_file)
-    print(f"Backed up file to {backup_file}")
-
-    backups = sorted([os.path.join(backup_dir, f) for f in os.listdir(backup_dir) if f.startswith('cards.data')], key=os.path.getctime)
-    if len(backups) > MAX_BACKUPS:
-        for old_backup in backups[:-MAX_BACKUPS]:
-            os.remove(old_backup)
-            print(f"Removed old backup: {old_backup}")
-
-
-def print_data(data: dict, details=False):
-    nouns_by_level = {}
-    for noun, info in data["nouns"].items():
-        level = info["level"]
-        if not level in nouns_by_level:
-            nouns_by_level[level] = []
-        nouns_by_level[level].append(noun)
-
-    adj_by_level = {}
-    for adj, info in data["adjectives"].items():
-        level = info["level"]
-        if not level in adj_by_level:
-            adj_by_level[level] = []
-        adj_by_level[level].append(adj)
+
+def print_data(db: CardDatabase, details=False):
+    nouns_by_level = db.levels("nouns")
+    adj_by_level = db.levels("adjectives")
     
     print("NOUNS:")
     for level, nouns in nouns_by_level.items():
@@ -94,80 +58,212 @@ def print_data(data: dict, details=False):
     print(json.dumps(adj_by_level, indent=3))
 
 
-def add_data(data: dict, type: str, values: list[str], level: int, overwrite=False):
-    data = data[type]
+def add_data(db: CardDatabase, type: str, values: list[str], level: int, overwrite=False):
     for value in values:
-        if value in data:
-            print(f"Value already exists! Value={value}. Existing={json.dumps(data[value])}")
+        # Same matching as data_import, so "goblin" doesn't add a second Goblin
+        existing = db.find(type, value)
+        if existing is not None:
+            print(f"Value already exists! Value={value}. Existing={existing}: {json.dumps(db.get(type, existing))}")
             if overwrite:
-                data[value]["level"] = int(level)
+                db.set_level(type, existing, level)
             continue
 
-        data[value] = { "level": int(level) }
+        db.add(type, value, level)
         print(f'Added {value} to the {type} list.')
 
 
-def generate_avatars(data: dict, creature_name: str, pipeline: StableDiffusionXLPipeline, n: int) -> None:
-    if creature_name not in data["nouns"]:
-        print(f"ERROR: Unknown creature {args.creature}")
-        return
-    
-    noun_data = data["nouns"][creature_name]
-    if not noun_data.get("avatars"):
-        noun_data["avatars"] = []
+def generate_avatars(db: CardDatabase, nouns: list[str], n: int, pipeline=None, workers: int = None, max_batch_size: int = MAX_BATCH_SIZE, save_every: int = 10, use_server=True) -> None:
+    creatures = {}
+    for noun in nouns:
+        if noun not in db.nouns:
+            print(f"ERROR: Unknown creature {noun}")
+            continue
+        new_n = n - db.avatar_count(noun)
+        if new_n > 0:
+            creatures[noun] = new_n
 
-    current_n = len(noun_data["avatars"])
-    new_n = n - current_n
-    if new_n <= 0:
+    if not creatures:
         return
 
-    raw_img_paths = generate_pixel_art_avatar(creature_name, raw_img_path, pipeline, new_n)
-    for img_path in raw_img_paths:
-        new_avatar_path = format_image(img_path, avatar_img_path)
-        new_avatar_filename = os.path.basename(new_avatar_path)
-        new_godot_avatar_path = godot_avatar_img_path + new_avatar_filename
-        noun_data["avatars"].append(new_godot_avatar_path)
+    remaining = dict(creatures)
+    completed = 0
+
+    def on_raw(noun: str, img_path: str):
+        append_journal({ "noun": noun, "raw": img_path })
+
+    def on_avatar(noun: str, img_path: str, avatar_path: str):
+        nonlocal completed
+        commit_avatar(db, noun, img_path, avatar_path)
+        remaining[noun] -= 1
+        if remaining[noun] == 0:
+            completed += 1
+            print(f"Finished avatars for {noun} ({len(creatures) - completed} remaining)")
+            if completed % save_every == 0:
+                save_data(db, sort=True)
+                compact_journal()
+
+    schedule_avatars(creatures, raw_img_path, avatar_img_path, on_avatar, on_raw=on_raw, pipeline=pipeline, workers=workers, max_batch_size=max_batch_size, use_server=use_server)
+
+
+def add_avatar(db: CardDatabase, creature_name: str, img_path: str) -> None:
+    new_avatar_path, _ = downscale_avatar(img_path, avatar_img_path)
+    commit_avatar(db, creature_name, img_path, new_avatar_path)
+
+
+def commit_avatar(db: CardDatabase, creature_name: str, img_path: str, avatar_path: str) -> None:
+    new_avatar_filename = os.path.basename(avatar_path)
+    new_godot_avatar_path = godot_avatar_img_path + new_avatar_filename
+    db.add_avatar(creature_name, new_godot_avatar_path)
+    append_journal({ "noun": creature_name, "raw": img_path, "avatar": new_godot_avatar_path })
+
+
+def append_journal(entry: dict) -> None:
+    # Raw images are journaled from the diffusion thread, avatars from the main thread
+    with journal_lock:
+        with open(journal_path, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
 
+def read_journal() -> list[dict]:
+    if not os.path.isfile(journal_path):
+        return []
 
-def remove_dangling_resources(data: dict) -> None:
+    entries = []
+    with open(journal_path, "r") as file:
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # The last line can be cut short if the run was killed mid-write
+                continue
+    return entries
+
+
+def get_unformatted(entries: list[dict]) -> dict[str, dict]:
+    # Raw images that finished diffusion but have no avatar yet
+    unformatted = {}
+    for entry in entries:
+        if "avatar" in entry:
+            unformatted.pop(entry["raw"], None)
+        else:
+            unformatted[entry["raw"]] = entry
+    return unformatted
+
+
+def replay_journal(db: CardDatabase) -> int:
+    entries = read_journal()
+    replayed = 0
+    for entry in entries:
+        noun = entry["noun"]
+        if "avatar" in entry and noun in db.nouns and entry["avatar"] not in db.avatars(noun):
+            db.add_avatar(noun, entry["avatar"])
+            replayed += 1
+
+    for img_path, entry in get_unformatted(entries).items():
+        if entry["noun"] in db.nouns and os.path.isfile(img_path):
+            add_avatar(db, entry["noun"], img_path)
+            replayed += 1
+
+    return replayed
+
+
+def compact_journal() -> None:
+    # Called after the deck data is saved. Only raw images still waiting on a downscale need to stay in the journal.
+    with journal_lock:
+        unformatted = get_unformatted(read_journal())
+        if not unformatted:
+            if os.path.isfile(journal_path):
+                os.remove(journal_path)
+            return
+
+        tmp_path = f"{journal_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.writelines(json.dumps(entry) + "\n" for entry in unformatted.values())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, journal_path)
+
+
+def remove_dangling_resources(db: CardDatabase) -> None:
     avatar_resources = set([godot_avatar_img_path + res for res in os.listdir(avatar_img_path) if res.endswith(".png") ])
 
-    deck_resources = set()
-    for info in data["nouns"].values():
-        avatars = info.get("avatars")
-        if avatars:
-            deck_resources.update(avatars)
-            removed_avatars = [ res for res in avatars if res not in avatar_resources ]
-            avatars = [ res for res in avatars if res in avatar_resources ]
-
-            if removed_avatars:
-                print(f'Update: Removed resource from deck data: {removed_avatars}')
-                info["avatars"] = avatars
-    
+    # Only nouns that own a missing avatar need to be touched
+    nouns_with_missing = { noun for res in db.avatar_paths() if res not in avatar_resources for noun in db.avatar_owners(res) }
+    # In deck order, like the messages of a full pass
+    for noun in [ noun for noun in db.nouns if noun in nouns_with_missing ] if nouns_with_missing else []:
+        avatars = db.avatars(noun)
+        removed_avatars = [ res for res in avatars if res not in avatar_resources ]
+        print(f'Update: Removed resource from deck data: {removed_avatars}')
+        db.set_avatars(noun, [ res for res in avatars if res in avatar_resources ])
+
     for res in avatar_resources:
-        if res not in deck_resources:
+        if db.avatar_owner(res) is None:
             print(f"Warning: Resource that is not in any deck resource: {res}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Utility for card game deck generator assets.")
+    parser.add_argument("--trace", default=None, help="Record timing spans to this file (.jsonl, or .json for a Chrome trace) and print a summary per stage at the end.")
     subparser = parser.add_subparsers(dest="command", help="Command to run.")
 
     print_command = subparser.add_parser("print", help="Pretty print the current deck generator assets.")
 
     add_command = subparser.add_parser("add", help="Add new nouns or adjectives to the current deck generator assets.")
     add_command.add_argument("type", choices=["noun", "adj", "adjective" ], help="Type of resource to add.")
-    add_command.add_argument("value", help="The value to add or a .json file for a batch.")
-    add_command.add_argument("--level", default=0, help="The level of the value to add")
+    add_command.add_argument("value", help="The value to add, or a .json, .txt, .jsonl or .csv file for a batch.")
+    add_command.add_argument("--level", type=int, default=0, help="The level of the value to add (rows in a file with their own level use that)")
     add_command.add_argument("--force", action="store_true", help="Overwrite existing values if they already exist")
 
     clean_command = subparser.add_parser("clean", help="Sort elements, remove dangling assets, reformat.")
 
+    rescale_command = subparser.add_parser("rescale", help="Re-run the pixel art downscale on every raw avatar image.")
+    rescale_command.add_argument("--workers", type=int, default=None, help="Number of worker processes. (Defaults to the number of CPUs)")
+    rescale_command.add_argument("--width", type=int, default=AVATAR_SIZE[0], help="Avatar width in pixels.")
+    rescale_command.add_argument("--height", type=int, default=AVATAR_SIZE[1], help="Avatar height in pixels.")
+    rescale_command.add_argument("--palette", action="store_true", help="Reduce each avatar to its predicted color palette.")
+    rescale_command.add_argument("--max-colors", type=int, default=128, help="Max colors for the palette search.")
+    rescale_command.add_argument("--check", choices=["hash", "mtime"], default="hash", help="How to detect raw images that changed since the last rescale.")
+    rescale_command.add_argument("--force", action="store_true", help="Rescale every image even if its avatar is up to date.")
+    rescale_command.add_argument("--no-cache", action="store_true", help="Always rescale instead of reusing cached scale_image results.")
+    rescale_command.add_argument("--indexed", type=int, default=None, metavar="COLORS", help="Save paletted PNGs with at most this many colors. (16 or fewer saves 4-bit PNGs)")
+    rescale_command.add_argument("--shared-palette", action="store_true", help="With --indexed, map every avatar onto the palette saved by `deck_generator.py indexed --shared-palette`.")
+
+    indexed_command = subparser.add_parser("indexed", help="Convert the avatars to paletted PNGs and report the bytes saved and the color error.")
+    indexed_command.add_argument("--colors", type=int, default=256, help="Max colors per avatar, or in the shared palette. (16 or fewer saves 4-bit PNGs)")
+    indexed_command.add_argument("--shared-palette", action="store_true", help="Learn one palette from every avatar, save it and map every avatar onto it.")
+    indexed_command.add_argument("--dry-run", action="store_true", help="Only report what converting would save, without changing any file.")
+
+    cache_command = subparser.add_parser("cache", help="Inspect or trim the scale_image result cache.")
+    cache_command.add_argument("action", choices=["stats", "prune"], help="Print cache statistics, or evict least recently used entries.")
+    cache_command.add_argument("--max-size", type=float, default=scale_cache.MAX_CACHE_BYTES / scale_cache.MB, help="Size in MB to prune the cache down to. (Use 0 to clear it)")
+
+    verify_command = subparser.add_parser("verify", help="Check the avatar images and the deck data for duplicates, orphans and broken files.")
+    verify_command.add_argument("--workers", type=int, default=None, help="Threads reading images.")
+    verify_command.add_argument("--full", action="store_true", help="Re-read every image instead of only those changed since the last check.")
+    verify_command.add_argument("--all", action="store_true", help="List every problem instead of the first 20 of each kind.")
+
+    atlas_command = subparser.add_parser("atlas", help="Pack the avatars into atlas textures with a JSON index.")
+    atlas_command.add_argument("--atlas-size", type=int, nargs=2, default=[2048, 2048], metavar=("WIDTH", "HEIGHT"), help="Atlas texture size in pixels.")
+    atlas_command.add_argument("--padding", type=int, default=1, help="Pixels between avatars. (Transparent only when an avatar has alpha)")
+    atlas_command.add_argument("--repack", action="store_true", help="Lay out every avatar again instead of keeping their slots from the last run.")
+
+    backups_command = subparser.add_parser("backups", help="List the compressed backups of the deck data, or restore one.")
+    backups_command.add_argument("--restore", type=int, default=None, help="Backup number to restore. (The current data is backed up first)")
+
     avatars_command = subparser.add_parser("avatars", help="Generate avatars for creatures.")
     avatars_command.add_argument("-n", type=int, default=4, help="How many avatars to generate. (Be careful setting above 4....)")
     avatars_command.add_argument("--creature", default=None, help="Generate for a single creature/noun.")
+    avatars_command.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE, help="Maximum images per diffusion call. (Halved automatically on out of memory errors)")
+    avatars_command.add_argument("--save-every", type=int, default=10, help="Save the deck data after this many creatures. (Finished avatars are journaled as they complete)")
+    avatars_command.add_argument("--workers", type=int, default=None, help="Number of downscale worker processes running alongside diffusion. (Defaults to the number of CPUs)")
+    avatars_command.add_argument("--no-server", action="store_true", help="Load the pipeline in this process even if an avatar server is running.")
+    avatars_command.add_argument("--stub", action="store_true", help="Use a tiny CPU stand-in instead of SDXL, to check the scheduler without a GPU.")
 
     args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
 
     type_map = {
         "noun": "nouns",
@@ -175,28 +271,104 @@ if __name__ == "__main__":
         "adjective": "adjectives"
     }
 
-    data = load_data()
+    db = load_data()
     if args.command == "print":
-        print_data(data)
+        print_data(db)
     elif args.command == "add":
         data_type = type_map[args.type]
-        values = load_array(args.value)
-        add_data(data, data_type, values, args.level, overwrite=args.force)
-        save_data(data, sort=True)
-    elif args.command == "avatars":
-        pipeline = initialize_diffusion_pipeline()
-        if args.creature:
-            generate_avatars(data, args.creature, pipeline, args.n)
-            save_data(data, sort=True)
+        import data_import
+        if data_import.is_import_file(args.value):
+            start = time.time()
+            stats = data_import.import_values(db, data_type, args.value, args.level, overwrite=args.force)
+            data_import.print_summary(data_type, args.value, stats, time.time() - start)
+            if stats["added"] or stats["updated"]:
+                save_data(db, sort=True)
         else:
-            noun_count = len(data["nouns"])
-            for noun in data["nouns"].keys():
-                noun_count -= 1
-                print(f"Generating avatars for {noun} ({noun_count} remaining)")
-                generate_avatars(data, noun, pipeline, args.n)
-                save_data(data, sort=True)
+            add_data(db, data_type, [ args.value ], args.level, overwrite=args.force)
+            save_data(db, sort=True)
+    elif args.command == "avatars":
+        if args.save_every < 1:
+            parser.error("--save-every must be at least 1")
+        replayed = replay_journal(db)
+        if replayed:
+            print(f"Recovered {replayed} avatars from an interrupted run")
+
+        pipeline = None
+        if args.stub:
+            from stub_pipeline import StubPipeline
+            pipeline = StubPipeline()
+
+        nouns = [ args.creature ] if args.creature else list(db.nouns.keys())
+        generate_avatars(db, nouns, args.n, pipeline, workers=args.workers, max_batch_size=args.batch_size, save_every=args.save_every, use_server=not args.no_server)
+        save_data(db, sort=True)
+        compact_journal()
     elif args.command == "clean":
-        remove_dangling_resources(data)
-        save_data(data, sort=True)
+        remove_dangling_resources(db)
+        save_data(db, sort=True)
+    elif args.command == "rescale":
+        if not os.path.isdir(raw_img_path):
+            parser.error(f"No raw images to rescale, {raw_img_path} does not exist. (Generate some with `deck_generator.py avatars`)")
+        shared_palette = None
+        if args.indexed is not None:
+            import avatar_palette
+            if not 2 <= args.indexed <= avatar_palette.MAX_COLORS:
+                parser.error(f"--indexed must be between 2 and {avatar_palette.MAX_COLORS}")
+        if args.shared_palette:
+            import avatar_palette
+            palette_path = avatar_palette.get_palette_path(avatar_img_path)
+            if not args.indexed or not os.path.isfile(palette_path):
+                parser.error("--shared-palette needs --indexed and a palette from `deck_generator.py indexed --shared-palette`")
+            shared_palette = avatar_palette.load_palette(palette_path)
+        rescale_avatars(raw_img_path, avatar_img_path, (args.width, args.height), palette=args.palette, max_colors=args.max_colors, workers=args.workers, check=args.check, force=args.force, cache=not args.no_cache,
+                        indexed_colors=args.indexed, shared_palette=shared_palette)
+    elif args.command == "indexed":
+        import avatar_palette
+        if not 2 <= args.colors <= avatar_palette.MAX_COLORS:
+            parser.error(f"--colors must be between 2 and {avatar_palette.MAX_COLORS}")
+        paths = sorted([ os.path.join(avatar_img_path, f) for f in os.listdir(avatar_img_path) if f.endswith(".png") ])
+        shared_palette = None
+        if args.shared_palette:
+            start = time.time()
+            colors, counts = avatar_palette.get_histogram(paths)
+            shared_palette = avatar_palette.learn_palette(colors, counts, args.colors)
+            print(f"Learned a {len(shared_palette)} color palette from {len(colors)} distinct colors in {time.time() - start:.1f} seconds")
+            if not args.dry_run:
+                avatar_palette.save_palette(avatar_palette.get_palette_path(avatar_img_path), shared_palette)
+        report = avatar_palette.index_avatars(paths, shared_palette, args.colors, dry_run=args.dry_run)
+        avatar_palette.print_report(report, shared_palette, dry_run=args.dry_run)
+    elif args.command == "verify":
+        import asset_verifier
+        report = asset_verifier.verify(db, avatar_img_path, godot_avatar_img_path, raw_img_path, workers=args.workers, full=args.full)
+        problems = asset_verifier.print_report(report, limit=None if args.all else 20)
+        sys.exit(1 if problems else 0)
+    elif args.command == "atlas":
+        import avatar_atlas
+        if args.padding < 0:
+            parser.error("--padding can't be negative")
+        if min(size - 2 * args.padding - cell for size, cell in zip(args.atlas_size, AVATAR_SIZE)) < 0:
+            parser.error(f"--atlas-size must fit at least one {AVATAR_SIZE[0]}x{AVATAR_SIZE[1]} avatar with its padding, "
+                         f"{AVATAR_SIZE[0] + 2 * args.padding}x{AVATAR_SIZE[1] + 2 * args.padding} with --padding {args.padding}")
+        report = avatar_atlas.pack_atlases(db, avatar_img_path, godot_avatar_img_path, atlas_img_path, godot_atlas_img_path, atlas_size=tuple(args.atlas_size), padding=args.padding, repack=args.repack)
+        avatar_atlas.print_report(report)
+        # The deck data points the game at the index, so it can load the atlases without knowing where they are packed
+        if db.set_avatar_atlas(godot_atlas_img_path + avatar_atlas.INDEX_FILENAME):
+            save_data(db)
+    elif args.command == "backups":
+        backups = data_store.list_backups()
+        if args.restore is None:
+            print(f"Backups in {data_store.BACKUP_DIR}:")
+            for entry in backups:
+                print(f"   {entry['number']}: {entry['time']} ({entry['size'] / 1024:.0f} KB) {entry['file']}")
+        else:
+            entry = next((entry for entry in backups if entry["number"] == args.restore), None)
+            if entry is None:
+                parser.error(f"No backup number {args.restore}, run `deck_generator.py backups` to list them")
+            data_store.restore(db.path, entry["slot"])
+            print(f"Restored backup {entry['number']} from {entry['time']}")
+    elif args.command == "cache":
+        if args.action == "prune":
+            removed = scale_cache.prune(int(args.max_size * scale_cache.MB))
+            print(f"Removed {removed} cached images")
+        scale_cache.print_stats()
     else:
         parser.print_help()
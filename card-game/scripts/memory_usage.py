@@ -0,0 +1,14 @@
+import sys
+
+# Peak memory of the current process, for the benchmark reports (benchmark_suite, card_pool_sampler).
+
+
+def get_peak_rss_mb() -> float:
+    # Peak resident memory of this process: the peak working set on Windows, ru_maxrss elsewhere (bytes on macOS,
+    # kilobytes on Linux)
+    if sys.platform == "win32":
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
@@ -0,0 +1,125 @@
+import argparse
+import base64
+import io
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI chat completions and image APIs, to try name_generator.py and avatar_generator.py
+# without an API key or network. It answers "Provide the list of {type} for {level} creatures." with a made up JSON
+# list and image requests with flat colored PNGs, can add latency to show requests overlapping, and can answer every
+# Nth request with a 429 to exercise retries.
+# GET /stats reports how many requests were served, the most in flight at once, and the prompt size sent.
+
+REQUEST_PATTERN = re.compile(r"Provide the list of (\w+) for (.+) creatures\.")
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], delay: float = 0.5, rate_limit_every: int = 0, list_length: int = 10):
+        super().__init__(address, MockOpenAIRequestHandler)
+        self.delay = delay
+        self.rate_limit_every = rate_limit_every
+        self.list_length = list_length
+        self.lock = threading.Lock()
+        self.stats = { "requests": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0, "prompt_characters": 0 }
+
+
+class MockOpenAIRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.lock:
+                self.send_json(200, dict(self.server.stats))
+        else:
+            self.send_json(404, { "error": { "message": "Not found" } })
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if not path.endswith("/chat/completions") and not path.endswith("/images/generations"):
+            self.send_json(404, { "error": { "message": "Not found" } })
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        server = self.server
+        with server.lock:
+            server.stats["requests"] += 1
+            if server.rate_limit_every and server.stats["requests"] % server.rate_limit_every == 0:
+                server.stats["rate_limited"] += 1
+                self.send_json(429, { "error": { "message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded" } }, { "Retry-After": "0.2" })
+                return
+            server.stats["in_flight"] += 1
+            server.stats["max_in_flight"] = max(server.stats["max_in_flight"], server.stats["in_flight"])
+
+        if path.endswith("/images/generations"):
+            self.generate_images(body)
+            return
+
+        prompt_characters = 0
+        try:
+            time.sleep(server.delay)
+            prompt_characters = sum(len(message.get("content") or "") for message in body["messages"])
+            match = REQUEST_PATTERN.search(body["messages"][-1]["content"])
+            list_type, level = match.groups() if match else ("names", "ANY LEVEL")
+            prefix = level.split()[0].capitalize()
+            names = [ f"{prefix} {list_type[:-1].capitalize()} {i}" for i in range(server.list_length) ]
+            content = json.dumps({ list_type: names })
+        finally:
+            with server.lock:
+                server.stats["in_flight"] -= 1
+                server.stats["prompt_characters"] += prompt_characters
+
+        self.send_json(200, {
+            "id": f"chatcmpl-mock-{server.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{ "index": 0, "message": { "role": "assistant", "content": content }, "finish_reason": "stop" }],
+            # Roughly 4 characters per token
+            "usage": { "prompt_tokens": prompt_characters // 4, "completion_tokens": len(content) // 4, "total_tokens": (prompt_characters + len(content)) // 4 },
+        })
+
+    def generate_images(self, body: dict):
+        from PIL import Image
+
+        try:
+            time.sleep(self.server.delay)
+            size = tuple(int(x) for x in body.get("size", "256x256").split("x"))
+            images = []
+            for i in range(body.get("n", 1)):
+                buffer = io.BytesIO()
+                Image.new("RGB", size, ((40 * i) % 256, 120, 200)).save(buffer, format="PNG")
+                images.append({ "b64_json": base64.b64encode(buffer.getvalue()).decode() })
+        finally:
+            with self.server.lock:
+                self.server.stats["in_flight"] -= 1
+
+        self.send_json(200, { "created": int(time.time()), "data": images })
+
+    def send_json(self, status: int, message: dict, headers: dict = None):
+        data = json.dumps(message).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a mock OpenAI chat completions API for name_generator.py.")
+    parser.add_argument("--port", type=int, default=8766, help="Port to listen on (127.0.0.1).")
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds each request takes.")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth request with a 429. (0 to never)")
+    parser.add_argument("--list-length", type=int, default=10, help="Names per list.")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(("127.0.0.1", args.port), args.delay, args.rate_limit_every, args.list_length)
+    print(f"Serving mock OpenAI API on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
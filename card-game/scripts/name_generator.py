@@ -1,26 +1,71 @@
 from dotenv import load_dotenv
-from openai import OpenAI
+import argparse
+import asyncio
 import os
 import json
-
-load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+import time
+import request_cache
+import tracing
 
 prompt_path = "./name_generator.prompt.txt"
 
+MODEL = "gpt-4o"
+TYPES = ["nouns", "adjectives"]
+# The index of each level is the level number used in cards.data.json
+LEVELS = ["NOOB LEVEL", "LOW LEVEL", "MEDIUM LEVEL", "HIGH LEVEL", "EPIC LEVEL"]
+
+# How many existing names the compact summary lists per type, instead of resending every earlier response
+SUMMARY_MAX_NAMES = 150
+MAX_RETRIES = 6
+
+_client = None
+usage = { "requests": 0, "cached": 0, "prompt_tokens": 0, "completion_tokens": 0 }
+
+
+def get_client(base_url: str = None):
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        load_dotenv()
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url)
+    return _client
+
+
+def get_request_params(messages) -> dict:
+    return {
+        "model": MODEL,
+        "response_format": {"type": "json_object"},
+        "temperature": 1.0,
+        "messages": messages,
+    }
+
 
 def get_assistant_response(messages):
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        response_format={"type": "json_object"},
-        temperature=1.0,
-        messages=messages,
-    )
+    from openai.types.chat import ChatCompletion
+
+    params = get_request_params(messages)
+
+    def request():
+        with tracing.span("api request", model=MODEL):
+            return get_client().chat.completions.create(**params).model_dump()
+
+    with tracing.span("name request"):
+        data, cached = request_cache.cached_request("chat.completions", params, request)
+    response = ChatCompletion.model_validate(data)
 
+    add_usage(response, cached)
     return response.choices[0].message
 
 
+def add_usage(response, cached=False):
+    usage["requests"] += 1
+    if cached:
+        usage["cached"] += 1
+    elif response.usage:
+        usage["prompt_tokens"] += response.usage.prompt_tokens
+        usage["completion_tokens"] += response.usage.completion_tokens
+
+
 def get_json_list_from_message(assistant_message) -> list[str]:
     content = assistant_message.content
     content_json = json.loads(content)
@@ -33,7 +78,7 @@ def get_json_list_from_message(assistant_message) -> list[str]:
     return content_json[content_keys[0]]
 
 
-def generate_lists(types = ["nouns", "adjectives"], levels = ["NOOB LEVEL", "LOW LEVEL", "MEDIUM LEVEL", "HIGH LEVEL", "EPIC LEVEL"]) -> dict:
+def generate_lists(types = TYPES, levels = LEVELS) -> dict:
     with open(prompt_path, "r") as file:
         nouns_prompt = file.read()
 
@@ -59,6 +104,128 @@ def generate_lists(types = ["nouns", "adjectives"], levels = ["NOOB LEVEL", "LOW
     return data
 
 
+def get_summary(list_type: str, existing: list[str]) -> str:
+    names = existing[:SUMMARY_MAX_NAMES]
+    summary = f"The game already has these {list_type}, do not repeat them: {', '.join(names)}"
+    if len(existing) > len(names):
+        summary += f" (and {len(existing) - len(names)} more)"
+    return summary
+
+
+def get_messages(system_prompt: str, list_type: str, level: str, history: str, existing: dict[str, list[str]]) -> list[dict]:
+    # Each (level, type) request stands alone: the system prompt, optionally a compact summary of the names that
+    # already exist, and the request itself
+    messages = [{"role": "system", "content": system_prompt}]
+    if history == "summary" and existing.get(list_type):
+        messages.append({"role": "user", "content": get_summary(list_type, existing[list_type])})
+    messages.append({"role": "user", "content": f"Provide the list of {list_type} for {level} creatures."})
+    return messages
+
+
+async def get_assistant_response_async(client, messages: list[dict], semaphore: asyncio.Semaphore, max_retries: int = MAX_RETRIES):
+    from openai.types.chat import ChatCompletion
+
+    params = get_request_params(messages)
+
+    async def request():
+        with tracing.span("api request", model=MODEL):
+            response = await create_with_retries(client, params, semaphore, max_retries)
+        return response.model_dump()
+
+    with tracing.span("name request"):
+        data, cached = await request_cache.cached_request_async("chat.completions", params, request)
+    response = ChatCompletion.model_validate(data)
+
+    add_usage(response, cached)
+    return response.choices[0].message
+
+
+async def create_with_retries(client, params: dict, semaphore: asyncio.Semaphore, max_retries: int = MAX_RETRIES):
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+    for attempt in range(max_retries + 1):
+        try:
+            async with semaphore:
+                return await client.chat.completions.create(**params)
+        except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+            if attempt == max_retries:
+                raise
+            # Wait outside the semaphore so other requests can use the slot
+            seconds = request_cache.get_retry_seconds(e, attempt)
+            print(f"   {type(e).__name__}, retrying in {seconds:.1f} seconds ({attempt + 1}/{max_retries})")
+            await asyncio.sleep(seconds)
+
+
+async def generate_lists_async(types = TYPES, levels = LEVELS, concurrency: int = 4, history: str = "summary", existing: dict[str, list[str]] = None, base_url: str = None, max_retries: int = MAX_RETRIES) -> dict:
+    # Runs every (level, type) request at once, up to concurrency in flight. history is "summary" to send a compact
+    # list of existing names with each request, or "none" for just the system prompt.
+    from openai import AsyncOpenAI
+
+    with open(prompt_path, "r") as file:
+        system_prompt = file.read()
+
+    load_dotenv()
+    semaphore = asyncio.Semaphore(concurrency)
+    existing = existing or {}
+
+    # Retries are handled here, so rate limits back off without holding a concurrency slot.
+    # Offline replays never reach the API, so they don't need a key.
+    api_key = os.getenv("OPENAI_API_KEY") or ("offline" if request_cache.MODE == "offline" else None)
+    async with AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0) as client:
+        async def generate(list_type: str, level: str):
+            print(f"Generating list of {list_type} for {level} creatures.")
+            messages = get_messages(system_prompt, list_type, level, history, existing)
+            assistant_response = await get_assistant_response_async(client, messages, semaphore, max_retries)
+            return list_type, level, get_json_list_from_message(assistant_response)
+
+        results = await asyncio.gather(*[ generate(list_type, level) for level in levels for list_type in types ])
+
+    data = {x: {} for x in types}
+    for list_type, level, names in results:
+        data[list_type][level] = names
+    return data
+
+
+def merge_lists(db, data: dict, levels = LEVELS) -> None:
+    from deck_generator import add_data
+
+    for list_type, lists in data.items():
+        for level, names in lists.items():
+            add_data(db, list_type, names, levels.index(level))
+
+
 if __name__ == "__main__":
-    data = generate_lists()
+    parser = argparse.ArgumentParser(description="Generate creature noun and adjective lists with OpenAI.")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Send every (level, type) request at once instead of one long conversation.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight with --async.")
+    parser.add_argument("--history", choices=["summary", "none"], default="summary", help="With --async, send a compact summary of the names already in cards.data.json, or nothing but the system prompt.")
+    parser.add_argument("--base-url", default=None, help="OpenAI compatible API to use, e.g. http://127.0.0.1:8766/v1 for mock_openai_server.py.")
+    parser.add_argument("--save", action="store_true", help="Add the new names to cards.data.json.")
+    parser.add_argument("--cache", choices=request_cache.MODES, default=request_cache.MODE, help="How to use the request cache. (offline replays cached responses without calling the API)")
+    parser.add_argument("--trace", default=None, help="Record timing spans to this file (.jsonl, or .json for a Chrome trace) and print a summary per stage at the end.")
+    args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+
+    request_cache.MODE = args.cache
+
+    db = None
+    if args.save or (args.use_async and args.history == "summary"):
+        from deck_generator import load_data
+        db = load_data()
+
+    start = time.time()
+    if args.use_async:
+        existing = { list_type: list(db.data[list_type].keys()) for list_type in TYPES } if db else {}
+        data = asyncio.run(generate_lists_async(concurrency=args.concurrency, history=args.history, existing=existing, base_url=args.base_url))
+    else:
+        get_client(args.base_url)
+        data = generate_lists()
+
     print(json.dumps(data, indent=3))
+    print(f"Made {usage['requests']} requests ({usage['cached']} from the cache) in {time.time() - start:.1f} seconds using {usage['prompt_tokens']} prompt tokens and {usage['completion_tokens']} completion tokens")
+
+    if args.save:
+        from deck_generator import save_data
+        merge_lists(db, data)
+        save_data(db, sort=True)
@@ -0,0 +1,7 @@
+import os
+
+# Locations and units shared by the scripts that keep state between runs (scale_cache, request_cache, avatar_server,
+# balance_sweep, benchmark_suite), so none of them has to import another cache module just for its directory.
+
+CACHE_DIR = os.environ.get("CARD_GAME_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "card-game"))
+MB = 1024 * 1024
@@ -1,13 +1,17 @@
-import os, argparse, time
+import os, argparse, io, time, tracemalloc
 from PIL import Image
 import numpy as np
 import scipy
 from itertools import product
+import scale_cache
+import tracing
+from avatar_palette import get_palette_hash, to_indexed
 
 # Modified from: https://github.com/Astropulse/pixeldetector
 # Changes:
 # - Converted to from command line script to the scale_image function
 # - Added function to force rescaling to a specific size instead of autodetecting
+# - Added kCentroid_numpy, a batched version of kCentroid (kept as the reference implementation)
 
 # ap = argparse.ArgumentParser()
 # ap.add_argument("-i", "--input", required = True, help = "Path to input image")
@@ -16,17 +20,47 @@ from itertools import product
 # ap.add_argument("-p", "--palette", required = False, action="store_true", help = "Automatically reduce the image to predicted color palette")
 # args = vars(ap.parse_args())
 
-def scale_image(input_path: str, output_path: str, height: int, width: int, palette=False, max_colors=128):
+# Bump when a change to the scaling algorithms changes their output, so cached results are not reused
+SCALE_IMAGE_VERSION = 1
+
+# Defaults for the adaptive kCentroid engine: tiles with an RGB standard deviation up to ADAPTIVE_THRESHOLD skip
+# k-means, and ADAPTIVE_PRESCALE (0 for off) box-filters the image to that multiple of the output size first
+ADAPTIVE_THRESHOLD = 6.0
+ADAPTIVE_PRESCALE = 0
+
+
+def scale_image(input_path: str, output_path: str, height: int, width: int, palette=False, max_colors=128, engine="numpy", palette_search="incremental", cache=True, indexed_colors=None, shared_palette=None):
+    # indexed_colors saves a paletted PNG of at most that many colors (see avatar_palette), mapped onto shared_palette if given
     if os.path.isfile(input_path):
         # Open input image
         image = Image.open(input_path).convert('RGB')
+        output_format = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower())
+
+        # Return the cached output if these pixels were already scaled with the same parameters
+        if cache:
+            start = round(time.time()*1000)
+            params = { "height": height, "width": width, "palette": palette, "max_colors": max_colors, "format": output_format, "version": SCALE_IMAGE_VERSION }
+            if indexed_colors:
+                params["indexed"] = indexed_colors
+                params["shared_palette"] = get_palette_hash(shared_palette) if shared_palette is not None else None
+            if engine == "adaptive":
+                # The other engines give the same pixels, this one depends on its settings
+                params.update(engine=engine, threshold=ADAPTIVE_THRESHOLD, prescale=ADAPTIVE_PRESCALE)
+            with tracing.span("scale cache lookup"):
+                cache_key = scale_cache.get_key(image, **params)
+                cached = scale_cache.get(cache_key)
+            if cached is not None:
+                _write_atomic(output_path, cached)
+                print(f"Loaded cached {width}x{height} image in {round(time.time()*1000)-start} milliseconds")
+                return
 
         # Start timer
         start = round(time.time()*1000)
 
         # Find 1:1 pixel scale
         # downscale = pixel_detect(image)
-        downscale = kCentroid(image, width, height, 2)
+        with tracing.span("kCentroid", engine=engine):
+            downscale = KCENTROID_ENGINES[engine](image, width, height, 2)
         print(f"Scaled image from {image.width}x{image.height} to {downscale.width}x{downscale.height} in {round(time.time()*1000)-start} milliseconds")
 
         output = downscale
@@ -35,12 +69,30 @@ def scale_image(input_path: str, output_path: str, height: int, width: int, pale
             start = round(time.time()*1000)
 
             # Reduce color palette using elbow method
-            best_k = determine_best_k(downscale, max_colors)
+            with tracing.span("palette search", search=palette_search):
+                best_k = PALETTE_SEARCHES[palette_search](downscale, max_colors)
             output = downscale.quantize(colors=best_k, method=1, kmeans=best_k, dither=0).convert('RGB')
 
             print(f"Palette reduced to {best_k} colors in {round(time.time()*1000)-start} milliseconds")
 
-        output.save(output_path)
+        if indexed_colors:
+            output = to_indexed(output, shared_palette, indexed_colors)
+
+        with tracing.span("save avatar"):
+            buffer = io.BytesIO()
+            output.save(buffer, format=output_format, optimize=bool(indexed_colors))
+            _write_atomic(output_path, buffer.getvalue())
+
+        if cache:
+            scale_cache.put(cache_key, buffer.getvalue(), **params)
+
+
+def _write_atomic(path: str, data: bytes):
+    # Write to a temp file and rename it, so an interrupted run never leaves a half written image
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
 
 
 def kCentroid(image: Image, width: int, height: int, centroids: int):
@@ -71,6 +123,240 @@ def kCentroid(image: Image, width: int, height: int, centroids: int):
     return Image.fromarray(downscaled, mode='RGB')
 
 
+def kCentroid_numpy(image: Image, width: int, height: int, centroids: int):
+    # Batched re-implementation of kCentroid.
+    # Every tile goes through the same steps as PIL's quantize(method=1, kmeans=centroids) followed by getcolors(),
+    # but all tiles of the same size are solved at once as a (tiles, pixels, 3) tensor.
+    # Tie-breaks follow PIL's hash table orders so the output matches kCentroid pixel for pixel
+    # with 2 centroids (with more centroids, pixels equally far from several palette entries may differ).
+    pixels = np.asarray(image.convert("RGB"))
+
+    # Create an empty array for the downscaled image
+    downscaled = np.zeros((height, width, 3), dtype=np.uint8)
+
+    x0, x1 = _tile_edges(image.width, width)
+    y0, y1 = _tile_edges(image.height, height)
+    tile_x, tile_y = np.meshgrid(np.arange(width), np.arange(height), indexing="ij")
+    _solve_tiles(pixels, downscaled, x0, x1, y0, y1, tile_x.ravel(), tile_y.ravel(), centroids)
+
+    return Image.fromarray(downscaled, mode='RGB')
+
+
+def kCentroid_adaptive(image: Image, width: int, height: int, centroids: int, threshold: float = None, prescale: int = None, stats: dict = None):
+    # kCentroid_numpy with a fast path for flat tiles: a tile whose RGB standard deviation is at most threshold takes
+    # its mean color, and only the busier tiles go through k-means. prescale first box-filters the image down to
+    # prescale times the output size, so k-means runs on prescale x prescale tiles. Not pixel exact, compare_adaptive
+    # measures the error. stats, if given, gets the tile counts.
+    threshold = ADAPTIVE_THRESHOLD if threshold is None else threshold
+    prescale = ADAPTIVE_PRESCALE if prescale is None else prescale
+    image = image.convert("RGB")
+    if prescale and image.width > width * prescale and image.height > height * prescale:
+        image = image.resize((width * prescale, height * prescale), Image.BOX)
+    pixels = np.asarray(image)
+
+    x0, x1 = _tile_edges(image.width, width)
+    y0, y1 = _tile_edges(image.height, height)
+
+    # Tile sums of the pixels and their squares, one pass over the image each
+    areas = ((y1 - y0)[:, np.newaxis] * (x1 - x0))[:, :, np.newaxis]
+    sums = _tile_sums(pixels, x0, y0)
+    square_sums = _tile_sums(np.square(pixels, dtype=np.uint16), x0, y0)
+    variances = (square_sums * areas - np.square(sums)).sum(axis=2) / np.square(areas[:, :, 0])
+    flat = variances <= threshold * threshold
+
+    downscaled = np.floor(sums / areas + 0.5).astype(np.uint8)
+    tile_y, tile_x = np.nonzero(~flat)
+    _solve_tiles(pixels, downscaled, x0, x1, y0, y1, tile_x, tile_y, centroids)
+
+    if stats is not None:
+        stats.update(tiles=width * height, fast=int(np.count_nonzero(flat)))
+    return Image.fromarray(downscaled, mode='RGB')
+
+
+def _tile_edges(size: int, count: int) -> tuple[np.ndarray, np.ndarray]:
+    # Start and end of each tile along one axis, rounded the same way image.crop() rounds float boxes
+    factor = size/count
+    starts = np.arange(count)*factor
+    return np.round(starts).astype(np.int64), np.round(starts + factor).astype(np.int64)
+
+
+def _solve_tiles(pixels: np.ndarray, downscaled: np.ndarray, x0: np.ndarray, x1: np.ndarray, y0: np.ndarray, y1: np.ndarray, tile_x: np.ndarray, tile_y: np.ndarray, centroids: int):
+    # Writes the dominant color of each (tile_x, tile_y) tile into downscaled.
+    # Non-integer factors give a few different tile sizes, solve each size as one batch.
+    tile_w = (x1 - x0)[tile_x]
+    tile_h = (y1 - y0)[tile_y]
+    for w, h in set(zip(tile_w.tolist(), tile_h.tolist())):
+        group = (tile_w == w) & (tile_h == h)
+        gx = tile_x[group]
+        gy = tile_y[group]
+
+        # Gather the tiles into a (tiles, pixels, 3) block tensor in raster order
+        rows = y0[gy][:, np.newaxis] + np.arange(h)
+        cols = x0[gx][:, np.newaxis] + np.arange(w)
+        tiles = pixels[rows[:, :, np.newaxis], cols[:, np.newaxis, :]].reshape(len(gx), w*h, 3)
+
+        downscaled[gy, gx, :] = _dominant_tile_colors(tiles, centroids)
+
+
+def _tile_sums(values: np.ndarray, x0: np.ndarray, y0: np.ndarray) -> np.ndarray:
+    # (rows, columns, channels) sums of every tile, the tiles cover the image edge to edge
+    return np.add.reduceat(np.add.reduceat(values, y0, axis=0, dtype=np.int64), x0, axis=1)
+
+
+def _dominant_tile_colors(tiles: np.ndarray, centroids: int) -> np.ndarray:
+    n_tiles, n_pixels, _ = tiles.shape
+    tile_index = np.arange(n_tiles)
+
+    # Channel-first int32 planes keep the k-means passes cheap
+    planes = np.ascontiguousarray(tiles.transpose(2, 0, 1), dtype=np.int32)
+    codes = (planes[0] << 16) | (planes[1] << 8) | planes[2]
+
+    # Single color tiles quantize to that color, only solve the rest
+    uniform = codes.min(axis=1) == codes.max(axis=1)
+    if uniform.any():
+        colors = tiles[:, 0, :].copy()
+        mixed = ~uniform
+        if mixed.any():
+            colors[mixed] = _dominant_tile_colors(tiles[mixed], centroids)
+        return colors
+
+    # Farthest point seeding: first from the rounded mean color, then from each new palette entry
+    palette = np.zeros((n_tiles, centroids, 3), dtype=np.int32)
+    reference = np.floor(planes.sum(axis=2, dtype=np.int64).T / n_pixels + 0.5).astype(np.int32)
+    min_distances = None
+    for i in range(centroids):
+        distances = _squared_distances(planes, reference)
+        min_distances = distances if i <= 1 else np.minimum(min_distances, distances)
+        seed = _furthest_pixel(tiles, codes, min_distances)
+        palette[:, i] = tiles[tile_index, seed]
+        reference = palette[:, i]
+
+    # Initial mapping: nearest palette entry, ties go to the lowest index
+    labels = _nearest_palette_entry(planes, palette, np.zeros((n_tiles, n_pixels), dtype=np.intp))
+
+    # k-means until no more than (centroids - 1) pixels of a tile change cluster.
+    # Like PIL, the palette is not recomputed after the final mapping.
+    active = tile_index
+    while len(active):
+        act_planes = planes[:, active]
+        act_labels = labels[active]
+
+        bins = (np.arange(len(active))[:, np.newaxis] * centroids + act_labels).ravel()
+        counts = np.bincount(bins, minlength=len(active) * centroids).reshape(-1, centroids)
+        for c in range(3):
+            sums = np.bincount(bins, weights=act_planes[c].ravel(), minlength=len(active) * centroids).reshape(-1, centroids)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means = np.floor(sums / counts + 0.5)
+            # Empty clusters come out of PIL as black
+            palette[active, :, c] = np.where(counts > 0, means, 0)
+
+        new_labels = _nearest_palette_entry(act_planes, palette[active], act_labels)
+        changes = np.count_nonzero(new_labels != act_labels, axis=1)
+        labels[active] = new_labels
+        active = active[changes > centroids - 1]
+
+    # Count pixels per output color (clusters may share a color) and keep the most common one
+    counts = np.bincount((tile_index[:, np.newaxis] * centroids + labels).ravel(), minlength=n_tiles * centroids).reshape(-1, centroids)
+    palette_codes = _color_codes(palette)
+    same_color = palette_codes[:, :, np.newaxis] == palette_codes[:, np.newaxis, :]
+    color_counts = np.where(counts > 0, (same_color * counts[:, np.newaxis, :]).sum(axis=2), 0)
+    best = np.argmax(color_counts, axis=1)
+    best_count = color_counts[tile_index, best]
+
+    # Break count ties between different colors in getcolors() order
+    tied = np.flatnonzero(((color_counts == best_count[:, np.newaxis]) & (palette_codes != palette_codes[tile_index, best][:, np.newaxis])).any(axis=1))
+    for t in tied:
+        appearance = [palette_codes[t, j] for j in dict.fromkeys(labels[t].tolist())]
+        for code in _getcolors_order(appearance):
+            j = int(np.flatnonzero(palette_codes[t] == code)[0])
+            if color_counts[t, j] == best_count[t]:
+                best[t] = j
+                break
+
+    return palette[tile_index, best].astype(np.uint8)
+
+
+def _color_codes(colors: np.ndarray) -> np.ndarray:
+    colors = colors.astype(np.int64)
+    return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+
+def _squared_distances(planes: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    distances = np.square(planes[0] - colors[:, 0, np.newaxis])
+    distances += np.square(planes[1] - colors[:, 1, np.newaxis])
+    distances += np.square(planes[2] - colors[:, 2, np.newaxis])
+    return distances
+
+
+def _furthest_pixel(tiles: np.ndarray, codes: np.ndarray, distances: np.ndarray) -> np.ndarray:
+    # Index of a pixel with the largest distance in each tile
+    seed = np.argmax(distances, axis=1)
+    furthest = distances == distances[np.arange(len(seed)), seed][:, np.newaxis]
+
+    # PIL walks its color hash table, so when different colors tie the first one in that table's order wins
+    tied = np.flatnonzero((furthest & (codes != codes[np.arange(len(seed)), seed][:, np.newaxis])).any(axis=1))
+    if len(tied):
+        tied_codes = codes[tied].astype(np.int64)
+        n_colors = 1 + np.count_nonzero(np.diff(np.sort(tied_codes, axis=1), axis=1), axis=1)
+        table_length = _quant_hash_lengths(tiles.shape[1])[n_colors]
+        tied_tiles = tiles[tied].astype(np.int64)
+        pixel_hash = ((tied_tiles[..., 0] * 463) ^ ((tied_tiles[..., 1] << 8) * 10069) ^ ((tied_tiles[..., 2] << 16) * 64997)) & 0xFFFFFFFF
+        walk_order = ((pixel_hash % table_length[:, np.newaxis]) << 24) | tied_codes
+        seed[tied] = np.argmin(np.where(furthest[tied], walk_order, np.iinfo(np.int64).max), axis=1)
+
+    return seed
+
+
+def _nearest_palette_entry(planes: np.ndarray, palette: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    # Nearest palette entry per pixel, a pixel only moves when another entry is strictly closer
+    best_labels = np.zeros_like(labels)
+    best_distances = _squared_distances(planes, palette[:, 0])
+    current = best_distances
+    for j in range(1, palette.shape[1]):
+        distances = _squared_distances(planes, palette[:, j])
+        current = np.where(labels == j, distances, current)
+        best_labels = np.where(distances < best_distances, j, best_labels)
+        best_distances = np.minimum(distances, best_distances)
+    return np.where(current == best_distances, labels, best_labels)
+
+
+_hash_length_cache = {}
+
+def _quant_hash_lengths(max_count: int) -> np.ndarray:
+    # Length of PIL's quantizer hash table after inserting n unique colors (QuantHash.c grows it 3:1 with _findPrime)
+    if max_count not in _hash_length_cache:
+        unit = [0, 1, 0, 1, 0, 0, 0, 1, 0, 1, 0, 1, 0, 1, 0, 0]
+        lengths = np.zeros(max_count + 1, dtype=np.int64)
+        length = 11
+        for count in range(max_count + 1):
+            if length * 3 < count:
+                length = length * 2 + 1
+                while not unit[length & 0x0F]:
+                    length += 1
+            lengths[count] = length
+        _hash_length_cache[max_count] = lengths
+    return _hash_length_cache[max_count]
+
+
+def _getcolors_order(codes: list[int]) -> list[int]:
+    # Order of the colors returned by getcolors() (GetBBox.c, 512 entry open addressing table),
+    # given the colors in the order they first appear in the image
+    code_mask, code_poly = 511, 17
+    table = {}
+    for code in codes:
+        r, g, b = (code >> 16) & 0xFF, (code >> 8) & 0xFF, code & 0xFF
+        h = r | (g << 8) | (b << 16)
+        i = (~h) & code_mask
+        incr = (h ^ (h >> 3)) & code_mask or code_mask
+        while i in table:
+            i = (i + incr) & code_mask
+            incr = incr << 1
+            if incr > code_mask:
+                incr = incr ^ code_poly
+        table[i] = code
+    return [table[i] for i in sorted(table)]
+
+
 # def pixel_detect(image: Image):
     # Thanks to https://github.com/paultron for optimizing my garbage code 
     # I swapped the axis so they accurately reflect the horizontal and vertical scaling factor for images with uneven ratios
@@ -127,4 +413,204 @@ def determine_best_k(image: Image, max_k: int):
         elbow_index = np.argmax(rate_of_change) + 1
         best_k = elbow_index + 2
 
-    return best_k
\ No newline at end of file
+    return best_k
+
+
+def determine_best_k_incremental(image: Image, max_k: int, patience=None, histogram=True, report=False):
+    # Same elbow search as determine_best_k, but:
+    # - distances are computed once per unique color (histogram=True) instead of once per pixel
+    # - the distance column of each palette color is kept between consecutive k, most of them survive from k to k+1
+    # - squared distances are expanded as |p|^2 - 2p.c + |c|^2 so there is no (pixels, k, 3) temporary
+    # - the search stops as soon as the distortion reaches zero, since the elbow cannot move after that
+    # - optionally, the search stops once the elbow has not moved for `patience` values of k
+    # The distortion of each k is bit-identical to determine_best_k, so without patience it picks the same k.
+    # With patience the result can differ: on kCentroid avatars the elbow still moved 50+ values of k later.
+    # report=True prints the time and, unless the caller is already tracing allocations, the peak memory of the search.
+    start = time.time()
+    measure_memory = report and not tracemalloc.is_tracing()
+    if measure_memory:
+        tracemalloc.start()
+
+    # Convert the image to RGB mode
+    image = image.convert("RGB")
+    pixels = np.reshape(np.array(image), (-1, 3))
+
+    # Search over the color histogram, inverse maps every pixel back to its color
+    if histogram:
+        colors, inverse = np.unique(pixels, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+    else:
+        colors, inverse = pixels, None
+    colors = colors.astype(np.int64)
+    color_norms = np.einsum("ij,ij->i", colors, colors)
+
+    distance_columns = {}
+    distortions = []
+    best_index = None
+    rate_of_change = None
+    for k in range(1, max_k + 1):
+        quantized_image = image.quantize(colors=k, method=0, kmeans=k, dither=0)
+        centroids = [tuple(c) for c in np.array(quantized_image.getpalette()[:k * 3]).reshape(-1, 3)]
+
+        # Squared distance to the nearest centroid, reusing the columns of centroids seen at k-1
+        columns = {}
+        for centroid in centroids:
+            if centroid not in columns:
+                column = distance_columns.get(centroid)
+                if column is None:
+                    c = np.array(centroid, dtype=np.int64)
+                    column = color_norms - 2 * (colors @ c) + c @ c
+                columns[centroid] = column
+        distance_columns = columns
+        min_distances = np.min(np.stack(list(columns.values())), axis=0)
+
+        # Same float operations as determine_best_k: sqrt for the norm, squared back, summed per pixel
+        min_distances = np.sqrt(min_distances.astype(np.float64)) ** 2
+        if inverse is not None:
+            min_distances = min_distances[inverse]
+        distortions.append(np.sum(min_distances))
+
+        if k == 1:
+            continue
+
+        # Running elbow: np.argmax picks the first NaN (0/0 once the distortion reaches zero), else the first maximum
+        index = k - 2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rate = (distortions[-1] - distortions[-2]) / distortions[-2]
+        if best_index is None or np.isnan(rate) or rate > rate_of_change:
+            best_index = index
+            rate_of_change = rate
+        if np.isnan(rate_of_change):
+            break
+        if patience is not None and index - best_index >= patience:
+            break
+
+    # Find the elbow point (best k value)
+    if best_index is None:
+        best_k = 2
+    else:
+        best_k = best_index + 1 + 2
+
+    if report:
+        memory = ""
+        if measure_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            memory = f", peak memory {peak / 1e6:.1f} MB"
+        print(f"Searched k=1..{len(distortions)} of {max_k} over {len(colors)} colors in {round((time.time() - start) * 1000)} milliseconds{memory}")
+
+    return best_k
+
+
+KCENTROID_ENGINES = {
+    "reference": kCentroid,
+    "numpy": kCentroid_numpy,
+    "adaptive": kCentroid_adaptive,
+}
+
+PALETTE_SEARCHES = {
+    "elbow": determine_best_k,
+    "incremental": determine_best_k_incremental,
+}
+
+
+def compare_engines(image: Image, width: int, height: int, centroids: int = 2) -> int:
+    # Pixel parity check of kCentroid_numpy against the reference kCentroid
+    start = time.time()
+    reference = np.asarray(kCentroid(image, width, height, centroids))
+    reference_ms = round((time.time() - start) * 1000)
+
+    start = time.time()
+    candidate = np.asarray(kCentroid_numpy(image, width, height, centroids))
+    candidate_ms = round((time.time() - start) * 1000)
+
+    mismatches = int(np.count_nonzero((reference != candidate).any(axis=2)))
+    print(f"reference: {reference_ms} ms, numpy: {candidate_ms} ms, mismatched pixels: {mismatches}/{width * height}")
+    return mismatches
+
+
+def compare_adaptive(image: Image, width: int, height: int, centroids: int = 2, tolerance: float = 2.0) -> bool:
+    # Speed and error of kCentroid_adaptive against the exact kCentroid_numpy, passes when the mean RGB distance
+    # between their pixels is at most tolerance
+    start = time.time()
+    exact = np.asarray(kCentroid_numpy(image, width, height, centroids)).astype(np.float64)
+    exact_ms = round((time.time() - start) * 1000)
+
+    stats = {}
+    start = time.time()
+    candidate = np.asarray(kCentroid_adaptive(image, width, height, centroids, stats=stats)).astype(np.float64)
+    candidate_ms = round((time.time() - start) * 1000)
+
+    errors = np.sqrt(np.square(exact - candidate).sum(axis=2))
+    mismatches = int(np.count_nonzero(errors))
+    print(f"numpy: {exact_ms} ms, adaptive: {candidate_ms} ms, fast-pathed tiles: {stats['fast']}/{stats['tiles']} ({stats['fast'] / stats['tiles']:.0%}), "
+          f"mismatched pixels: {mismatches}/{width * height}, mean error {errors.mean():.2f}, max error {errors.max():.1f}")
+    return errors.mean() <= tolerance
+
+
+def compare_palette_searches(image: Image, max_k: int, patience=None) -> bool:
+    # Check that the incremental palette search picks the same k as determine_best_k
+    tracemalloc.start()
+    start = time.time()
+    reference = determine_best_k(image, max_k)
+    reference_ms = round((time.time() - start) * 1000)
+    _, reference_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    candidate = determine_best_k_incremental(image, max_k, patience=patience, report=True)
+    print(f"elbow: k={reference} in {reference_ms} ms, peak memory {reference_peak / 1e6:.1f} MB. incremental: k={candidate}")
+    return reference == candidate
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Downscale pixel art images with kCentroid.")
+    ap.add_argument("input", nargs="+", help="Path to input image(s)")
+    ap.add_argument("-o", "--output", default=None, help="Path to save output image (single input only)")
+    ap.add_argument("--width", type=int, default=90, help="Output width")
+    ap.add_argument("--height", type=int, default=60, help="Output height")
+    ap.add_argument("-m", "--max", type=int, default=128, help="Max colors for computation, more = slower")
+    ap.add_argument("-p", "--palette", action="store_true", help="Automatically reduce the image to predicted color palette")
+    ap.add_argument("--engine", choices=KCENTROID_ENGINES.keys(), default="numpy", help="kCentroid implementation to use")
+    ap.add_argument("--no-cache", action="store_true", help="Always rescale instead of reusing cached results")
+    ap.add_argument("--palette-search", choices=PALETTE_SEARCHES.keys(), default="incremental", help="Palette size search to use with --palette")
+    ap.add_argument("--compare", action="store_true", help="Check the numpy engine against the reference implementation instead of saving")
+    ap.add_argument("--compare-adaptive", action="store_true", help="Report the tiles the adaptive engine fast-paths and its error against the numpy engine instead of saving")
+    ap.add_argument("--threshold", type=float, default=ADAPTIVE_THRESHOLD, help="RGB standard deviation up to which the adaptive engine takes a tile's mean color instead of k-means")
+    ap.add_argument("--prescale", type=int, default=ADAPTIVE_PRESCALE, help="Box-filter to this multiple of the output size before the adaptive engine's k-means (0 for off)")
+    ap.add_argument("--tolerance", type=float, default=2.0, help="Mean RGB distance from the numpy engine that --compare-adaptive accepts")
+    ap.add_argument("--compare-palette", action="store_true", help="Check the incremental palette search against determine_best_k instead of saving")
+    ap.add_argument("--patience", type=int, default=None, help="Stop the incremental palette search when the elbow has not moved for this many k")
+    ap.add_argument("--trace", default=None, help="Record timing spans to this file (.jsonl, or .json for a Chrome trace) and print a summary per stage at the end.")
+    args = ap.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+    ADAPTIVE_THRESHOLD = args.threshold
+    ADAPTIVE_PRESCALE = args.prescale
+
+    if args.compare:
+        failed = 0
+        for input_path in args.input:
+            print(input_path)
+            failed += compare_engines(Image.open(input_path).convert("RGB"), args.width, args.height) > 0
+        exit(1 if failed else 0)
+
+    if args.compare_adaptive:
+        passed = 0
+        for input_path in args.input:
+            print(input_path)
+            passed += compare_adaptive(Image.open(input_path).convert("RGB"), args.width, args.height, tolerance=args.tolerance)
+        print(f"Within tolerance for {passed}/{len(args.input)} images")
+        exit(0 if passed == len(args.input) else 1)
+
+    if args.compare_palette:
+        matched = 0
+        for input_path in args.input:
+            print(input_path)
+            downscale = kCentroid_numpy(Image.open(input_path).convert("RGB"), args.width, args.height, 2)
+            matched += compare_palette_searches(downscale, args.max, patience=args.patience)
+        print(f"Same k for {matched}/{len(args.input)} images")
+        exit(0 if matched == len(args.input) else 1)
+
+    for input_path in args.input:
+        output_path = args.output or os.path.splitext(input_path)[0] + "_scaled.png"
+        scale_image(input_path, output_path, args.height, args.width, palette=args.palette, max_colors=args.max, engine=args.engine, palette_search=args.palette_search, cache=not args.no_cache)
@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from paths import CACHE_DIR, MB
+
+# On-disk cache of OpenAI responses (chat completions, DALL-E images), keyed on the endpoint, the model and every
+# request parameter including the full prompt/messages. Entries expire after a TTL and are evicted least recently used
+# first once the cache is over its size limit. Identical requests made at the same time in one process are only
+# sent once, the others wait for the first one's response.
+#
+# MODE controls how the cache is used (set with the CARD_GAME_REQUEST_CACHE environment variable or --cache):
+# - refresh (default): always call the API and store the new response. The cached calls are sampled generations
+#   (chat at temperature 1, DALL-E), so a rerun should get new names and images, replaying them is opt-in.
+# - use: return cached responses, call the API on a miss
+# - offline: only return cached responses, a miss raises CacheMissError instead of calling the API
+# - off: always call the API, never store anything
+
+MODES = ["use", "refresh", "offline", "off"]
+MODE = os.environ.get("CARD_GAME_REQUEST_CACHE", "refresh")
+
+CACHE_FILENAME = "requests.sqlite"
+MAX_CACHE_BYTES = 128 * MB
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+
+MAX_RETRY_SECONDS = 60
+
+_inflight_lock = threading.Lock()
+_inflight = {}
+_inflight_async = {}
+
+
+class CacheMissError(Exception):
+    pass
+
+
+def get_cache_path() -> str:
+    return os.path.join(CACHE_DIR, CACHE_FILENAME)
+
+
+def connect() -> sqlite3.Connection:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    connection = sqlite3.connect(get_cache_path(), timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, endpoint TEXT, params TEXT, response TEXT, size INTEGER, created REAL, last_access REAL, expires REAL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+    connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+    return connection
+
+
+def to_json(value) -> str:
+    # Messages can include the SDK's response objects (e.g. an assistant message appended to the history)
+    return json.dumps(value, sort_keys=True, default=lambda o: o.model_dump() if hasattr(o, "model_dump") else str(o))
+
+
+def get_key(endpoint: str, params: dict) -> str:
+    return hashlib.sha256(to_json({ "endpoint": endpoint, "params": params }).encode()).hexdigest()
+
+
+def get(key: str) -> dict:
+    now = time.time()
+    with closing(connect()) as connection:
+        with connection:
+            row = connection.execute("SELECT response, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < now:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                _increment(connection, "misses")
+                return None
+
+            connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            _increment(connection, "hits")
+            return json.loads(row[0])
+
+
+def put(key: str, endpoint: str, params: dict, response: dict, ttl: float = DEFAULT_TTL_SECONDS, max_bytes: int = MAX_CACHE_BYTES) -> None:
+    now = time.time()
+    data = to_json(response)
+    with closing(connect()) as connection:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, endpoint, params, response, size, created, last_access, expires) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, to_json(params), data, len(data), now, now, now + ttl if ttl else None))
+            _evict(connection, max_bytes)
+
+
+def cached_request(endpoint: str, params: dict, request, mode: str = None, ttl: float = DEFAULT_TTL_SECONDS) -> tuple[dict, bool]:
+    # request() makes the API call and returns the response as a dict. Returns (response, True if it came from the cache).
+    mode = mode or MODE
+    if mode == "off":
+        return request(), False
+
+    key = get_key(endpoint, params)
+    if mode == "refresh":
+        # Every call is a new sample, identical requests in flight are not shared either
+        response = request()
+        put(key, endpoint, params, response, ttl)
+        return response, False
+
+    while True:
+        response = get(key)
+        if response is not None:
+            return response, True
+        if mode == "offline":
+            raise CacheMissError(f"No cached {endpoint} response for this request ({key[:12]}), and the request cache is offline")
+
+        with _inflight_lock:
+            event = _inflight.get(key)
+            if event is None:
+                event = _inflight[key] = threading.Event()
+                break
+
+        # The same request is already being made, use its response once it lands (or make it if that one failed)
+        event.wait()
+
+    try:
+        response = request()
+        put(key, endpoint, params, response, ttl)
+        return response, False
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        event.set()
+
+
+async def cached_request_async(endpoint: str, params: dict, request, mode: str = None, ttl: float = DEFAULT_TTL_SECONDS) -> tuple[dict, bool]:
+    # Same as cached_request, request is an async function. sqlite calls run on a thread so they don't block the loop.
+    mode = mode or MODE
+    if mode == "off":
+        return await request(), False
+
+    key = get_key(endpoint, params)
+    if mode == "refresh":
+        response = await request()
+        await asyncio.to_thread(put, key, endpoint, params, response, ttl)
+        return response, False
+
+    while True:
+        response = await asyncio.to_thread(get, key)
+        if response is not None:
+            return response, True
+        if mode == "offline":
+            raise CacheMissError(f"No cached {endpoint} response for this request ({key[:12]}), and the request cache is offline")
+
+        event = _inflight_async.get(key)
+        if event is None:
+            event = _inflight_async[key] = asyncio.Event()
+            break
+
+        await event.wait()
+
+    try:
+        response = await request()
+        await asyncio.to_thread(put, key, endpoint, params, response, ttl)
+        return response, False
+    finally:
+        del _inflight_async[key]
+        event.set()
+
+
+def get_retry_seconds(error, attempt: int) -> float:
+    # Use the server's Retry-After when it sends one, otherwise exponential backoff with jitter
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_RETRY_SECONDS)
+        except ValueError:
+            pass
+    return min(2 ** attempt, MAX_RETRY_SECONDS) * random.uniform(0.5, 1.0)
+
+
+def stats() -> dict:
+    with closing(connect()) as connection:
+        entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        endpoints = dict(connection.execute("SELECT endpoint, COUNT(*) FROM entries GROUP BY endpoint").fetchall())
+        counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "path": get_cache_path(),
+            "entries": entries,
+            "endpoints": endpoints,
+            "bytes": size,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+        }
+
+
+def prune(max_bytes: int = MAX_CACHE_BYTES) -> int:
+    with closing(connect()) as connection:
+        with connection:
+            removed = _evict(connection, max_bytes)
+        connection.execute("VACUUM")
+        return removed
+
+
+def print_stats() -> None:
+    info = stats()
+    lookups = info["hits"] + info["misses"]
+    hit_rate = f"{100 * info['hits'] / lookups:.1f}%" if lookups else "n/a"
+    print(f"Request cache: {info['path']} (mode: {MODE})")
+    print(f"   Entries: {info['entries']} ({', '.join(f'{endpoint}: {count}' for endpoint, count in info['endpoints'].items()) or 'empty'})")
+    print(f"   Size: {info['bytes'] / MB:.2f} MB (limit {MAX_CACHE_BYTES / MB:.0f} MB)")
+    print(f"   Hits: {info['hits']}, Misses: {info['misses']}, Hit rate: {hit_rate}")
+
+
+def _evict(connection: sqlite3.Connection, max_bytes: int) -> int:
+    removed = connection.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (time.time(),)).rowcount
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total <= max_bytes:
+        return removed
+
+    for key, size in connection.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+        if total <= max_bytes:
+            break
+        connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+        total -= size
+        removed += 1
+    return removed
+
+
+def _increment(connection: sqlite3.Connection, name: str) -> None:
+    connection.execute("INSERT INTO counters (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or trim the OpenAI request cache.")
+    parser.add_argument("action", choices=["stats", "prune"], help="Print cache statistics, or evict expired and least recently used entries.")
+    parser.add_argument("--max-size", type=float, default=MAX_CACHE_BYTES / MB, help="Size in MB to prune the cache down to. (Use 0 to clear it)")
+    args = parser.parse_args()
+
+    if args.action == "prune":
+        removed = prune(int(args.max_size * MB))
+        print(f"Removed {removed} cached responses")
+    print_stats()
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import multiprocessing.util
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import TYPE_CHECKING
+
+from paths import CACHE_DIR, MB
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# On-disk cache of scale_image outputs, keyed on the input pixels and the scaling parameters.
+# Entries live in a single SQLite file and are evicted least recently used first once the cache is over its size limit.
+
+CACHE_FILENAME = "scale_image.sqlite"
+MAX_CACHE_BYTES = 256 * MB
+# Lookups only read the cache. Hit/miss counts and last access times are kept here and written in one transaction
+# every FLUSH_EVERY lookups, on the next put, and when the process exits (rescale workers included).
+FLUSH_EVERY = 64
+_pending = { "hits": 0, "misses": 0, "access": {} }
+_flush_registered = False
+
+
+def get_cache_path() -> str:
+    return os.path.join(CACHE_DIR, CACHE_FILENAME)
+
+
+def connect() -> sqlite3.Connection:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Rescale workers share the cache, wait on each other's writes instead of failing
+    connection = sqlite3.connect(get_cache_path(), timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, params TEXT, data BLOB, size INTEGER, created REAL, last_access REAL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+    connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+    return connection
+
+
+def get_key(image: "Image", **params) -> str:
+    # Hash the decoded pixels rather than the file, so re-saving a raw image with new metadata still hits
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def get(key: str) -> bytes:
+    with closing(connect()) as connection:
+        row = connection.execute("SELECT data FROM entries WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        _record("misses")
+        return None
+
+    _pending["access"][key] = time.time()
+    _record("hits")
+    return row[0]
+
+
+def put(key: str, data: bytes, max_bytes: int = MAX_CACHE_BYTES, **params) -> None:
+    now = time.time()
+    with closing(connect()) as connection:
+        with connection:
+            # Recent hits count as recent before anything is evicted
+            _write_pending(connection)
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, params, data, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(params, sort_keys=True), data, len(data), now, now))
+            _evict(connection, max_bytes)
+
+
+def flush() -> None:
+    if not _pending["hits"] and not _pending["misses"]:
+        return
+    with closing(connect()) as connection:
+        with connection:
+            _write_pending(connection)
+
+
+def stats() -> dict:
+    flush()
+    with closing(connect()) as connection:
+        entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        counters = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "path": get_cache_path(),
+            "entries": entries,
+            "bytes": size,
+            "file_bytes": os.path.getsize(get_cache_path()),
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+        }
+
+
+def prune(max_bytes: int = MAX_CACHE_BYTES) -> int:
+    with closing(connect()) as connection:
+        with connection:
+            removed = _evict(connection, max_bytes)
+        # Give the freed pages back to the file system
+        connection.execute("VACUUM")
+        return removed
+
+
+def print_stats() -> None:
+    info = stats()
+    lookups = info["hits"] + info["misses"]
+    hit_rate = f"{100 * info['hits'] / lookups:.1f}%" if lookups else "n/a"
+    print(f"Cache: {info['path']}")
+    print(f"   Entries: {info['entries']}")
+    print(f"   Size: {info['bytes'] / MB:.2f} MB of images, {info['file_bytes'] / MB:.2f} MB on disk (limit {MAX_CACHE_BYTES / MB:.0f} MB)")
+    print(f"   Hits: {info['hits']}, Misses: {info['misses']}, Hit rate: {hit_rate}")
+
+
+def _evict(connection: sqlite3.Connection, max_bytes: int) -> int:
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+
+    removed = 0
+    for key, size in connection.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+        if total <= max_bytes:
+            break
+        connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+        total -= size
+        removed += 1
+    return removed
+
+
+def _reset_after_fork() -> None:
+    # A forked worker starts with a copy of the parent's pending counts and none of its finalizers
+    global _flush_registered
+    _pending.update(hits=0, misses=0, access={})
+    _flush_registered = False
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _record(counter: str) -> None:
+    global _flush_registered
+    if not _flush_registered:
+        # Finalizers with an exit priority run at interpreter exit and when a multiprocessing worker exits, atexit
+        # handlers only run for the former
+        multiprocessing.util.Finalize(None, flush, exitpriority=10)
+        _flush_registered = True
+
+    _pending[counter] += 1
+    if _pending["hits"] + _pending["misses"] >= FLUSH_EVERY:
+        flush()
+
+
+def _write_pending(connection: sqlite3.Connection) -> None:
+    # Entries evicted since their lookup are skipped by the UPDATE
+    connection.executemany("UPDATE entries SET last_access = MAX(last_access, ?) WHERE key = ?", [ (when, key) for key, when in _pending["access"].items() ])
+    for name in ("hits", "misses"):
+        if _pending[name]:
+            connection.execute("INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, _pending[name]))
+    _pending.update(hits=0, misses=0, access={})
@@ -0,0 +1,79 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Measures how long the quick deck_generator commands take to start, using `python -X importtime`.
+# The ML stack (torch, diffusers, ...) and the image libraries should only be imported by the commands that use them,
+# so any of HEAVY_MODULES showing up here is reported as a failure along with commands over the time budget.
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# add and clean change the deck data, so --help is used to time their imports and argument parsing without running them
+COMMANDS = {
+    "print": ["deck_generator.py", "print"],
+    "add": ["deck_generator.py", "add", "--help"],
+    "clean": ["deck_generator.py", "clean", "--help"],
+}
+
+HEAVY_MODULES = ["torch", "diffusers", "huggingface_hub", "transformers", "numpy", "scipy", "PIL", "openai"]
+
+BUDGET_MS = 200
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    # Lines look like "import time:  self [us] | cumulative | imported package", nested imports are indented
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports[name.strip()] = (int(self_us), int(cumulative_us))
+    return imports
+
+
+def time_command(args: list[str]) -> tuple[float, dict[str, tuple[int, int]]]:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=SCRIPTS_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{result.stderr[-2000:]}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+def benchmark(commands: dict[str, list[str]], runs: int = 5, budget_ms: float = BUDGET_MS, top: int = 5) -> bool:
+    passed = True
+    for command, args in commands.items():
+        # The first run warms the file system and __pycache__
+        time_command(args)
+        timings = [ time_command(args) for _ in range(runs) ]
+        wall_ms = statistics.median(elapsed for elapsed, _ in timings)
+        imports = timings[-1][1]
+        import_ms = sum(self_us for self_us, _ in imports.values()) / 1000
+        heavy = sorted({ name.split(".")[0] for name in imports if name.split(".")[0] in HEAVY_MODULES })
+
+        ok = wall_ms < budget_ms and not heavy
+        passed = passed and ok
+        print(f"{'OK' if ok else 'FAIL'} {command}: {wall_ms:.0f} ms to run (budget {budget_ms:.0f} ms), {import_ms:.0f} ms of it importing {len(imports)} modules")
+        if heavy:
+            print(f"   Heavy modules imported: {', '.join(heavy)}")
+        slowest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        print(f"   Slowest imports: {', '.join(f'{name} {self_us / 1000:.1f} ms' for name, (self_us, _) in slowest)}")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check how quickly the deck_generator commands start.")
+    parser.add_argument("commands", nargs="*", help=f"Commands to time, any of {', '.join(COMMANDS)}. (Defaults to all)")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per command, the median is reported.")
+    parser.add_argument("--budget", type=float, default=BUDGET_MS, help="Maximum median start time in milliseconds.")
+    args = parser.parse_args()
+
+    unknown = [ command for command in args.commands if command not in COMMANDS ]
+    if unknown:
+        parser.error(f"Unknown commands: {', '.join(unknown)}")
+
+    commands = { command: COMMANDS[command] for command in (args.commands or COMMANDS.keys()) }
+    sys.exit(0 if benchmark(commands, args.runs, args.budget) else 1)
@@ -0,0 +1,48 @@
+import contextlib
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+# Tiny CPU stand-in for the fused StableDiffusionXLPipeline. It has the same call surface that avatar_generator_local uses
+# (encode_prompt and __call__ with prompt embeddings), draws a flat colour derived from the prompt, and records what it
+# was asked to do, so the generation loop can be checked without a GPU, a model download or torch.
+# Embeddings are numpy arrays, tensor_ops gives the generation loop the numpy versions of the torch calls it makes.
+
+
+class StubOutOfMemoryError(MemoryError):
+    # Stands in for torch.cuda.OutOfMemoryError
+    pass
+
+
+class StubPipeline:
+    tensor_ops = SimpleNamespace(cat=np.concatenate, no_grad=contextlib.nullcontext, OutOfMemoryError=StubOutOfMemoryError, empty_cache=lambda: None)
+
+    def __init__(self, oom_batch_size: int = None, embed_dim: int = 8):
+        # Batches larger than oom_batch_size raise StubOutOfMemoryError, like a GPU that is too small
+        self.oom_batch_size = oom_batch_size
+        self.embed_dim = embed_dim
+        self.encoded_prompts = []
+        self.batch_sizes = []
+
+    def encode_prompt(self, prompt: str, negative_prompt: str = None, num_images_per_prompt: int = 1, do_classifier_free_guidance: bool = True, **kwargs) -> tuple:
+        self.encoded_prompts.append(prompt)
+        value = float(zlib.crc32(prompt.encode()) % 256)
+        prompt_embeds = np.full((num_images_per_prompt, 77, self.embed_dim), value, dtype=np.float32)
+        pooled_prompt_embeds = np.full((num_images_per_prompt, self.embed_dim), value, dtype=np.float32)
+        negative_prompt_embeds = np.zeros((num_images_per_prompt, 77, self.embed_dim), dtype=np.float32)
+        negative_pooled_prompt_embeds = np.zeros((num_images_per_prompt, self.embed_dim), dtype=np.float32)
+        return prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds
+
+    def __call__(self, prompt_embeds=None, pooled_prompt_embeds=None, width: int = 1216, height: int = 832, **kwargs) -> SimpleNamespace:
+        batch_size = prompt_embeds.shape[0]
+        self.batch_sizes.append(batch_size)
+        if self.oom_batch_size is not None and batch_size > self.oom_batch_size:
+            raise StubOutOfMemoryError(f"Stub pipeline out of memory for batch size {batch_size}")
+
+        images = []
+        for i in range(batch_size):
+            value = int(pooled_prompt_embeds[i][0])
+            images.append(Image.new("RGB", (width, height), (value, 255 - value, (value * 7) % 256)))
+        return SimpleNamespace(images=images)
@@ -0,0 +1,61 @@
+import gc
+import os
+
+import pytest
+
+import avatar_generator_local
+from avatar_generator_local import encode_prompt, generate_images
+from stub_pipeline import StubOutOfMemoryError, StubPipeline
+
+# The generation loop of avatar_generator_local on the CPU stub pipeline, no GPU or torch needed
+
+
+def test_batches_are_shared_between_requests(tmp_path):
+    pipeline = StubPipeline()
+    saved = []
+    requests = [ ("goblin", "", "goblin.png", 3), ("troll", "", "troll.png", 2) ]
+    image_paths = generate_images(requests, str(tmp_path), pipeline, max_batch_size=2, on_image=lambda i, path: saved.append((i, path)))
+
+    assert pipeline.batch_sizes == [2, 2, 1]
+    assert [ len(paths) for paths in image_paths ] == [3, 2]
+    assert sorted(saved) == sorted((i, path) for i, paths in enumerate(image_paths) for path in paths)
+    assert all(os.path.isfile(path) for paths in image_paths for path in paths)
+    assert len({ path for paths in image_paths for path in paths }) == 5
+
+
+def test_out_of_memory_halves_the_batch(tmp_path):
+    pipeline = StubPipeline(oom_batch_size=1)
+    image_paths = generate_images([ ("goblin", "", "goblin.png", 4) ], str(tmp_path), pipeline, max_batch_size=4)
+
+    # 4 and 2 fail, then every image goes through on its own
+    assert pipeline.batch_sizes == [4, 2, 1, 1, 1, 1]
+    assert len(image_paths[0]) == 4
+
+
+def test_out_of_memory_at_batch_size_one_raises(tmp_path):
+    pipeline = StubPipeline(oom_batch_size=0)
+    with pytest.raises(StubOutOfMemoryError):
+        generate_images([ ("goblin", "", "goblin.png", 2) ], str(tmp_path), pipeline, max_batch_size=2)
+    assert pipeline.batch_sizes == [2, 1]
+
+
+def test_encode_prompt_is_cached_per_pipeline(tmp_path):
+    pipeline = StubPipeline()
+    first = encode_prompt(pipeline, "goblin", "blurry")
+    assert encode_prompt(pipeline, "goblin", "blurry") is first
+    generate_images([ ("goblin", "blurry", "goblin.png", 1) ], str(tmp_path), pipeline)
+    assert pipeline.encoded_prompts == ["goblin"]
+
+    # A different negative prompt or pipeline is encoded again
+    encode_prompt(pipeline, "goblin", "")
+    other = StubPipeline()
+    encode_prompt(other, "goblin", "blurry")
+    assert pipeline.encoded_prompts == ["goblin", "goblin"]
+    assert other.encoded_prompts == ["goblin"]
+
+    # Entries go away with their pipeline instead of being found by a new object at the same address
+    cached_pipelines = len(avatar_generator_local._prompt_embeds_cache)
+    del other
+    gc.collect()
+    assert len(avatar_generator_local._prompt_embeds_cache) == cached_pipelines - 1
+    assert pipeline in avatar_generator_local._prompt_embeds_cache
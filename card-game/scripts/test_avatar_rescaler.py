@@ -0,0 +1,32 @@
+import os
+
+from PIL import Image
+
+from avatar_rescaler import get_avatar_path, load_manifest, rescale_avatars, save_manifest
+
+# Incremental rescaling of raw avatar images
+
+
+def test_missing_raw_dir(tmp_path):
+    assert rescale_avatars(str(tmp_path / "raw"), str(tmp_path / "avatars")) == []
+
+
+def test_manifest_forgets_deleted_raw_images(tmp_path):
+    raw_dir = tmp_path / "raw"
+    output_dir = tmp_path / "avatars"
+    raw_dir.mkdir()
+    for name, color in [ ("goblin_0.png", (200, 40, 40)), ("troll_0.png", (40, 200, 40)) ]:
+        Image.new("RGB", (180, 120), color).save(raw_dir / name)
+
+    rescaled = rescale_avatars(str(raw_dir), str(output_dir), workers=1, cache=False)
+    assert sorted(rescaled) == sorted(get_avatar_path(str(raw_dir / name), str(output_dir)) for name in ["goblin_0.png", "troll_0.png"])
+    assert sorted(load_manifest(str(raw_dir))) == ["goblin_0.png", "troll_0.png"]
+
+    os.remove(raw_dir / "troll_0.png")
+    manifest = load_manifest(str(raw_dir))
+    manifest["renamed_0.png"] = manifest["goblin_0.png"]
+    save_manifest(str(raw_dir), manifest)
+
+    # Nothing changed for the goblin, so it is skipped, and the records without a raw image are dropped
+    assert rescale_avatars(str(raw_dir), str(output_dir), workers=1, cache=False) == []
+    assert sorted(load_manifest(str(raw_dir))) == ["goblin_0.png"]
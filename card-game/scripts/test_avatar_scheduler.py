@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+
+import pytest
+
+import deck_generator
+from avatar_scheduler import schedule_avatars
+from card_database import CardDatabase, generate_synthetic_data
+from stub_pipeline import StubPipeline
+
+# The diffusion/downscale scheduler end to end on the CPU stub pipeline
+
+
+@pytest.fixture
+def deck(tmp_path, monkeypatch):
+    # Deck data, journal and avatar folders of deck_generator moved into tmp_path
+    raw_dir = tmp_path / "raw"
+    avatar_dir = tmp_path / "avatars"
+    raw_dir.mkdir()
+    avatar_dir.mkdir()
+    monkeypatch.setattr(deck_generator, "raw_img_path", str(raw_dir) + "/")
+    monkeypatch.setattr(deck_generator, "avatar_img_path", str(avatar_dir) + "/")
+    monkeypatch.setattr(deck_generator, "journal_path", str(tmp_path / "cards.data.journal"))
+    return CardDatabase(str(tmp_path / "cards.data.json"), generate_synthetic_data(3, 2, avatars_per_noun=0))
+
+
+def test_every_avatar_is_committed(deck):
+    deck_generator.generate_avatars(deck, list(deck.nouns), 2, StubPipeline(), workers=2, max_batch_size=3, use_server=False)
+
+    journal = deck_generator.read_journal()
+    for noun in deck.nouns:
+        avatars = deck.avatars(noun)
+        assert len(avatars) == 2
+        for avatar in avatars:
+            assert os.path.isfile(os.path.join(deck_generator.avatar_img_path, avatar[len(deck_generator.godot_avatar_img_path):]))
+        assert sorted(entry["avatar"] for entry in journal if entry["noun"] == noun and "avatar" in entry) == sorted(avatars)
+    # Every raw image was journaled before its avatar
+    assert not deck_generator.get_unformatted(journal)
+    assert sum(1 for entry in journal if "avatar" not in entry) == 6
+
+
+class FailingPipeline(StubPipeline):
+    def __call__(self, **kwargs):
+        if len(self.batch_sizes) >= 1:
+            self.batch_sizes.append(0)
+            raise RuntimeError("diffusion failed")
+        return super().__call__(**kwargs)
+
+
+def test_producer_error_shuts_the_pool_down(tmp_path):
+    avatars = []
+    with pytest.raises(RuntimeError, match="diffusion failed"):
+        schedule_avatars({ "Goblin": 2, "Troll": 2 }, str(tmp_path / "raw"), str(tmp_path), lambda *args: avatars.append(args),
+                         pipeline=FailingPipeline(), workers=2, max_batch_size=2, use_server=False)
+
+    # The first batch was still downscaled and handed over, and no worker process is left behind
+    assert len(avatars) == 2
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+import avatar_server
+from avatar_server import TOKEN_HEADER, AvatarServer
+from stub_pipeline import StubPipeline
+
+# avatar_server with the CPU stub pipeline on a free localhost port
+
+
+@pytest.fixture
+def server():
+    server = AvatarServer(("127.0.0.1", 0), StubPipeline(), avatar_server.write_token())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield SimpleNamespace(server=server, thread=thread, url=f"http://127.0.0.1:{server.server_address[1]}")
+    # Returns straight away if the test already stopped it
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def post(url: str, data: bytes, headers: dict) -> int:
+    request = urllib.request.Request(url, data=data, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_generate_round_trip(server, tmp_path):
+    url = server.url
+    assert avatar_server.is_running(url)
+
+    streamed = []
+    image_paths = avatar_server.generate_pixel_art_avatars({ "Goblin": 2, "Troll": 1 }, str(tmp_path), on_image=lambda creature, path: streamed.append((creature, path)), max_batch_size=2, url=url)
+
+    assert [ len(image_paths["Goblin"]), len(image_paths["Troll"]) ] == [2, 1]
+    assert sorted(streamed) == sorted((creature, path) for creature, paths in image_paths.items() for path in paths)
+    assert all(os.path.isfile(path) for paths in image_paths.values() for path in paths)
+    status = avatar_server.get_status(url)
+    assert (status["pipeline"], status["jobs"], status["images"]) == ("StubPipeline", 1, 3)
+
+
+@pytest.mark.parametrize("path", ["/generate", "/shutdown"])
+def test_requests_are_refused(server, path):
+    url = server.url
+    job = json.dumps({ "creatures": { "Goblin": 1 }, "output_dir": "." }).encode()
+    json_type = { "Content-Type": "application/json" }
+
+    assert post(url + path, job, json_type) == 403
+    assert post(url + path, job, dict(json_type, **{ TOKEN_HEADER: "wrong" })) == 403
+    assert post(url + path, job, dict(avatar_server.get_headers(), Origin="http://example.com")) == 403
+    assert post(url + path, job, dict(avatar_server.get_headers(), **{ "Content-Type": "text/plain" })) == 415
+
+    # None of them got through to the pipeline or stopped the server
+    assert server.server.pipeline.batch_sizes == []
+    assert avatar_server.is_running(url)
+
+
+def test_stop_server(server):
+    avatar_server.stop_server(server.url)
+    server.thread.join(5)
+    assert not server.thread.is_alive()
+    assert not avatar_server.is_running(server.url)
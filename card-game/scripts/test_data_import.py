@@ -0,0 +1,29 @@
+from card_database import CardDatabase
+from data_import import import_values
+from deck_generator import add_data
+from name_generator import merge_lists
+
+# Every way of adding names matches existing ones the same way, ignoring case and extra whitespace
+
+
+def make_db() -> CardDatabase:
+    return CardDatabase(None, { "starting_deck": {}, "stats": {}, "nouns": { "Goblin": { "level": 1 } }, "adjectives": {} })
+
+
+def test_add_data_matches_existing_names():
+    db = make_db()
+    add_data(db, "nouns", ["goblin", "  GOBLIN ", "Cave  Troll", "cave troll"], 2, overwrite=True)
+    assert db.nouns == { "Goblin": { "level": 2 }, "Cave Troll": { "level": 2 } }
+    assert db.find("nouns", "CAVE TROLL") == "Cave Troll"
+
+
+def test_import_and_add_data_agree(tmp_path):
+    path = tmp_path / "nouns.txt"
+    path.write_text("goblin\nCave Troll\ncave  troll\n")
+    db = make_db()
+    stats = import_values(db, "nouns", str(path), level=3)
+    assert (stats["added"], stats["existing"], stats["duplicates"]) == (1, 1, 1)
+
+    # A later list from the name generator with other spellings adds nothing new
+    merge_lists(db, { "nouns": { "Common": ["GOBLIN", "cave troll", "Imp"] } }, levels=["Common"])
+    assert list(db.nouns) == ["Goblin", "Cave Troll", "Imp"]
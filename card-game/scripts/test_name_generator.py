@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+
+import name_generator
+from card_database import CardDatabase
+from mock_openai_server import MockOpenAIServer
+
+# The async name generator against an in-process mock of the OpenAI API
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    server = MockOpenAIServer(("127.0.0.1", 0), delay=0.05, rate_limit_every=3, list_length=3)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def test_generate_lists_async(server, monkeypatch):
+    # Every request goes to the server, whatever CARD_GAME_REQUEST_CACHE says
+    monkeypatch.setattr(name_generator.request_cache, "MODE", "refresh")
+    levels = name_generator.LEVELS[:3]
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    data = asyncio.run(name_generator.generate_lists_async(levels=levels, concurrency=2, history="none", base_url=base_url))
+
+    stats = server.stats
+    assert stats["max_in_flight"] <= 2
+    # Every third request was rate limited and retried until all 6 lists came back
+    assert stats["rate_limited"] >= 1
+    assert stats["requests"] == 6 + stats["rate_limited"]
+    assert stats["in_flight"] == 0
+
+    db = CardDatabase(None, { "starting_deck": {}, "stats": {}, "nouns": {}, "adjectives": {} })
+    name_generator.merge_lists(db, data, levels)
+    assert db.levels("nouns") == { level: [ f"{name.split()[0].capitalize()} Noun {i}" for i in range(3) ] for level, name in enumerate(levels) }
+    assert len(db.adjectives) == 9
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from pixel_scaler import kCentroid, kCentroid_numpy
+
+# Pixel parity of the batched kCentroid engine with the reference PIL loop, on seeded synthetic images.
+# Run with `python -m pytest` from this folder.
+
+
+def make_image(width: int, height: int, seed: int) -> Image:
+    # Flat color blocks with noise on top, so tiles range from single color to busy
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, size=(height // 16 + 1, width // 16 + 1, 3))
+    pixels = np.repeat(np.repeat(blocks, 16, axis=0), 16, axis=1)[:height, :width]
+    noise = rng.normal(0, 10, size=pixels.shape) * (rng.random((height, width, 1)) < 0.5)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8), "RGB")
+
+
+@pytest.mark.parametrize("image_size, output_size, seed", [
+    # Whole number factors
+    ((180, 120), (90, 60), 0),
+    ((360, 240), (45, 30), 1),
+    # wFactor and hFactor that are not whole numbers, so tiles come in several sizes
+    ((304, 208), (90, 60), 2),
+    ((250, 170), (37, 23), 3),
+    ((1216, 832), (90, 60), 4),
+])
+def test_kcentroid_numpy_matches_reference(image_size, output_size, seed):
+    image = make_image(*image_size, seed)
+    reference = np.asarray(kCentroid(image, *output_size, 2))
+    candidate = np.asarray(kCentroid_numpy(image, *output_size, 2))
+    assert candidate.shape == reference.shape
+    assert np.array_equal(candidate, reference)
+
+
+def test_kcentroid_numpy_single_color_tiles():
+    image = Image.new("RGB", (100, 70), (12, 200, 99))
+    assert np.array_equal(np.asarray(kCentroid_numpy(image, 9, 7, 2)), np.asarray(kCentroid(image, 9, 7, 2)))
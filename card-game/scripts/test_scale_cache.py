@@ -0,0 +1,61 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import scale_cache
+
+# Lookups in the scale_image cache are read only, their counts and access times are written in batches
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(scale_cache, "CACHE_DIR", str(tmp_path))
+    scale_cache.flush()
+    yield
+    scale_cache._pending.update(hits=0, misses=0, access={})
+
+
+def lookup(keys: list[str]) -> int:
+    return sum(scale_cache.get(key) is not None for key in keys)
+
+
+def test_lookups_are_counted_without_writing_each_one():
+    scale_cache.put("a", b"image a")
+    assert scale_cache.get("a") == b"image a"
+    assert scale_cache.get("b") is None
+    assert scale_cache._pending["hits"] == 1 and scale_cache._pending["misses"] == 1
+
+    info = scale_cache.stats()
+    assert (info["hits"], info["misses"]) == (1, 1)
+    assert scale_cache._pending == { "hits": 0, "misses": 0, "access": {} }
+
+
+def test_pending_lookups_flush_in_batches(monkeypatch):
+    monkeypatch.setattr(scale_cache, "FLUSH_EVERY", 3)
+    scale_cache.put("a", b"image a")
+    for _ in range(4):
+        scale_cache.get("a")
+    assert scale_cache._pending["hits"] == 1
+    assert scale_cache.stats()["hits"] == 4
+
+
+def test_hits_keep_entries_from_eviction():
+    scale_cache.put("old", b"x" * 10)
+    scale_cache.put("new", b"x" * 10)
+    scale_cache.get("old")
+    # The hit is still pending when the next put evicts, and must count as the most recent access
+    scale_cache.put("newest", b"x" * 10, max_bytes=20)
+    assert scale_cache.get("old") is not None
+    assert scale_cache.get("new") is None
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs forked workers to share the test's cache directory")
+def test_worker_lookups_are_flushed_when_the_worker_exits():
+    scale_cache.put("a", b"image a")
+    scale_cache.get("a")
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as executor:
+        assert executor.submit(lookup, ["a", "a", "b"]).result() == 2
+    # The parent's own pending hit isn't counted twice by the forked worker
+    info = scale_cache.stats()
+    assert (info["hits"], info["misses"]) == (3, 1)
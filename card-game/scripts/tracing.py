@@ -0,0 +1,130 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Timed spans for the generator scripts, off unless a script is run with --trace. Spans are appended to a JSONL file
+# as they finish, one line each: { "name", "start" (epoch seconds), "duration" (seconds), "pid", "tid", "args" }.
+# Worker processes started after enable() find the file through TRACE_ENV and append to it too, so a run with worker
+# processes still ends up in one file. At exit the main process prints the count, total, p50 and p95 of every span
+# name, and converts the file to a Chrome trace (chrome://tracing, Perfetto) if the --trace path ends in .json.
+
+TRACE_ENV = "CARD_GAME_TRACE_FILE"
+
+_fd = None
+_lock = threading.Lock()
+
+
+def enable(path: str) -> None:
+    # path ending in .json writes a Chrome trace, anything else JSONL
+    global _fd
+    events_path = path if not path.endswith(".json") else f"{path}.{os.getpid()}.jsonl.tmp"
+    if os.path.exists(events_path):
+        os.remove(events_path)
+    os.environ[TRACE_ENV] = os.path.abspath(events_path)
+    _fd = os.open(events_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    atexit.register(finish, path, events_path)
+
+
+def enabled() -> bool:
+    return _fd is not None
+
+
+def _open_from_env() -> None:
+    # Worker processes: append to the file the main process opened
+    global _fd
+    path = os.environ.get(TRACE_ENV)
+    if path and _fd is None:
+        _fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+
+
+def record(name: str, start: float, duration: float, **args) -> None:
+    if _fd is None:
+        return
+    line = json.dumps({ "name": name, "start": start, "duration": duration, "pid": os.getpid(), "tid": threading.get_ident(), "args": args }, default=str) + "\n"
+    # One write per line on an O_APPEND file, so lines from threads and processes don't interleave
+    with _lock:
+        os.write(_fd, line.encode())
+
+
+@contextmanager
+def span(name: str, **args):
+    if _fd is None:
+        yield
+        return
+    start = time.time()
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, start, time.perf_counter() - begin, **args)
+
+
+def traced(name: str):
+    # Decorator form of span
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_events(path: str) -> list[dict]:
+    with open(path, "r") as file:
+        return [ json.loads(line) for line in file if line.strip() ]
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    # Nearest rank on sorted values
+    return values[min(len(values) - 1, max(0, round(fraction * len(values) + 0.5) - 1))]
+
+
+def summarize(events: list[dict]) -> list[tuple]:
+    # (name, count, total, p50, p95) in seconds, largest total first
+    durations = {}
+    for event in events:
+        durations.setdefault(event["name"], []).append(event["duration"])
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append((name, len(values), sum(values), percentile(values, 0.50), percentile(values, 0.95)))
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+def print_summary(events: list[dict]) -> None:
+    if not events:
+        print("Trace: no spans recorded")
+        return
+    wall = max(e["start"] + e["duration"] for e in events) - min(e["start"] for e in events)
+    print(f"Trace: {len(events)} spans over {wall:.1f} seconds")
+    print(f"   {'span':<28} {'count':>7} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, count, total, p50, p95 in summarize(events):
+        print(f"   {name:<28} {count:>7} {total:>9.2f} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f}")
+
+
+def to_chrome_trace(events: list[dict]) -> dict:
+    # Complete ("X") events in microseconds
+    return { "traceEvents": [ { "name": e["name"], "ph": "X", "ts": round(e["start"] * 1e6), "dur": round(e["duration"] * 1e6), "pid": e["pid"], "tid": e["tid"], "args": e["args"] } for e in events ], "displayTimeUnit": "ms" }
+
+
+def finish(path: str, events_path: str) -> None:
+    global _fd
+    if _fd is None:
+        return
+    os.close(_fd)
+    _fd = None
+    events = read_events(events_path)
+    print_summary(events)
+    if events_path != path:
+        with open(path, "w") as file:
+            file.write(json.dumps(to_chrome_trace(events)))
+        os.remove(events_path)
+    print(f"   Saved {path}")
+
+
+_open_from_env()